@@ -3,7 +3,10 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from posts.models import Post, Comment
+from posts.services import PostCounterService
+from messaging.services import ConversationService
 from interactions.models import Like, Notification
+from interactions.counters import UnreadCounterService
 from messaging.models import Message, GroupChat, GroupMessage
 from faker import Faker
 import random
@@ -61,6 +64,11 @@ class Command(BaseCommand):
         
         # 9. 创建通知
         notifications = self.create_notifications(users, posts, comments, likes)
+
+        # 10. 直接创建的数据不会更新冗余计数、会话表和未读数缓存，统一重算一次
+        PostCounterService.reconcile()
+        ConversationService.rebuild()
+        UnreadCounterService.reconcile()
         
         self.stdout.write(
             self.style.SUCCESS(
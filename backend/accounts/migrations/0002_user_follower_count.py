@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-17 18:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_follower_count(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    Follow = User.following.through
+    counts = (
+        Follow.objects.values("to_user_id")
+        .annotate(count=Count("id"))
+        .values_list("to_user_id", "count")
+    )
+    for user_id, count in counts:
+        User.objects.filter(pk=user_id).update(follower_count=count)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="follower_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_follower_count, migrations.RunPython.noop),
+    ]
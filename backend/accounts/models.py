@@ -7,6 +7,8 @@ class User(AbstractUser):
     birth_date=models.DateField(null=True,blank=True)
     avatar=models.ImageField(null=True,blank=True,upload_to='avatars/')
     following=models.ManyToManyField('self',related_name='followers',blank=True,symmetrical=False)
+    # 粉丝数，由 accounts.signals 在关注关系变化时维护，关注流按它判断高粉作者
+    follower_count=models.PositiveIntegerField(default=0)
     
     USERNAME_FIELD='email'
     REQUIRED_FIELDS=['username']
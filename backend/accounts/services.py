@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import User
+
+
+class FollowerService:
+    """
+    缓存中的粉丝ID列表
+
+    WebSocket 上下线广播需要每个用户的粉丝，连接风暴时直接查库压力很大。
+    关注关系变化时由 accounts.signals 在事务提交后删除缓存，缓存同时设置了过期时间。
+    """
+
+    @staticmethod
+    def key(user_id):
+        return f"followers:{user_id}"
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, "FOLLOWER_CACHE_TIMEOUT", 3600)
+
+    @staticmethod
+    def follower_ids(user_id):
+        key = FollowerService.key(user_id)
+        follower_ids = cache.get(key)
+        if follower_ids is None:
+            follower_ids = list(
+                User.following.through.objects.filter(to_user_id=user_id).values_list(
+                    "from_user_id", flat=True
+                )
+            )
+            cache.add(key, follower_ids, FollowerService.timeout())
+        return follower_ids
+
+    @staticmethod
+    def invalidate(user_ids):
+        keys = [FollowerService.key(user_id) for user_id in user_ids]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @staticmethod
+    def change_counts(deltas):
+        """
+        按 {用户ID: 变化量} 更新粉丝数，返回 {用户ID: (原粉丝数, 新粉丝数)}
+
+        用 F() 增减而不是重新统计，并发关注同一个人时不会互相覆盖。
+        """
+        deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+        for user_id, delta in deltas.items():
+            User.objects.filter(pk=user_id).update(follower_count=F("follower_count") + delta)
+        counts = User.objects.filter(pk__in=deltas).values_list("id", "follower_count")
+        return {user_id: (count - deltas[user_id], count) for user_id, count in counts}
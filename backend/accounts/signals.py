@@ -0,0 +1,62 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from posts import tasks as timeline_tasks
+from posts.timeline import TimelineService
+from .models import User
+from .services import FollowerService
+
+Follow = User.following.through
+
+
+def existing_follows(instance, reverse, pk_set):
+    """即将被删除、实际存在的关注关系，返回 [(粉丝ID, 被关注者ID)]"""
+    if reverse:
+        follows = Follow.objects.filter(to_user_id=instance.pk)
+        if pk_set is not None:
+            follows = follows.filter(from_user_id__in=pk_set)
+    else:
+        follows = Follow.objects.filter(from_user_id=instance.pk)
+        if pk_set is not None:
+            follows = follows.filter(to_user_id__in=pk_set)
+    return list(follows.values_list("from_user_id", "to_user_id"))
+
+
+def update_follower_counts(followee_ids, delta):
+    deltas = {}
+    for followee_id in followee_ids:
+        deltas[followee_id] = deltas.get(followee_id, 0) + delta
+    changes = FollowerService.change_counts(deltas)
+    if not TimelineService.enabled():
+        return
+    for user_id, (old, new) in changes.items():
+        # 作者降到阈值以下后改为推送，超过阈值期间没有推送的帖子要补进粉丝的关注流
+        if TimelineService.dropped_below_threshold(old, new):
+            timeline_tasks.backfill_followers.delay(user_id)
+
+
+@receiver(m2m_changed, sender=Follow)
+def following_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """关注或取消关注后清除被关注者的粉丝缓存并更新粉丝数"""
+    if action in ("pre_remove", "pre_clear"):
+        # 删除之后就查不到被删除的关系了，先记下来
+        instance._removed_follows = existing_follows(
+            instance, reverse, pk_set if action == "pre_remove" else None
+        )
+        return
+    if action == "post_add":
+        follows = (
+            [(user_id, instance.pk) for user_id in pk_set]
+            if reverse
+            else [(instance.pk, user_id) for user_id in pk_set]
+        )
+        delta = 1
+    elif action in ("post_remove", "post_clear"):
+        follows = getattr(instance, "_removed_follows", [])
+        instance._removed_follows = []
+        delta = -1
+    else:
+        return
+    followee_ids = [followee_id for _, followee_id in follows]
+    FollowerService.invalidate(set(followee_ids))
+    update_follower_counts(followee_ids, delta)
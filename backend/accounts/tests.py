@@ -1,3 +1,36 @@
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from .models import User
+from .services import FollowerService
+
+
+class FollowerCacheTests(TestCase):
+    """粉丝列表从缓存读取，关注关系变化后失效"""
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com", password="password"
+            )
+            for i in range(3)
+        ]
+
+    def test_cache_follows_changes(self):
+        target = self.users[0]
+        self.assertEqual(FollowerService.follower_ids(target.id), [])
+        with self.assertNumQueries(0):
+            FollowerService.follower_ids(target.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[1].following.add(target)
+            target.followers.add(self.users[2])
+        self.assertEqual(
+            sorted(FollowerService.follower_ids(target.id)),
+            [self.users[1].id, self.users[2].id],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[1].following.clear()
+        self.assertEqual(FollowerService.follower_ids(target.id), [self.users[2].id])
@@ -21,6 +21,7 @@ from posts.serializers import PostSerializer # 修正拼写
 # --- 修改结束 ---
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.db import transaction
 from django.db.models import Q
 from django.conf import settings
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -28,7 +29,11 @@ from django.shortcuts import get_object_or_404
 from rest_framework.pagination import PageNumberPagination
 from posts.models import Post
 from interactions.models import Notification
-from interactions.services import NotificationService
+from interactions.tasks import create_follow_notification
+from posts import tasks as timeline_tasks
+from posts.timeline import TimelineService
+from posts.search import get_search_backend
+from myproject.pagination import get_page_params
 from rest_framework import filters
 from rest_framework.permissions import IsAuthenticated
 
@@ -128,8 +133,11 @@ class FollowView(APIView):
                     {"error": "You cannot follow yourself"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            request.user.following.add(user_to_follow)
-            NotificationService.create_follow_notification(request.user, user_to_follow)
+            with transaction.atomic():
+                request.user.following.add(user_to_follow)
+                if TimelineService.enabled():
+                    timeline_tasks.backfill.delay(request.user.id, user_to_follow.id)
+                create_follow_notification.delay(request.user.id, user_to_follow.id)
             return Response(
                 {"message": f"You are now following {user_to_follow.username}"}
             )
@@ -144,7 +152,10 @@ class UnFollowView(APIView):
     def post(self, request, pk):
         try:
             user_to_unfollow = User.objects.get(pk=pk)
-            request.user.following.remove(user_to_unfollow)
+            with transaction.atomic():
+                request.user.following.remove(user_to_unfollow)
+                if TimelineService.enabled():
+                    timeline_tasks.remove.delay(request.user.id, user_to_unfollow.id)
             return Response(
                 {"message": f"You are no longer following {user_to_unfollow.username}"}
             )
@@ -197,11 +208,19 @@ class UserSearchView(generics.ListAPIView):
     serializer_class = UserSerializer
     # --- 修改结束 ---
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['username', 'email', 'bio']
 
-    def get_queryset(self):
-        return User.objects.exclude(id=self.request.user.id)
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get("search", "").strip()
+        if not query:
+            return Response([])
+        # 按相关度排序，page / page_size 分页
+        page, page_size = get_page_params(request)
+        user_ids = get_search_backend().search_users(
+            query, (page - 1) * page_size, page_size, exclude_id=request.user.id
+        )
+        users = User.objects.in_bulk(user_ids)
+        serializer = self.get_serializer([users[pk] for pk in user_ids if pk in users], many=True)
+        return Response(serializer.data)
 
 
 @api_view(["GET"])
@@ -0,0 +1,18 @@
+from tasks.queue import task
+from .services import DeepSeekService
+
+
+# 接口调用失败时 DeepSeekService 返回 status=error 的结果而不是抛异常，这里不做重试。
+# 调用耗时较长，放在单独的 ai 队列，不在数据库事务中等待接口返回
+@task(max_attempts=1, queue="ai", atomic=False)
+def chat_completion(messages, model="deepseek-chat", temperature=None, max_tokens=2048):
+    return DeepSeekService().chat_completion(
+        messages, model=model, temperature=temperature, max_tokens=max_tokens
+    )
+
+
+@task(max_attempts=1, queue="ai", atomic=False)
+def generate_text(prompt, model="deepseek-chat", temperature=0.7, max_tokens=2048):
+    return DeepSeekService().generate_text(
+        prompt=prompt, model=model, temperature=temperature, max_tokens=max_tokens
+    )
@@ -2,15 +2,16 @@ from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import AllowAny
-from .services import DeepSeekService
+from rest_framework.permissions import IsAuthenticated
+from tasks.serializers import TaskSerializer
+from .tasks import chat_completion, generate_text
 
 
 # Create your views here.
 class DeepSeekChatView(APIView):
     """调用DeepSeek模型进行对话"""
 
-    permission_classes = [AllowAny]
+    permission_classes = [IsAuthenticated]
 
     def post(self, request):
         messages = request.data.get("messages", [])
@@ -22,21 +23,18 @@ class DeepSeekChatView(APIView):
         temperature = request.data.get("temperature")
         max_tokens = request.data.get("max_tokens", 2048)
 
-        deepseek_service = DeepSeekService()
-        result = deepseek_service.chat_completion(
+        # 模型调用耗时较长，交给后台任务执行，客户端通过 /api/tasks/<id>/ 查询结果
+        task = chat_completion.delay_for(
+            request.user,
             messages, model=model, temperature=temperature, max_tokens=max_tokens
         )
-
-        if result["status"] == "success":
-            return Response(result, status=status.HTTP_200_OK)
-        else:
-            return Response(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(TaskSerializer(task).data, status=status.HTTP_202_ACCEPTED)
 
 
 class DeepSeekGenerateTextView(APIView):
     """使用DeepSeek生成文本"""
 
-    permission_classes = [AllowAny]
+    permission_classes = [IsAuthenticated]
 
     def post(self, request):
         prompt = request.data.get("prompt", "")
@@ -49,11 +47,8 @@ class DeepSeekGenerateTextView(APIView):
             )
         temperature = request.data.get("temperature", 0.7)
         max_tokens = request.data.get("max_tokens", 2048)
-        deepseek_service = DeepSeekService()
-        result = deepseek_service.generate_text(
-            prompt=prompt, model=model, temperature=temperature, max_tokens=max_tokens
+        task = generate_text.delay_for(
+            request.user,
+            prompt, model=model, temperature=temperature, max_tokens=max_tokens
         )
-        if result["status"] == "success":
-            return Response(result, status=status.HTTP_200_OK)
-        else:
-            return Response(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(TaskSerializer(task).data, status=status.HTTP_202_ACCEPTED)
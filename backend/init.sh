@@ -77,6 +77,17 @@ else
     echo "No initial data file found. Continuing..."
 fi
 
+# 首次部署时根据历史消息生成会话表
+python manage.py rebuild_conversations --if-empty
+
+# 补写上次退出时还在缓冲中的群聊消息
+python manage.py recover_group_messages
+
+# 启动后台任务 worker：通知等短任务和调用 AI 接口的长任务分开执行
+echo "Starting task workers..."
+python manage.py run_tasks --queue default &
+python manage.py run_tasks --queue ai &
+
 # 启动服务器
 echo "Starting server..."
 exec daphne -b 0.0.0.0 -p 8000 myproject.asgi:application
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Like, Notification
+from .models import ArchivedNotification, Like, Notification
 
 
 @admin.register(Like)
@@ -18,13 +18,14 @@ class NotificationAdmin(admin.ModelAdmin):
         "recipient",
         "actor",
         "notification_type",
+        "actor_count",
         "is_read",
-        "created_at",
+        "updated_at",
         "content_preview",
     )
     list_filter = ("notification_type", "is_read", "created_at")
     search_fields = ("recipient__username", "actor__username", "comment")
-    readonly_fields = ("created_at",)
+    readonly_fields = ("created_at", "updated_at", "group_key", "actor_count", "recent_actors")
     date_hierarchy = "created_at"
     list_editable = ("is_read",)
     raw_id_fields = ("recipient", "actor", "post")
@@ -35,3 +36,12 @@ class NotificationAdmin(admin.ModelAdmin):
         return "No content"
 
     content_preview.short_description = "Comment Preview"
+
+
+@admin.register(ArchivedNotification)
+class ArchivedNotificationAdmin(admin.ModelAdmin):
+    list_display = ("recipient", "notification_type", "actor_count", "is_read", "updated_at")
+    list_filter = ("notification_type", "is_read")
+    search_fields = ("recipient__username",)
+    date_hierarchy = "updated_at"
+    raw_id_fields = ("recipient",)
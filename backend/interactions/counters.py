@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from messaging.models import ConversationMember
+from .models import Notification
+
+User = get_user_model()
+
+
+class UnreadCounterService:
+    """
+    缓存中的未读数
+
+    角标轮询只读缓存，缓存缺失时才回源统计。通知未读数在创建、已读时增减，
+    私信未读数由 ConversationMember.unread_count 汇总，变化时直接删除缓存。
+    所有写操作都在事务提交后执行，避免并发读把未提交的旧值写回缓存。
+    缓存设置了过期时间，另有 reconcile_unread_counters 命令做全量校准。
+    """
+
+    NOTIFICATIONS = "notifications"
+    MESSAGES = "messages"
+
+    @staticmethod
+    def key(kind, user_id):
+        return f"unread:{kind}:{user_id}"
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, "UNREAD_COUNTER_TIMEOUT", 3600)
+
+    @staticmethod
+    def count_notifications(user_id):
+        return Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+
+    @staticmethod
+    def count_messages(user_id):
+        total = ConversationMember.objects.filter(user_id=user_id).aggregate(
+            total=Sum("unread_count")
+        )["total"]
+        return total or 0
+
+    @staticmethod
+    def _get(kind, user_id, compute):
+        key = UnreadCounterService.key(kind, user_id)
+        value = cache.get(key)
+        if value is None:
+            value = compute(user_id)
+            # add 不会覆盖其他请求在此期间写入的值
+            cache.add(key, value, UnreadCounterService.timeout())
+        return value
+
+    @staticmethod
+    def notifications(user_id):
+        return UnreadCounterService._get(
+            UnreadCounterService.NOTIFICATIONS,
+            user_id,
+            UnreadCounterService.count_notifications,
+        )
+
+    @staticmethod
+    def messages(user_id):
+        return UnreadCounterService._get(
+            UnreadCounterService.MESSAGES, user_id, UnreadCounterService.count_messages
+        )
+
+    @staticmethod
+    def _incr(key, delta):
+        try:
+            value = cache.incr(key, delta)
+        except ValueError:
+            # 缓存中没有这个计数，下次读取时会重新统计
+            return
+        if value < 0:
+            cache.delete(key)
+
+    @staticmethod
+    def notification_created(user_id):
+        key = UnreadCounterService.key(UnreadCounterService.NOTIFICATIONS, user_id)
+        transaction.on_commit(lambda: UnreadCounterService._incr(key, 1))
+
+    @staticmethod
+    def notification_read(user_id):
+        key = UnreadCounterService.key(UnreadCounterService.NOTIFICATIONS, user_id)
+        transaction.on_commit(lambda: UnreadCounterService._incr(key, -1))
+
+    @staticmethod
+    def notifications_cleared(user_id):
+        key = UnreadCounterService.key(UnreadCounterService.NOTIFICATIONS, user_id)
+        transaction.on_commit(lambda: cache.set(key, 0, UnreadCounterService.timeout()))
+
+    @staticmethod
+    def notifications_changed(user_ids):
+        keys = [
+            UnreadCounterService.key(UnreadCounterService.NOTIFICATIONS, user_id)
+            for user_id in user_ids
+        ]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @staticmethod
+    def messages_changed(user_ids):
+        keys = [
+            UnreadCounterService.key(UnreadCounterService.MESSAGES, user_id)
+            for user_id in user_ids
+        ]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @staticmethod
+    def reconcile(batch_size=1000):
+        """按数据库重新统计所有用户的未读数并写入缓存"""
+        notifications = dict(
+            Notification.objects.filter(is_read=False)
+            .values("recipient_id")
+            .annotate(count=Count("id"))
+            .values_list("recipient_id", "count")
+        )
+        messages = dict(
+            ConversationMember.objects.filter(unread_count__gt=0)
+            .values("user_id")
+            .annotate(total=Sum("unread_count"))
+            .values_list("user_id", "total")
+        )
+        user_ids = list(User.objects.values_list("id", flat=True))
+        timeout = UnreadCounterService.timeout()
+        for start in range(0, len(user_ids), batch_size):
+            values = {}
+            for user_id in user_ids[start : start + batch_size]:
+                values[
+                    UnreadCounterService.key(UnreadCounterService.NOTIFICATIONS, user_id)
+                ] = notifications.get(user_id, 0)
+                values[
+                    UnreadCounterService.key(UnreadCounterService.MESSAGES, user_id)
+                ] = messages.get(user_id, 0)
+            cache.set_many(values, timeout)
+        return len(user_ids)
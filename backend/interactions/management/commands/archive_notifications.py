@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from interactions.services import NotificationService
+
+
+class Command(BaseCommand):
+    help = '把超过保留天数的通知迁移到归档表，可由定时任务每天执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='保留天数，默认使用 NOTIFICATION_RETENTION_DAYS')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每个事务迁移的条数')
+
+    def handle(self, *args, **options):
+        count = NotificationService.archive(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'已归档 {count} 条通知'))
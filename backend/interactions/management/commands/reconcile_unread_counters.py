@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from interactions.counters import UnreadCounterService
+
+
+class Command(BaseCommand):
+    help = '按数据库重新统计所有用户的通知和私信未读数并写入缓存，可由定时任务周期执行'
+
+    def handle(self, *args, **options):
+        count = UnreadCounterService.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'已校准 {count} 个用户的未读数'))
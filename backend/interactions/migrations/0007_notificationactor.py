@@ -0,0 +1,67 @@
+# Generated by Django 4.2.5 on 2026-10-17 20:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_actors(apps, schema_editor):
+    """已有的聚合通知只知道 actor 和 recent_actors 中的用户"""
+    Notification = apps.get_model("interactions", "Notification")
+    NotificationActor = apps.get_model("interactions", "NotificationActor")
+    rows = []
+    for notification in Notification.objects.only("id", "actor_id", "recent_actors").iterator():
+        actor_ids = {notification.actor_id}
+        actor_ids.update(item["id"] for item in notification.recent_actors or [])
+        rows += [
+            NotificationActor(notification_id=notification.id, actor_id=actor_id)
+            for actor_id in actor_ids
+        ]
+        if len(rows) >= 1000:
+            NotificationActor.objects.bulk_create(rows, ignore_conflicts=True)
+            rows = []
+    NotificationActor.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("interactions", "0006_archivednotification"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationActor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "actor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="actors",
+                        to="interactions.notification",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="notificationactor",
+            constraint=models.UniqueConstraint(
+                fields=("notification", "actor"), name="notif_actor_uniq"
+            ),
+        ),
+        migrations.RunPython(fill_actors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 4.2.5 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("interactions", "0007_notificationactor"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(fields=["updated_at"], name="notif_updated_idx"),
+        ),
+    ]
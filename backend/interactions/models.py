@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from posts.models import Post
 
 
@@ -39,9 +40,81 @@ class Notification(models.Model):
     comment = models.TextField(null=True, blank=True)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # 聚合通知：同一接收者、类型、帖子在同一时间窗口内的通知合并为一行
+    # group_key 为 "类型:帖子ID:时间窗口"，actor 为最近一次触发的用户
+    group_key = models.CharField(max_length=64, null=True, blank=True)
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actors = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        ordering = ["-created_at"]
+        ordering = ["-updated_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipient", "group_key"], name="notif_recipient_group_key_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["recipient", "-updated_at"], name="notif_recipient_updated_idx"),
+            # 未读数角标只统计未读的行
+            models.Index(
+                fields=["recipient"],
+                name="notif_unread_idx",
+                condition=models.Q(is_read=False),
+            ),
+            # 归档按 updated_at 查找过期的通知
+            models.Index(fields=["updated_at"], name="notif_updated_idx"),
+        ]
 
     def __str__(self):
         return f"{self.actor.username} {self.notification_type} on {self.post}"
+
+
+class NotificationActor(models.Model):
+    """
+    聚合通知的触发用户，每个用户一行
+
+    actor_count 只在插入新行时加一，同一用户反复点赞不会重复计数；
+    recent_actors 只是展示用的最近几个用户，不用来判断是否重复。
+    """
+
+    notification = models.ForeignKey(
+        Notification, related_name="actors", on_delete=models.CASCADE
+    )
+    actor = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["notification", "actor"], name="notif_actor_uniq"
+            ),
+        ]
+
+
+class ArchivedNotification(models.Model):
+    """
+    超过保留期的通知，由 archive_notifications 命令从 Notification 迁移过来
+
+    只保留统计和追溯需要的字段，不再关联帖子，帖子删除后记录仍然保留。
+    """
+
+    recipient = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="archived_notifications",
+        on_delete=models.CASCADE,
+    )
+    actor_id = models.BigIntegerField()
+    notification_type = models.CharField(max_length=20)
+    post_id = models.BigIntegerField(null=True, blank=True)
+    actor_count = models.PositiveIntegerField(default=1)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["recipient", "-updated_at"], name="archived_notif_recipient_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.notification_type} to {self.recipient_id} ({self.updated_at:%Y-%m-%d})"
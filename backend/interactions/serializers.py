@@ -20,8 +20,18 @@ class NotificationSerializer(serializers.ModelSerializer):
             "comment",
             "is_read",
             "created_at",
+            "actor_count",
+            "recent_actors",
+            "updated_at",
+        )
+        read_only_fields = (
+            "id",
+            "actor",
+            "created_at",
+            "actor_count",
+            "recent_actors",
+            "updated_at",
         )
-        read_only_fields = ("id", "actor", "created_at")
 
     def get_post_content(self, obj):
         if obj.post:
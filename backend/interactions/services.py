@@ -1,16 +1,279 @@
-from .models import Notification
+import logging
+from collections import namedtuple
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import ArchivedNotification, Notification, NotificationActor
 from posts.models import Post
 from accounts.models import User
+from .counters import UnreadCounterService
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+# 聚合通知中保留的最近触发用户数
+RECENT_ACTORS_LIMIT = 3
+# 合并通知时需要写回的字段
+MERGE_FIELDS = ["actor", "actor_count", "recent_actors", "is_read", "updated_at", "comment"]
+
+# 一次待写入的通知，由通知任务批量交给 aggregate_many
+NotificationEvent = namedtuple(
+    "NotificationEvent",
+    ["recipient", "actor", "notification_type", "post", "comment", "created_at"],
+)
+
 
 class NotificationService:
+    @staticmethod
+    def publish(notification):
+        """事务提交后通过 WebSocket 把通知和最新未读数推送到接收者的 user_{id} 房间"""
+        payload = NotificationSerializer(notification).data
+
+        def send():
+            channel_layer = get_channel_layer()
+            if channel_layer is None:
+                return
+            try:
+                async_to_sync(channel_layer.group_send)(
+                    f"user_{notification.recipient_id}",
+                    {
+                        "type": "notification",
+                        "notification": payload,
+                        "unread_count": UnreadCounterService.notifications(
+                            notification.recipient_id
+                        ),
+                    },
+                )
+            except Exception:
+                # 推送失败不影响业务，客户端仍可通过未读数接口兜底
+                logger.warning("通知推送失败", exc_info=True)
+
+        transaction.on_commit(send)
+
+    @staticmethod
+    def group_key(notification_type, post=None, now=None):
+        """同一类型、同一帖子在同一时间窗口内的通知共用一个 group_key"""
+        now = now or timezone.now()
+        window = getattr(settings, "NOTIFICATION_AGGREGATION_WINDOW", 86400)
+        bucket = int(now.timestamp()) // window
+        return f"{notification_type}:{post.id if post else ''}:{bucket}"
+
+    @staticmethod
+    @transaction.atomic
+    def aggregate(recipient, actor, notification_type, post=None, comment=None):
+        """
+        创建或合并一条通知
+
+        窗口内已有同组通知时只更新这一行：actor 换成最新的用户，第一次触发的用户使 actor_count 加一，
+        recent_actors 保留最近的几个用户，并重新标记为未读。
+        是否第一次触发按 NotificationActor 判断，同一用户反复点赞不重复计数。
+        """
+        now = timezone.now()
+        key = NotificationService.group_key(notification_type, post, now)
+        sample = {"id": actor.id, "username": actor.username}
+        queryset = Notification.objects.select_for_update().filter(
+            recipient=recipient, group_key=key
+        )
+        notification = queryset.first()
+        if notification is None:
+            try:
+                with transaction.atomic():
+                    notification = Notification.objects.create(
+                        recipient=recipient,
+                        actor=actor,
+                        notification_type=notification_type,
+                        post=post,
+                        comment=comment,
+                        group_key=key,
+                        recent_actors=[sample],
+                        updated_at=now,
+                    )
+                    NotificationActor.objects.create(notification=notification, actor=actor)
+                UnreadCounterService.notification_created(recipient.id)
+                NotificationService.publish(notification)
+                return notification
+            except IntegrityError:
+                # 并发请求已经创建了这一组，转为合并
+                notification = queryset.get()
+
+        was_read = notification.is_read
+        _, new_actor = NotificationActor.objects.get_or_create(
+            notification=notification, actor=actor
+        )
+        NotificationService.merge(notification, actor, comment, now, new_actor)
+        notification.save(update_fields=MERGE_FIELDS)
+        if was_read:
+            UnreadCounterService.notification_created(recipient.id)
+        NotificationService.publish(notification)
+        return notification
+
+    @staticmethod
+    @transaction.atomic
+    def aggregate_many(events):
+        """
+        批量创建或合并通知，events 为 NotificationEvent 列表
+
+        同一接收者、用户、类型、帖子的重复事件（如反复点赞）只保留最后一次；
+        已有的聚合通知用一次查询取出，新分组用 bulk_create 写入，已有分组用 bulk_update 更新。
+        """
+        latest = {}
+        for event in events:
+            key = (
+                event.recipient.id,
+                event.actor.id,
+                event.notification_type,
+                event.post.id if event.post else None,
+            )
+            # 重复事件移到末尾，保持事件的先后顺序
+            latest.pop(key, None)
+            latest[key] = event
+
+        groups = {}
+        for event in latest.values():
+            key = NotificationService.group_key(
+                event.notification_type, event.post, event.created_at
+            )
+            groups.setdefault((event.recipient.id, key), []).append(event)
+        if not groups:
+            return []
+
+        existing = {
+            (notification.recipient_id, notification.group_key): notification
+            for notification in Notification.objects.select_for_update().filter(
+                recipient_id__in={recipient_id for recipient_id, _ in groups},
+                group_key__in={key for _, key in groups},
+            )
+        }
+
+        # 已有分组中已经触发过的用户，不重复计数
+        known_actors = set(
+            NotificationActor.objects.filter(
+                notification__in=existing.values(),
+                actor_id__in={event.actor.id for event in latest.values()},
+            ).values_list("notification_id", "actor_id")
+        )
+
+        created, updated, unread, new_actors = [], [], [], []
+        for (recipient_id, key), group in groups.items():
+            notification = existing.get((recipient_id, key))
+            if notification is None:
+                first = group[0]
+                notification = Notification(
+                    recipient_id=recipient_id,
+                    actor=first.actor,
+                    notification_type=first.notification_type,
+                    post=first.post,
+                    comment=first.comment,
+                    group_key=key,
+                    recent_actors=[{"id": first.actor.id, "username": first.actor.username}],
+                    updated_at=first.created_at,
+                )
+                created.append((notification, group))
+                # 同一分组中的事件已按用户去重，新分组的每个用户都是第一次触发
+                for event in group[1:]:
+                    notification.post = event.post
+                    NotificationService.merge(
+                        notification, event.actor, event.comment, event.created_at, True
+                    )
+                continue
+            if notification.is_read:
+                unread.append(recipient_id)
+            updated.append(notification)
+            for event in group:
+                new_actor = (notification.id, event.actor.id) not in known_actors
+                if new_actor:
+                    new_actors.append((notification.id, event.actor.id))
+                notification.post = event.post
+                NotificationService.merge(
+                    notification, event.actor, event.comment, event.created_at, new_actor
+                )
+
+        notifications = updated
+        try:
+            with transaction.atomic():
+                Notification.objects.bulk_create(
+                    [notification for notification, _ in created]
+                )
+        except IntegrityError:
+            # 并发请求已经创建了其中的分组，退回逐条合并
+            for _, group in created:
+                for event in group:
+                    NotificationService.aggregate(
+                        event.recipient,
+                        event.actor,
+                        event.notification_type,
+                        post=event.post,
+                        comment=event.comment,
+                    )
+        else:
+            unread += [notification.recipient_id for notification, _ in created]
+            notifications = updated + [notification for notification, _ in created]
+            created_ids = NotificationService._created_ids(created)
+            new_actors += [
+                (created_ids[notification.recipient_id, notification.group_key], event.actor.id)
+                for notification, group in created
+                for event in group
+            ]
+        if updated:
+            Notification.objects.bulk_update(updated, MERGE_FIELDS)
+        NotificationActor.objects.bulk_create(
+            [
+                NotificationActor(notification_id=notification_id, actor_id=actor_id)
+                for notification_id, actor_id in new_actors
+            ],
+            ignore_conflicts=True,
+        )
+
+        for recipient_id in unread:
+            UnreadCounterService.notification_created(recipient_id)
+        for notification in notifications:
+            NotificationService.publish(notification)
+        return notifications
+
+    @staticmethod
+    def _created_ids(created):
+        """bulk_create 不一定返回主键（如较老的 SQLite），没有时按分组重新查询"""
+        ids = {
+            (notification.recipient_id, notification.group_key): notification.id
+            for notification, _ in created
+        }
+        if any(notification_id is None for notification_id in ids.values()):
+            ids = {
+                (recipient_id, key): notification_id
+                for recipient_id, key, notification_id in Notification.objects.filter(
+                    recipient_id__in={recipient_id for recipient_id, _ in ids},
+                    group_key__in={key for _, key in ids},
+                ).values_list("recipient_id", "group_key", "id")
+            }
+        return ids
+
+    @staticmethod
+    def merge(notification, actor, comment, now, new_actor):
+        """把一次新的触发合并进已有的聚合通知，只修改内存中的对象；new_actor 为是否第一次触发"""
+        sample = {"id": actor.id, "username": actor.username}
+        recent = [item for item in notification.recent_actors if item["id"] != actor.id]
+        if new_actor:
+            notification.actor_count += 1
+        notification.recent_actors = [sample] + recent[: RECENT_ACTORS_LIMIT - 1]
+        notification.actor = actor
+        notification.is_read = False
+        notification.updated_at = now
+        if comment is not None:
+            notification.comment = comment
+
     @staticmethod
     def create_like_notification(like_instance):
         """完成点赞通知的创建"""
         if like_instance.user!=like_instance.post.author:
-            Notification.objects.create(
-                recipient=like_instance.post.author,
-                actor=like_instance.user,
-                notification_type='like',
+            NotificationService.aggregate(
+                like_instance.post.author,
+                like_instance.user,
+                'like',
                 post=like_instance.post,
             )
 
@@ -18,10 +281,10 @@ class NotificationService:
     def create_comment_notification(comment_instance):
         """完成评论通知的创建"""
         if comment_instance.author!=comment_instance.post.author:
-            Notification.objects.create(
-                recipient=comment_instance.post.author,
-                actor=comment_instance.author,
-                notification_type='comment',
+            NotificationService.aggregate(
+                comment_instance.post.author,
+                comment_instance.author,
+                'comment',
                 post=comment_instance.post,
                 comment=comment_instance.content,
             )
@@ -30,9 +293,47 @@ class NotificationService:
     def create_follow_notification(follower,followed):
         """完成关注通知的创建"""
         if followed!=follower:
-            Notification.objects.create(
-                recipient=followed,
-                actor=follower,
-                notification_type='follow',
-            )
-        
\ No newline at end of file
+            NotificationService.aggregate(followed, follower, 'follow')
+
+    @staticmethod
+    def archive(days=None, batch_size=1000):
+        """
+        把超过保留天数的通知迁移到 ArchivedNotification，返回迁移的条数
+
+        按批次在各自的事务中复制并删除，删除了未读通知的用户重新统计未读数。
+        """
+        if days is None:
+            days = getattr(settings, "NOTIFICATION_RETENTION_DAYS", 90)
+        cutoff = timezone.now() - timedelta(days=days)
+        total = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Notification.objects.select_for_update()
+                    .filter(updated_at__lt=cutoff)
+                    .order_by("updated_at", "id")[:batch_size]
+                )
+                if not batch:
+                    return total
+                ArchivedNotification.objects.bulk_create(
+                    [
+                        ArchivedNotification(
+                            recipient_id=notification.recipient_id,
+                            actor_id=notification.actor_id,
+                            notification_type=notification.notification_type,
+                            post_id=notification.post_id,
+                            actor_count=notification.actor_count,
+                            is_read=notification.is_read,
+                            created_at=notification.created_at,
+                            updated_at=notification.updated_at,
+                        )
+                        for notification in batch
+                    ]
+                )
+                Notification.objects.filter(
+                    id__in=[notification.id for notification in batch]
+                ).delete()
+                UnreadCounterService.notifications_changed(
+                    {n.recipient_id for n in batch if not n.is_read}
+                )
+            total += len(batch)
@@ -0,0 +1,63 @@
+from django.utils import timezone
+
+from accounts.models import User
+from posts.models import Comment
+from tasks.queue import task
+from .models import Like
+from .services import NotificationEvent, NotificationService
+
+
+# 通知任务都是批量任务：worker 同一批领取到的同类通知在任务自己的事务中用 aggregate_many 一起写入，
+# 写入失败时这一组任务一起重试
+
+
+@task(batch=True)
+def create_like_notification(calls):
+    like_ids = [args[0] for args, _ in calls]
+    likes = Like.objects.select_related("user", "post__author").in_bulk(like_ids)
+    now = timezone.now()
+    # 任务执行前已经取消点赞的不再通知
+    NotificationService.aggregate_many(
+        [
+            NotificationEvent(like.post.author, like.user, "like", like.post, None, now)
+            for like in (likes.get(like_id) for like_id in like_ids)
+            if like is not None and like.user_id != like.post.author_id
+        ]
+    )
+
+
+@task(batch=True)
+def create_comment_notification(calls):
+    comment_ids = [args[0] for args, _ in calls]
+    comments = Comment.objects.select_related("author", "post__author").in_bulk(comment_ids)
+    now = timezone.now()
+    NotificationService.aggregate_many(
+        [
+            NotificationEvent(
+                comment.post.author, comment.author, "comment", comment.post, comment.content, now
+            )
+            for comment in (comments.get(comment_id) for comment_id in comment_ids)
+            if comment is not None and comment.author_id != comment.post.author_id
+        ]
+    )
+
+
+@task(batch=True)
+def create_follow_notification(calls):
+    pairs = [tuple(args) for args, _ in calls]
+    users = User.objects.in_bulk({user_id for pair in pairs for user_id in pair})
+    # 任务执行前已经取消关注的不再通知
+    following = set(
+        User.following.through.objects.filter(
+            from_user_id__in={follower_id for follower_id, _ in pairs},
+            to_user_id__in={followed_id for _, followed_id in pairs},
+        ).values_list("from_user_id", "to_user_id")
+    )
+    now = timezone.now()
+    NotificationService.aggregate_many(
+        [
+            NotificationEvent(users[followed_id], users[follower_id], "follow", None, None, now)
+            for follower_id, followed_id in pairs
+            if follower_id != followed_id and (follower_id, followed_id) in following
+        ]
+    )
@@ -1,3 +1,399 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from myproject.explain import ExplainAssertionsMixin
+from posts.models import Post
+from tasks.models import Task
+from tasks.queue import TaskQueue
+from . import tasks as notification_tasks
+from .counters import UnreadCounterService
+from .models import ArchivedNotification, Like, Notification
+from .services import NotificationService
+
+
+class NotificationHotQueryPlanTests(ExplainAssertionsMixin, TestCase):
+    """通知列表和未读数角标必须走索引"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipient = User.objects.create_user(
+            username="recipient", email="recipient@example.com", password="password"
+        )
+        actor = User.objects.create_user(
+            username="actor", email="actor@example.com", password="password"
+        )
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    recipient=cls.recipient,
+                    actor=actor,
+                    notification_type="follow",
+                    is_read=i % 2 == 0,
+                )
+                for i in range(50)
+            ]
+        )
+
+    def test_unread_count(self):
+        self.assertNoSequentialScan(
+            Notification.objects.filter(recipient=self.recipient, is_read=False)
+        )
+
+    def test_notification_list(self):
+        self.assertNoSequentialScan(
+            Notification.objects.filter(recipient=self.recipient).order_by("-updated_at")[:20]
+        )
+
+    def test_archive_batch(self):
+        self.assertNoSequentialScan(
+            Notification.objects.filter(updated_at__lt=timezone.now())
+            .order_by("updated_at", "id")[:1000]
+        )
+
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class UnreadCounterTests(TestCase):
+    """未读数从缓存读取，并随通知的创建和已读保持一致"""
+
+    def setUp(self):
+        cache.clear()
+        self.recipient = User.objects.create_user(
+            username="recipient", email="recipient@example.com", password="password"
+        )
+        self.actor = User.objects.create_user(
+            username="actor", email="actor@example.com", password="password"
+        )
+        self.post = Post.objects.create(author=self.recipient, content="post")
+        self.client = APIClient()
+        self.client.force_authenticate(self.recipient)
+
+    def unread_count(self):
+        response = self.client.get("/api/interactions/notifications/unread-count/")
+        self.assertEqual(response.status_code, 200)
+        return response.data["count"]
+
+    def notify(self, actor=None, post=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.aggregate(
+                self.recipient, actor or self.actor, "like", post=post or self.post
+            )
+
+    def test_counter_follows_writes(self):
+        self.assertEqual(self.unread_count(), 0)
+        self.notify()
+        self.notify(post=Post.objects.create(author=self.recipient, content="another"))
+        self.assertEqual(self.unread_count(), 2)
+
+        notification = Notification.objects.filter(recipient=self.recipient).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/interactions/notifications/{notification.id}/read/")
+            self.client.post(f"/api/interactions/notifications/{notification.id}/read/")
+        self.assertEqual(self.unread_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/interactions/notifications/read-all/")
+        self.assertEqual(self.unread_count(), 0)
+
+    def test_polling_hits_cache_only(self):
+        self.notify()
+        self.unread_count()
+        # 认证已在测试中跳过，缓存命中后不需要任何数据库查询
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                UnreadCounterService.notifications(self.recipient.id), 1
+            )
+
+    def test_reconcile(self):
+        Notification.objects.create(
+            recipient=self.recipient, actor=self.actor, notification_type="like", post=self.post
+        )
+        self.assertEqual(self.unread_count(), 1)
+        # 绕过服务直接写入的数据由校准修正
+        Notification.objects.create(
+            recipient=self.recipient, actor=self.actor, notification_type="follow"
+        )
+        self.assertEqual(self.unread_count(), 1)
+        UnreadCounterService.reconcile()
+        self.assertEqual(self.unread_count(), 2)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationPushTests(TestCase):
+    """新通知在事务提交后推送到接收者的 user_{id} 房间"""
+
+    def setUp(self):
+        cache.clear()
+        self.recipient = User.objects.create_user(
+            username="recipient", email="recipient@example.com", password="password"
+        )
+        self.actor = User.objects.create_user(
+            username="actor", email="actor@example.com", password="password"
+        )
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(
+            f"user_{self.recipient.id}", self.channel_name
+        )
+
+    def test_push_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            NotificationService.create_follow_notification(self.actor, self.recipient)
+        # 提交前不推送
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+
+        event = async_to_sync(self.channel_layer.receive)(self.channel_name)
+        self.assertEqual(event["type"], "notification")
+        self.assertEqual(event["unread_count"], 1)
+        self.assertEqual(event["notification"]["notification_type"], "follow")
+        self.assertEqual(event["notification"]["actor"], "actor")
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationAggregationTests(TestCase):
+    """同一帖子同一类型的通知在时间窗口内合并为一行"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password"
+        )
+        self.post = Post.objects.create(author=self.author, content="post")
+        self.likers = [
+            User.objects.create_user(
+                username=f"liker{i}", email=f"liker{i}@example.com", password="password"
+            )
+            for i in range(5)
+        ]
+
+    def like(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.create_like_notification(Like(user=user, post=self.post))
+
+    def test_likes_are_coalesced(self):
+        for user in self.likers:
+            self.like(user)
+        # 取消后再次点赞不重复计数，包括已经不在 recent_actors 中的用户
+        self.like(self.likers[3])
+        self.like(self.likers[0])
+
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.actor_count, 5)
+        self.assertEqual(notification.actor, self.likers[0])
+        self.assertEqual(
+            [item["username"] for item in notification.recent_actors],
+            ["liker0", "liker3", "liker4"],
+        )
+        self.assertEqual(UnreadCounterService.notifications(self.author.id), 1)
+
+    def test_read_group_becomes_unread_again(self):
+        self.like(self.likers[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.filter(recipient=self.author).update(is_read=True)
+            UnreadCounterService.notifications_cleared(self.author.id)
+        self.like(self.likers[1])
+
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertFalse(notification.is_read)
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(UnreadCounterService.notifications(self.author.id), 1)
+
+    def test_window_and_type_separate_groups(self):
+        self.like(self.likers[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.create_follow_notification(self.likers[0], self.author)
+        # 把已有的点赞通知移到上一个时间窗口
+        Notification.objects.filter(notification_type="like").update(
+            group_key=f"like:{self.post.id}:0"
+        )
+        self.like(self.likers[1])
+        self.assertEqual(Notification.objects.filter(recipient=self.author).count(), 3)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, TASKS_EAGER=False)
+class NotificationTaskTests(TestCase):
+    """worker 同一批领取的通知任务合并为少量批量写入，写入失败时一起重试"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password"
+        )
+        self.posts = [
+            Post.objects.create(author=self.author, content=f"post{i}") for i in range(3)
+        ]
+        self.likers = [
+            User.objects.create_user(
+                username=f"liker{i}", email=f"liker{i}@example.com", password="password"
+            )
+            for i in range(5)
+        ]
+
+    def like(self, user, post):
+        like = Like.objects.create(user=user, post=post)
+        notification_tasks.create_like_notification.delay(like.id)
+        return like
+
+    def run_tasks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return TaskQueue.run_pending(batch_size=100)
+
+    def test_burst_is_written_in_bulk(self):
+        for post in self.posts:
+            for user in self.likers:
+                self.like(user, post)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.run_tasks(), 15)
+        # 15 个任务只产生通知和触发用户各一条 INSERT
+        writes = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith(("INSERT", "UPDATE"))
+            and "interactions_notification" in query["sql"]
+        ]
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(Task.objects.filter(status=Task.SUCCEEDED).count(), 15)
+
+        notifications = Notification.objects.filter(recipient=self.author)
+        self.assertEqual(notifications.count(), 3)
+        self.assertEqual({n.actor_count for n in notifications}, {5})
+        self.assertEqual(UnreadCounterService.notifications(self.author.id), 3)
+
+    def test_toggled_likes_are_deduplicated(self):
+        post = self.posts[0]
+        self.like(self.likers[0], post).delete()
+        self.like(self.likers[1], post)
+        self.like(self.likers[0], post)
+        self.run_tasks()
+
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.actor, self.likers[0])
+
+    def test_merges_into_existing_group(self):
+        post = self.posts[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.aggregate(self.author, self.likers[0], "like", post=post)
+        self.like(self.likers[1], post)
+        self.like(self.likers[2], post)
+        self.run_tasks()
+        # 已经计数过的用户再次触发
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.aggregate(self.author, self.likers[0], "like", post=post)
+
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(
+            [item["username"] for item in notification.recent_actors],
+            ["liker0", "liker2", "liker1"],
+        )
+        self.assertEqual(UnreadCounterService.notifications(self.author.id), 1)
+
+    def test_failed_write_is_retried(self):
+        self.like(self.likers[0], self.posts[0])
+        self.like(self.likers[1], self.posts[0])
+        # 写入失败时这一组任务都回到队列等待重试
+        with mock.patch.object(
+            NotificationService, "aggregate_many", side_effect=RuntimeError
+        ):
+            self.run_tasks()
+        self.assertEqual(Task.objects.filter(status=Task.PENDING, attempts=1).count(), 2)
+        self.assertFalse(Notification.objects.exists())
+
+        Task.objects.update(run_at=timezone.now())
+        self.run_tasks()
+        self.assertEqual(Task.objects.filter(status=Task.SUCCEEDED).count(), 2)
+        self.assertEqual(Notification.objects.get(recipient=self.author).actor_count, 2)
+
+
+class NotificationListTests(TestCase):
+    """通知列表游标分页、过滤和过期归档"""
+
+    def setUp(self):
+        cache.clear()
+        self.recipient = User.objects.create_user(
+            username="recipient", email="recipient@example.com", password="password"
+        )
+        self.actors = [
+            User.objects.create_user(
+                username=f"actor{i}", email=f"actor{i}@example.com", password="password"
+            )
+            for i in range(2)
+        ]
+        self.post = Post.objects.create(author=self.recipient, content="post")
+        now = timezone.now()
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    recipient=self.recipient,
+                    actor=self.actors[i % 2],
+                    notification_type="like" if i % 2 else "follow",
+                    post=self.post if i % 2 else None,
+                    is_read=i < 10,
+                    updated_at=now - timedelta(minutes=i),
+                )
+                for i in range(25)
+            ]
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.recipient)
+
+    def fetch_all(self, params=None):
+        results, cursor = [], None
+        while True:
+            query = dict(params or {}, page_size=10)
+            if cursor:
+                query["cursor"] = cursor
+            response = self.client.get("/api/interactions/notifications/", query)
+            self.assertEqual(response.status_code, 200)
+            results += response.data["results"]
+            cursor = response.data["next"]
+            if not cursor:
+                return results
+
+    def test_cursor_pages(self):
+        results = self.fetch_all()
+        self.assertEqual(len(results), 25)
+        self.assertEqual(len({item["id"] for item in results}), 25)
+
+    def test_filters(self):
+        self.assertEqual(len(self.fetch_all({"is_read": "false"})), 15)
+        likes = self.fetch_all({"type": "like", "is_read": "true"})
+        self.assertEqual(len(likes), 5)
+        self.assertTrue(all(item["notification_type"] == "like" for item in likes))
+
+    def test_query_count_is_constant(self):
+        # 认证、查询一页通知，actor 和 post 一并取出
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/interactions/notifications/", {"page_size": 20})
+        self.assertEqual(len(response.data["results"]), 20)
+
+    def test_archive_old_notifications(self):
+        self.assertEqual(UnreadCounterService.notifications(self.recipient.id), 15)
+        Notification.objects.filter(notification_type="follow").update(
+            updated_at=timezone.now() - timedelta(days=100)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            archived = NotificationService.archive(days=90, batch_size=5)
+
+        self.assertEqual(archived, 13)
+        self.assertEqual(ArchivedNotification.objects.count(), 13)
+        self.assertEqual(Notification.objects.count(), 12)
+        self.assertEqual(
+            UnreadCounterService.notifications(self.recipient.id),
+            Notification.objects.filter(is_read=False).count(),
+        )
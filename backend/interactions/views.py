@@ -3,16 +3,38 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from rest_framework.generics import ListAPIView, UpdateAPIView
+from myproject.pagination import KeysetPagination
+from .counters import UnreadCounterService
 from .models import Notification
 from .serializers import NotificationSerializer
 
 
 class NotificationListView(ListAPIView):
+    """
+    通知列表，按 (updated_at, id) 游标分页
+
+    支持 ?is_read=true/false 和 ?type=like,comment 过滤，返回 {"results": [...], "next": 游标}
+    """
+
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user).order_by('-created_at')
+        queryset = Notification.objects.filter(recipient=self.request.user).select_related(
+            'actor', 'post'
+        )
+        is_read = self.request.query_params.get('is_read')
+        if is_read in ('true', 'false'):
+            queryset = queryset.filter(is_read=is_read == 'true')
+        types = self.request.query_params.get('type')
+        if types:
+            queryset = queryset.filter(notification_type__in=types.split(','))
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        paginator = KeysetPagination(ordering=('-updated_at', '-id'))
+        page = paginator.paginate_queryset(self.get_queryset(), request)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
 
 
 class NotificationMarkAsReadView(UpdateAPIView):
@@ -24,8 +46,13 @@ class NotificationMarkAsReadView(UpdateAPIView):
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
+        # 只有这次请求真正把未读改为已读时才减少未读数，重复标记不会重复扣减
+        updated = Notification.objects.filter(pk=instance.pk, is_read=False).update(
+            is_read=True
+        )
         instance.is_read = True
-        instance.save()
+        if updated:
+            UnreadCounterService.notification_read(request.user.id)
         serializer = self.get_serializer(instance)
         return Response({
             "message": "Notification marked as read",
@@ -44,6 +71,7 @@ class NotificationMarkAllAsReadView(APIView):
         Notification.objects.filter(recipient=request.user, is_read=False).update(
             is_read=True
         )
+        UnreadCounterService.notifications_cleared(request.user.id)
         return Response(
             {"message": "All notifications marked as read", "status": "success"}
         )
@@ -53,7 +81,10 @@ class UnreadNotificationCountView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        count = Notification.objects.filter(
-            recipient=request.user, is_read=False
-        ).count()
-        return Response({"count": count})
\ No newline at end of file
+        # 角标轮询只读缓存，count 为通知未读数，messages 为私信和群聊的未读总数
+        return Response(
+            {
+                "count": UnreadCounterService.notifications(request.user.id),
+                "messages": UnreadCounterService.messages(request.user.id),
+            }
+        )
\ No newline at end of file
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MessagesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "messaging"
+
+    def ready(self):
+        # 注册群成员缓存的失效处理
+        from . import signals  # noqa: F401
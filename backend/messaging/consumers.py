@@ -1,103 +1,98 @@
-import json
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import Message, GroupMessage, GroupChat
-from .serializers import MessageSerializer, GroupMessageSerializer
+from django.db import transaction
+from .eventlog import ChatEventLog
+from .models import Message
+from .fanout import group_send_many
+from .persistence import group_message_persister
+from .presence import PresenceService, status_digest
+from .protocol import FrameBatcher, negotiate
+from .services import (
+    ConversationService,
+    GroupActivityService,
+    GroupMembershipService,
+)
 
 User = get_user_model()
 
 
 class ChatConsumer(AsyncJsonWebsocketConsumer):
-    online_users = set()
     async def connect(self):
         user = self.scope["user"]
         if user.is_anonymous:
             await self.close()
         else:
-            self.online_users.add(user.id)
             # 私聊房间
             self.private_room_name = f"user_{user.id}"
             await self.channel_layer.group_add(
                 self.private_room_name, self.channel_name
             )
 
-            # 加入所有群聊房间
-            group_chats = await self.get_user_group_chats(user.id)
-            for group_id in group_chats:
-                room_name = f"group_{group_id}"
-                await self.channel_layer.group_add(room_name, self.channel_name)
+            # 协议选项：帧编码、是否合并推送、群聊房间按需订阅
+            options = negotiate(self.scope)
+            self.codec = options.codec
+            self.batcher = FrameBatcher(self.send_frame) if options.batch else None
+            self.lazy_groups = options.lazy_groups
+
+            # 记下用户所在的群供在线状态广播复用；按需订阅时连接只加入客户端
+            # 通过 subscribe_group 标记为活跃的群聊房间，否则加入所有群聊房间
+            self.group_ids = set(await self.get_user_group_chats(user.id))
+            self.subscribed_group_ids = set()
+            if not self.lazy_groups:
+                for group_id in self.group_ids:
+                    await self.subscribe_group(group_id)
 
             await self.accept()
 
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 "type":"connection_established",
                 "user_id": user.id,
                 "message": "websocket 连接成功"
-            }))
-            await self.broadcast_user_status(user.id,"online")
+            })
+            await database_sync_to_async(PresenceService.connected)(user.id)
+            status_digest.submit(user.id, self.group_ids)
 
     async def disconnect(self, close_code):
         user = self.scope["user"]
+        if getattr(self, "batcher", None) is not None:
+            await self.batcher.close()
         if not user.is_anonymous:
-            self.online_users.discard(user.id)
             # 离开私聊房间
             await self.channel_layer.group_discard(
                 self.private_room_name, self.channel_name
             )
 
-            # 离开所有群聊房间
-            group_chats = await self.get_user_group_chats(user.id)
-            for group_id in group_chats:
-                room_name = f"group_{group_id}"
-                await self.channel_layer.group_discard(room_name, self.channel_name)
-            
-            await self.broadcast_user_status(user.id, "offline")
-
-    async def broadcast_user_status(self,user_id,status):
-        group_chats=await self.get_user_group_chats(user_id)
-        for group_id in group_chats:
-            room_name=f"group_{group_id}"
-            await self.channel_layer.group_send(
-                room_name,
-                {
-                    "type": "user_status",
-                    "user_id": user_id,
-                    "status": status,
-                }
-            )
-        followers=await self.get_user_followers(user_id)
-        for follower_id in followers:
-            room_name=f"user_{follower_id}"
-            await self.channel_layer.group_send(
-                room_name,
-                {
-                    "type": "user_status",
-                    "user_id": user_id,
-                    "status": status,
-                }
-            )
-    async def user_status(self,event):
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "user_status",
-                    "user_id": event["user_id"],
-                    "status": event["status"],
-                }
-            )
+            # 离开连接期间订阅的群聊房间
+            for group_id in list(getattr(self, "subscribed_group_ids", ())):
+                await self.unsubscribe_group(group_id)
+
+            await database_sync_to_async(PresenceService.disconnected)(user.id)
+            status_digest.submit(user.id, getattr(self, "group_ids", ()))
+
+    async def send_event(self, event):
+        """推送一个事件给客户端，开启合并推送时先进入缓冲"""
+        if self.batcher is not None:
+            await self.batcher.add(event)
+        else:
+            await self.send_frame(event)
+
+    async def send_frame(self, event):
+        """按协商的编码发送一帧"""
+        if self.codec.binary:
+            await self.send(bytes_data=self.codec.encode(event))
+        else:
+            await self.send(text_data=self.codec.encode(event))
+
+    async def presence_digest(self, event):
+        """发送合并后的在线状态变化给客户端"""
+        status_digest.watch(event["statuses"])
+        await self.send_event(
+            {"type": "presence_digest", "statuses": event["statuses"]}
         )
-    @database_sync_to_async
-    def get_user_followers(self,user_id):
-        """获取所有关注该用户的id"""
-        try:
-            user=User.objects.get(id=user_id)
-            return list(user.followers.values_list("id", flat=True))
-        except User.DoesNotExist:
-            return []
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.codec.decode(text_data, bytes_data)
         message_type = data.get("type")
         if message_type == "private_message":
             await self.handle_private_message(data)
@@ -105,14 +100,28 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             await self.handle_group_message(data)
         elif message_type == "read":
             await self.handle_read(data)
-        elif message_type == "join_group":
+        elif message_type in ("join_group", "subscribe_group"):
             await self.handle_join_group(data)
+        elif message_type == "unsubscribe_group":
+            await self.handle_leave_group(data)
+        elif message_type == "resume":
+            await self.handle_resume(data)
+        elif message_type == "ping":
+            # 客户端定时发送的心跳，只刷新在线状态
+            await self.heartbeat()
         elif message_type == "heartbeat":
             # 心跳响应
-            await self.send(text_data=json.dumps({
+            await self.heartbeat()
+            await self.send_event({
                 "type": "heartbeat",
                 "timestamp": data.get("timestamp")
-            }))
+            })
+
+    async def heartbeat(self):
+        """刷新在线状态，计数过期后重新上线的广播一次状态变化"""
+        user = self.scope["user"]
+        if await database_sync_to_async(PresenceService.heartbeat)(user.id):
+            status_digest.submit(user.id, getattr(self, "group_ids", ()))
 
     async def handle_private_message(self, data):
         """处理私聊消息"""
@@ -122,18 +131,13 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
 
         message = await self.save_private_message(user.id, recipient_id, content)
 
+        # 事件带有会话和序号，客户端重连时据此补发
+        event = ChatEventLog.message_event(message)
         # 发送给发送者
-        await self.send(
-            text_data=json.dumps(
-                {"type": "private_message", "message": MessageSerializer(message).data}
-            )
-        )
+        await self.send_event(dict(event, type="private_message"))
         # 发送给接收者
         recipient_group_name = f"user_{recipient_id}"
-        await self.channel_layer.group_send(
-            recipient_group_name,
-            {"type": "chat_message", "message": MessageSerializer(message).data},
-        )
+        await self.channel_layer.group_send(recipient_group_name, event)
 
     async def handle_group_message(self, data):
         """处理群聊消息"""
@@ -144,48 +148,106 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         # 检查用户是否是群成员
         is_member = await self.check_group_membership(user.id, group_id)
         if not is_member:
-            await self.send(
-                text_data=json.dumps({"type": "error", "message": "您不是该群的成员"})
-            )
+            await self.send_event({"type": "error", "message": "您不是该群的成员"})
+            return
+        if not isinstance(content, str) or not content.strip():
+            await self.send_event({"type": "error", "message": "发送的内容不能为空"})
             return
 
-        message = await self.save_group_message(user.id, group_id, content)
+        if group_message_persister.enabled():
+            # 延迟写入：消息先进入持久缓冲并分配ID和序号，推送不等待数据库
+            message = await group_message_persister.accept(user, group_id, content)
+        else:
+            message = await self.save_group_message(user.id, group_id, content)
 
         # 发送给所有群成员（除了发送者）
         group_room_name = f"group_{group_id}"
         await self.channel_layer.group_send(
-            group_room_name,
-            {
-                "type": "group_chat_message",
-                "message": GroupMessageSerializer(message).data,
-            },
+            group_room_name, ChatEventLog.message_event(message)
+        )
+        # 没有订阅该群的成员只收到新消息提示
+        hint_rooms = await self.get_activity_hint_rooms(group_id, user.id)
+        await group_send_many(
+            self.channel_layer,
+            [
+                (
+                    room,
+                    {
+                        "type": "group_activity",
+                        "group_id": message.group_id,
+                        "message_id": message.id,
+                        "seq": message.seq,
+                    },
+                )
+                for room in hint_rooms
+            ],
         )
 
-    async def handle_read(self, data):
-        """处理消息已读"""
-        message_id = data.get("message_id")
-        message= await self.mark_as_read(message_id)
-        if message:
-            sender_group_name=f"user_{message.sender.id}"
-            await self.channel_layer.group_send(
-                sender_group_name,
-                {
-                    "type":"message_read",
-                    "message_id":message_id,
-                    "read_by":self.scope["user"].id
-                }
-            )
+    async def handle_resume(self, data):
+        """
+        断线重连后补发错过的消息
 
-    async def message_read(self,event):
-        """确认消息已读并发送给客户端"""
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "message_read",
-                    "message_id": event["message_id"],
-                    "read_by": event["read_by"],
-                }
+        客户端发送 {"type": "resume", "conversations": {会话: 最后收到的序号}}，
+        按会话从事件日志补发；日志无法覆盖的会话回复 resync_required，由客户端重新拉取。
+        """
+        positions = data.get("conversations") or {}
+        if not isinstance(positions, dict):
+            await self.send_event(
+                {"type": "error", "message": "conversations 必须是会话到序号的映射"}
             )
+            return
+        for conversation, last_seq in positions.items():
+            events, complete = await self.get_missed_events(conversation, last_seq)
+            group_id = self.unsubscribed_group_id(conversation)
+            if group_id is not None and events:
+                # 按需订阅时没有订阅的群和实时推送一样只提示有新消息，不补发消息内容
+                await self.send_event(
+                    {
+                        "type": "group_activity",
+                        "group_id": group_id,
+                        "message_id": events[-1]["message"]["id"],
+                        "seq": events[-1]["seq"],
+                    }
+                )
+                continue
+            for event in events:
+                await self.send_event(dict(event, replayed=True))
+            if not complete:
+                await self.send_event(
+                    {"type": "resync_required", "conversation": conversation}
+                )
+        await self.send_event({"type": "resume_complete"})
+
+    def unsubscribed_group_id(self, conversation):
+        """按需订阅的连接没有订阅的群聊会话返回群ID，其余返回 None"""
+        if not self.lazy_groups:
+            return None
+        try:
+            kind, group_id = ChatEventLog.parse_key(conversation)
+        except ValueError:
+            return None
+        if kind != "group" or group_id in self.subscribed_group_ids:
+            return None
+        return group_id
+
+    async def handle_read(self, data):
+        """
+        处理已读：{"type": "read", "conversation": 会话, "message_id": 已读到的消息ID}
+
+        一次移动整个会话的已读水位，回执由服务端在提交后合并推送；
+        只带 message_id 的旧格式按该消息所在的私聊处理。
+        """
+        await self.mark_read_up_to(data.get("conversation"), data.get("message_id"))
+
+    async def message_read(self, event):
+        """已读回执：read_by 已读到 conversation 中的 message_id"""
+        await self.send_event(
+            {
+                "type": "message_read",
+                "conversation": event.get("conversation"),
+                "message_id": event["message_id"],
+                "read_by": event["read_by"],
+            }
         )
 
     async def handle_join_group(self, data):
@@ -196,69 +258,110 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         # 检查用户是否是群成员
         is_member = await self.check_group_membership(user.id, group_id)
         if not is_member:
-            await self.send(
-                text_data=json.dumps({"type": "error", "message": "您不是该群的成员"})
-            )
+            await self.send_event({"type": "error", "message": "您不是该群的成员"})
             return
 
         # 加入群聊房间
-        room_name = f"group_{group_id}"
-        await self.channel_layer.group_add(room_name, self.channel_name)
-        await self.send(
-            text_data=json.dumps({"type": "group_joined", "group_id": group_id})
-        )
+        await self.subscribe_group(int(group_id))
+        self.group_ids.add(int(group_id))
+        await self.send_event({"type": "group_joined", "group_id": group_id})
+
+    async def handle_leave_group(self, data):
+        """客户端不再查看某个群聊时退订，之后只收到新消息提示"""
+        try:
+            group_id = int(data.get("group_id"))
+        except (TypeError, ValueError):
+            return
+        await self.unsubscribe_group(group_id)
+        await self.send_event({"type": "group_left", "group_id": group_id})
+
+    async def subscribe_group(self, group_id):
+        if group_id not in self.subscribed_group_ids:
+            await self.channel_layer.group_add(f"group_{group_id}", self.channel_name)
+            self.subscribed_group_ids.add(group_id)
+
+    async def unsubscribe_group(self, group_id):
+        if group_id in self.subscribed_group_ids:
+            await self.channel_layer.group_discard(f"group_{group_id}", self.channel_name)
+            self.subscribed_group_ids.discard(group_id)
+
+    async def group_activity(self, event):
+        """其他群的新消息提示；已订阅的群会直接收到消息，不再推送提示"""
+        if event["group_id"] in self.subscribed_group_ids:
+            return
+        await self.send_event(event)
 
     async def chat_message(self, event):
         """发送私聊消息给客户端"""
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
 
     async def group_chat_message(self, event):
         """发送群聊消息给客户端"""
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
+
+    async def notification(self, event):
+        """推送新通知和最新的通知未读数"""
+        await self.send_event(
+            {
+                "type": "notification",
+                "notification": event["notification"],
+                "unread_count": event["unread_count"],
+            }
+        )
 
     @database_sync_to_async
     def save_private_message(self, sender_id, recipient_id, content):
         """保存私聊消息"""
         sender = User.objects.get(id=sender_id)
         recipient = User.objects.get(id=recipient_id)
-        return Message.objects.create(
-            sender=sender, recipient=recipient, content=content
-        )
+        with transaction.atomic():
+            message = Message.objects.create(
+                sender=sender, recipient=recipient, content=content
+            )
+            ConversationService.record_private_message(message)
+        return message
 
     @database_sync_to_async
     def save_group_message(self, sender_id, group_id, content):
         """保存群聊消息"""
-        sender = User.objects.get(id=sender_id)
-        group = GroupChat.objects.get(id=group_id)
-        return GroupMessage.objects.create(sender=sender, group=group, content=content)
+        return group_message_persister.save_now(sender_id, group_id, content)
 
     @database_sync_to_async
-    def mark_as_read(self, message_id):
-        """标记消息为已读"""
+    def mark_read_up_to(self, conversation, message_id):
+        """移动已读水位，水位有变化时返回 True"""
+        user_id = self.scope["user"].id
         try:
-            message = Message.objects.get(id=message_id)
-            if not message.is_read:
-                message.is_read = True
-                message.save()
-            return message
-        except Message.DoesNotExist:
-            return None
+            message_id = int(message_id)
+            if conversation is None:
+                message = Message.objects.only("sender_id").get(
+                    id=message_id, recipient_id=user_id
+                )
+                conversation = ChatEventLog.private_key(message.sender_id, user_id)
+            return ConversationService.read_up_to(user_id, conversation, message_id)
+        except (TypeError, ValueError, Message.DoesNotExist):
+            return False
 
     @database_sync_to_async
     def get_user_group_chats(self, user_id):
-        """获取用户所属的所有群聊ID"""
-        return list(
-            GroupChat.objects.filter(members=user_id).values_list("id", flat=True)
+        """获取用户所属的所有群聊ID，读取缓存的群列表"""
+        return GroupMembershipService.group_ids(user_id)
+
+    @database_sync_to_async
+    def get_missed_events(self, conversation, last_seq):
+        """读取会话在 last_seq 之后的事件"""
+        return ChatEventLog.missed_events(
+            self.scope["user"].id, self.group_ids, conversation, last_seq
         )
 
+    @database_sync_to_async
+    def get_activity_hint_rooms(self, group_id, sender_id):
+        """新消息提示需要推送到的成员房间，按群节流"""
+        return GroupActivityService.hint_rooms(group_id, sender_id)
+
     @database_sync_to_async
     def check_group_membership(self, user_id, group_id):
-        """检查用户是否是群成员"""
-        try:
-            group = GroupChat.objects.get(id=group_id)
-            return group.members.filter(id=user_id).exists()
-        except GroupChat.DoesNotExist:
-            return False
+        """检查用户是否是群成员，读取缓存的成员集合"""
+        return GroupMembershipService.is_member(group_id, user_id)
 
     async def handle_private_message_with_file(self, data):
         await self.handle_private_message(data)
@@ -0,0 +1,203 @@
+import logging
+import threading
+from collections import defaultdict, deque
+
+import orjson
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from .models import Conversation
+from .serializers import GroupMessageSerializer, MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def ordered_after(entries, seq, count):
+    """按会话序号排序取 seq 之后的前 count 条事件，同一序号只保留一条"""
+    latest = {}
+    for entry_seq, payload in entries:
+        if entry_seq > seq:
+            latest[entry_seq] = payload
+    return sorted(latest.items())[:count]
+
+
+class RedisStreamBackend:
+    """
+    每个会话一个 Redis Stream，条目ID由 Redis 自动生成，会话序号保存在条目的 seq 字段中
+
+    并发提交的事务写入顺序和序号顺序不一定一致，按写入顺序追加后读取时再按序号排序，
+    序号较小的事件晚到时不会因为条目ID落后被拒绝、在日志中留下缺口。
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+
+    def append(self, key, seq, payload):
+        pipe = self.client.pipeline()
+        pipe.xadd(
+            key,
+            {"seq": seq, "event": payload},
+            maxlen=getattr(settings, "CHAT_EVENT_LOG_MAXLEN", 1000),
+            approximate=True,
+        )
+        pipe.expire(key, getattr(settings, "CHAT_EVENT_LOG_TTL", 7 * 86400))
+        pipe.execute()
+
+    def read_after(self, key, seq, count):
+        # 晚到的事件排在序号更大的事件之后，从末尾多读一段覆盖乱序的范围
+        window = getattr(settings, "CHAT_EVENT_LOG_REORDER_WINDOW", 100)
+        entries = self.client.xrevrange(key, count=count + window)
+        return ordered_after(
+            [
+                # 旧格式的条目ID就是会话序号
+                (int(fields.get(b"seq") or entry_id.split(b"-")[0]), fields[b"event"])
+                for entry_id, fields in entries
+            ],
+            seq,
+            count,
+        )
+
+
+class LocalStreamBackend:
+    """没有 Redis 时的进程内替代，只适合本地开发和测试"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = defaultdict(
+            lambda: deque(maxlen=getattr(settings, "CHAT_EVENT_LOG_MAXLEN", 1000))
+        )
+
+    def append(self, key, seq, payload):
+        with self.lock:
+            self.streams[key].append((seq, payload))
+
+    def read_after(self, key, seq, count):
+        with self.lock:
+            return ordered_after(self.streams.get(key, ()), seq, count)
+
+
+class ChatEventLog:
+    """
+    会话消息事件日志
+
+    新消息和消息的编辑、撤回在事务提交后按会话序号追加到有上限的事件流（CHAT_EVENT_LOG_URL 指向的 Redis，
+    未配置时使用进程内替代）。WebSocket 断线重连后客户端发送 resume，
+    带上每个会话最后收到的序号，只补发缺少的事件；事件流已被截断或缺口较大时
+    通知客户端通过接口重新拉取。
+    """
+
+    _backend = None
+
+    @staticmethod
+    def backend():
+        if ChatEventLog._backend is None:
+            url = getattr(settings, "CHAT_EVENT_LOG_URL", None)
+            ChatEventLog._backend = RedisStreamBackend(url) if url else LocalStreamBackend()
+        return ChatEventLog._backend
+
+    @staticmethod
+    def stream_key(conversation_key):
+        return f"chat_events:{conversation_key}"
+
+    @staticmethod
+    def private_key(user_id, other_id):
+        low, high = sorted([int(user_id), int(other_id)])
+        return f"private:{low}:{high}"
+
+    @staticmethod
+    def group_key(group_id):
+        return f"group:{group_id}"
+
+    @staticmethod
+    def parse_key(conversation_key):
+        """
+        解析会话标识，返回 ("private", (较小用户ID, 较大用户ID)) 或 ("group", 群ID)
+
+        格式不正确时抛出 ValueError。
+        """
+        kind, _, rest = str(conversation_key).partition(":")
+        if kind == "private":
+            member_ids = tuple(sorted(int(part) for part in rest.split(":")))
+            if len(member_ids) != 2:
+                raise ValueError(conversation_key)
+            return kind, member_ids
+        if kind == "group":
+            return kind, int(rest)
+        raise ValueError(conversation_key)
+
+    @staticmethod
+    def message_event(message, event_type=None):
+        """
+        消息对应的推送事件，实时推送和补发使用同一格式
+
+        seq 为消息最近一次变更的序号，新消息的 seq 与消息自身的序号相同。
+        """
+        if hasattr(message, "group_id"):
+            return {
+                "type": event_type or "group_chat_message",
+                "conversation": ChatEventLog.group_key(message.group_id),
+                "seq": message.change_seq,
+                "message": GroupMessageSerializer(message).data,
+            }
+        return {
+            "type": event_type or "chat_message",
+            "conversation": ChatEventLog.private_key(message.sender_id, message.recipient_id),
+            "seq": message.change_seq,
+            "message": MessageSerializer(message).data,
+        }
+
+    @staticmethod
+    def append_on_commit(message, event_type=None):
+        """在消息所在事务提交后追加事件，回滚的变更不会进入日志"""
+        event = ChatEventLog.message_event(message, event_type)
+        payload = orjson.dumps(event, default=str)
+        key = ChatEventLog.stream_key(event["conversation"])
+        transaction.on_commit(
+            lambda: ChatEventLog.backend().append(key, event["seq"], payload)
+        )
+
+    @staticmethod
+    def latest_seq(user_id, group_ids, conversation_key):
+        """会话当前的序号；用户不是会话成员时返回 None，group_ids 为用户所在的群"""
+        try:
+            kind, target = ChatEventLog.parse_key(conversation_key)
+        except ValueError:
+            return None
+        if kind == "private":
+            if int(user_id) not in target:
+                return None
+            conversations = Conversation.objects.filter(private_key="{}:{}".format(*target))
+        else:
+            if target not in group_ids:
+                return None
+            conversations = Conversation.objects.filter(group_id=target)
+        return conversations.values_list("last_seq", flat=True).first() or 0
+
+    @staticmethod
+    def missed_events(user_id, group_ids, conversation_key, last_seq):
+        """
+        返回 (事件列表, 是否完整)
+
+        事件流中从 last_seq 之后必须连续覆盖到会话当前序号才算完整，
+        不完整时不返回事件，客户端需要通过接口重新拉取该会话。
+        """
+        latest = ChatEventLog.latest_seq(user_id, group_ids, conversation_key)
+        try:
+            last_seq = int(last_seq)
+        except (TypeError, ValueError):
+            return [], False
+        if latest is None:
+            return [], True
+        if last_seq >= latest:
+            return [], True
+        limit = getattr(settings, "CHAT_EVENT_LOG_RESUME_LIMIT", 200)
+        if latest - last_seq > limit:
+            return [], False
+        entries = ChatEventLog.backend().read_after(
+            ChatEventLog.stream_key(conversation_key), last_seq, limit
+        )
+        seqs = [seq for seq, _ in entries]
+        if seqs != list(range(last_seq + 1, latest + 1)):
+            return [], False
+        return [orjson.loads(payload) for _, payload in entries], True
@@ -0,0 +1,22 @@
+import asyncio
+
+from django.conf import settings
+
+
+async def group_send_many(channel_layer, sends, concurrency=None):
+    """
+    并发执行多条 group_send，sends 为 (房间名, 消息) 的列表
+
+    逐条 await 时每次发送都要等一个 Redis 往返；并发发送时多个请求在连接池中流水线执行，
+    分片部署下不同房间落在不同的 Redis 上，可以同时处理。并发数由
+    CHANNEL_FANOUT_CONCURRENCY 限制，避免一次广播占满连接池。
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, "CHANNEL_FANOUT_CONCURRENCY", 100)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(room, message):
+        async with semaphore:
+            await channel_layer.group_send(room, message)
+
+    await asyncio.gather(*(send(room, message) for room, message in sends))
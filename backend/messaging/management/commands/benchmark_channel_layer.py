@@ -0,0 +1,89 @@
+import asyncio
+import multiprocessing
+import time
+
+from channels.layers import channel_layers
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from messaging.fanout import group_send_many
+
+
+def run_worker(index, rooms, messages, results):
+    """模拟一个 Daphne 进程：每个房间一个连接，向这些房间广播并收齐全部消息"""
+
+    async def main():
+        # fork 出来的进程不能复用父进程的连接，重新创建通道层
+        layer = channel_layers.make_backend("default")
+        channels = []
+        for room in range(rooms):
+            channel = await layer.new_channel()
+            await layer.group_add(f"bench_{index}_{room}", channel)
+            channels.append(channel)
+
+        started = time.perf_counter()
+        await group_send_many(
+            layer,
+            [
+                (f"bench_{index}_{i % rooms}", {"type": "bench", "seq": i})
+                for i in range(messages)
+            ],
+        )
+        received = 0
+        for i in range(messages):
+            await layer.receive(channels[i % rooms])
+            received += 1
+        elapsed = time.perf_counter() - started
+
+        for room, channel in enumerate(channels):
+            await layer.group_discard(f"bench_{index}_{room}", channel)
+        return received, elapsed
+
+    results.put(asyncio.run(main()))
+
+
+class Command(BaseCommand):
+    help = (
+        '通道层广播压测：依次启动 1..N 个进程，每个进程独立广播并接收消息，'
+        '输出总吞吐，用来验证分片部署下吞吐随进程数线性增长'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='最多启动的进程数')
+        parser.add_argument('--rooms', type=int, default=100, help='每个进程的房间数')
+        parser.add_argument('--messages', type=int, default=5000, help='每个进程发送的消息数')
+
+    def handle(self, *args, **options):
+        # 进程内的通道层每个进程各自独立，测不出共享 Redis 时的吞吐
+        backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+        if not backend.startswith('channels_redis.'):
+            raise CommandError(f'压测需要 Redis 通道层，当前为 {backend or "未配置"}')
+        context = multiprocessing.get_context('fork')
+        baseline = None
+        for count in range(1, options['processes'] + 1):
+            results = context.Queue()
+            workers = [
+                context.Process(
+                    target=run_worker,
+                    args=(
+                        index,
+                        options['rooms'],
+                        options['messages'],
+                        results,
+                    ),
+                )
+                for index in range(count)
+            ]
+            for worker in workers:
+                worker.start()
+            outcomes = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+
+            received = sum(item[0] for item in outcomes)
+            elapsed = max(item[1] for item in outcomes)
+            throughput = received / elapsed
+            baseline = baseline or throughput
+            self.stdout.write(
+                f'{count} 个进程: {received} 条消息, {elapsed:.2f}s, '
+                f'{throughput:.0f} 条/秒, 相对单进程 {throughput / baseline:.2f}x'
+            )
@@ -0,0 +1,78 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from messaging.models import GroupChat
+from messaging.persistence import GroupMessagePersister, LocalWal
+from messaging.services import ConversationService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        '群聊消息写入压测：在临时群中分别用逐条写入和延迟批量写入保存消息，'
+        '输出单进程每秒可接收的消息数'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='每种方式写入的消息数')
+        parser.add_argument('--members', type=int, default=50, help='临时群的成员数')
+        parser.add_argument('--batch', type=int, default=200, help='延迟写入每批的消息数')
+
+    def handle(self, *args, **options):
+        prefix = f'bench_{uuid.uuid4().hex[:8]}'
+        User.objects.bulk_create(
+            [
+                User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com')
+                for i in range(options['members'])
+            ]
+        )
+        users = list(User.objects.filter(username__startswith=prefix))
+        group = GroupChat.objects.create(name=prefix, created_by=users[0])
+        group.members.add(*users)
+        ConversationService.get_group(group)
+        try:
+            count = options['messages']
+
+            started = time.perf_counter()
+            for i in range(count):
+                GroupMessagePersister.save_now(users[i % len(users)].id, group.id, f'message {i}')
+            before = count / (time.perf_counter() - started)
+
+            # 使用配置的持久缓冲（GROUP_MESSAGE_WAL_URL），和 accept 的开销一致；
+            # 接收（分配ID、序号并写入缓冲）和批量写入数据库分别计时
+            persister = GroupMessagePersister()
+            wal = persister.wal()
+            reserving = persisting = 0.0
+            batch = []
+            for i in range(count):
+                started = time.perf_counter()
+                batch.append(persister.reserve(users[i % len(users)], group.id, f'message {i}'))
+                reserving += time.perf_counter() - started
+                if len(batch) >= options['batch'] or i == count - 1:
+                    started = time.perf_counter()
+                    persister.persist_and_ack(batch)
+                    persisting += time.perf_counter() - started
+                    batch = []
+            after = count / (reserving + persisting)
+
+            self.stdout.write(f'逐条写入: {before:.0f} 条/秒')
+            self.stdout.write(
+                f'延迟批量写入（每批 {options["batch"]} 条）: {after:.0f} 条/秒, '
+                f'提升 {after / before:.2f}x'
+            )
+            self.stdout.write(
+                f'  其中接收 {count / reserving:.0f} 条/秒（持久缓冲: {type(wal).__name__}）, '
+                f'写入数据库 {count / persisting:.0f} 条/秒'
+            )
+            if isinstance(wal, LocalWal):
+                self.stdout.write(
+                    self.style.WARNING(
+                        '未配置 GROUP_MESSAGE_WAL_URL，持久缓冲为进程内替代，结果不含 Redis 写入的开销'
+                    )
+                )
+        finally:
+            group.delete()
+            User.objects.filter(username__startswith=prefix).delete()
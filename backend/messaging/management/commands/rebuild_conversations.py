@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from messaging.models import Conversation
+from messaging.services import ConversationService
+
+
+class Command(BaseCommand):
+    help = '根据消息表重建会话表（会话列表依赖该表）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--if-empty', action='store_true', help='仅在会话表为空时重建')
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and Conversation.objects.exists():
+            self.stdout.write('会话表已存在数据，跳过重建')
+            return
+        ConversationService.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'已重建 {Conversation.objects.count()} 个会话')
+        )
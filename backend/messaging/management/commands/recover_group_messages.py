@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from messaging.persistence import group_message_persister
+
+
+class Command(BaseCommand):
+    help = '把已退出进程的持久缓冲中还没写入数据库的群聊消息补写入库（群聊消息延迟写入的崩溃恢复）'
+
+    def handle(self, *args, **options):
+        recovered = group_message_persister.recover()
+        self.stdout.write(self.style.SUCCESS(f'已补写 {recovered} 条群聊消息'))
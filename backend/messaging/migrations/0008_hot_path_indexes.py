@@ -0,0 +1,32 @@
+# Generated by Django 4.2.5 on 2026-10-17 16:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0007_conversation"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=models.Index(
+                fields=["group", "timestamp"], name="group_msg_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["sender", "recipient", "-timestamp"], name="msg_pair_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_read", False)),
+                fields=["recipient", "sender"],
+                name="msg_unread_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-17 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0008_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="message",
+            name="msg_pair_time_idx",
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["sender", "recipient", "-id"], name="msg_pair_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0009_message_pair_id_index"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="groupmessage",
+            name="group_msg_time_idx",
+        ),
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=models.Index(
+                fields=["group", "timestamp", "id"], name="group_msg_time_id_idx"
+            ),
+        ),
+    ]
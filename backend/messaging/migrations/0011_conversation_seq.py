@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0010_group_message_time_id_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_seq",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="seq",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="groupmessage",
+            name="seq",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
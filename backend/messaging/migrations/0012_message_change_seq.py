@@ -0,0 +1,32 @@
+# Generated by Django 4.2.5 on 2026-10-17 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0011_conversation_seq"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="change_seq",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="groupmessage",
+            name="change_seq",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["sender", "recipient", "change_seq"], name="msg_pair_change_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=models.Index(fields=["group", "change_seq"], name="group_msg_change_idx"),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-17 22:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0012_message_change_seq"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversationmember",
+            name="last_read_message_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=models.Index(fields=["group", "id"], name="group_msg_id_idx"),
+        ),
+    ]
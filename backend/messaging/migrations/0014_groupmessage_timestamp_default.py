@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-17 22:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("messaging", "0013_read_watermark"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="groupmessage",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
 
 # Create your models here.
@@ -22,9 +23,27 @@ class Message(models.Model):
     file = models.FileField(upload_to="messages/file/", blank=True, null=True)
 
     is_revoked = models.BooleanField(default=False)
+    # 会话内递增的序号，断线重连时按序号补发
+    seq = models.BigIntegerField(null=True, blank=True)
+    # 最近一次新增、编辑或撤回时分配的会话序号，增量同步按它读取
+    change_seq = models.BigIntegerField(null=True, blank=True)
 
     class Meta:
         ordering = ["timestamp"]
+        indexes = [
+            # 两人之间的聊天记录，按消息ID游标分页
+            models.Index(fields=["sender", "recipient", "-id"], name="msg_pair_id_idx"),
+            # 增量同步：两人之间某个变更序号之后的消息
+            models.Index(
+                fields=["sender", "recipient", "change_seq"], name="msg_pair_change_idx"
+            ),
+            # 未读消息计数，只索引未读的行
+            models.Index(
+                fields=["recipient", "sender"],
+                name="msg_unread_idx",
+                condition=models.Q(is_read=False),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender} to {self.recipient}: {self.content[:20]}..."
@@ -53,15 +72,97 @@ class GroupMessage(models.Model):
         User, related_name="group_messages", on_delete=models.CASCADE
     )
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # 不用 auto_now_add：延迟写入时保存的是接收消息时的时间，批量写入前已经设置好
+    timestamp = models.DateTimeField(default=timezone.now)
     is_edited = models.BooleanField(default=False)
     updated_at = models.DateTimeField(auto_now=True)
     image = models.ImageField(upload_to="group_messages/images/", blank=True, null=True)
     file = models.FileField(upload_to="group_messages/file/", blank=True, null=True)
     is_revoked = models.BooleanField(default=False)
+    # 会话内递增的序号，断线重连时按序号补发
+    seq = models.BigIntegerField(null=True, blank=True)
+    # 最近一次新增、编辑或撤回时分配的会话序号，增量同步按它读取
+    change_seq = models.BigIntegerField(null=True, blank=True)
 
     class Meta:
         ordering = ["timestamp"]
+        indexes = [
+            # 群聊记录按 (timestamp, id) 游标分页，倒序翻页时反向扫描
+            models.Index(fields=["group", "timestamp", "id"], name="group_msg_time_id_idx"),
+            # 增量同步：群里某个变更序号之后的消息
+            models.Index(fields=["group", "change_seq"], name="group_msg_change_idx"),
+            # 已读水位之后的未读数
+            models.Index(fields=["group", "id"], name="group_msg_id_idx"),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} in {self.group.name}: {self.content[:20]}..."
+
+
+class Conversation(models.Model):
+    """
+    物化的会话（私聊或群聊）
+
+    记录最后一条消息和最近活动时间，在发消息时事务性地更新，
+    会话列表直接按 ConversationMember 上的活动时间做索引范围读取。
+    """
+
+    PRIVATE = "private"
+    GROUP = "group"
+    CONVERSATION_TYPES = (
+        (PRIVATE, "Private"),
+        (GROUP, "Group"),
+    )
+
+    conversation_type = models.CharField(max_length=10, choices=CONVERSATION_TYPES)
+    # 私聊用 "较小用户ID:较大用户ID" 唯一标识，群聊为空
+    private_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    group = models.OneToOneField(
+        GroupChat,
+        related_name="conversation",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_activity_at = models.DateTimeField()
+    member_count = models.PositiveIntegerField(default=0)
+    # 最近分配的会话序号（新消息、编辑和撤回各占一个）
+    last_seq = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        if self.conversation_type == self.GROUP:
+            return f"group {self.group_id}"
+        return f"private {self.private_key}"
+
+
+class ConversationMember(models.Model):
+    """会话成员，保存每个成员自己的未读数"""
+
+    conversation = models.ForeignKey(
+        Conversation, related_name="memberships", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        User, related_name="conversation_memberships", on_delete=models.CASCADE
+    )
+    # 私聊中的对方，群聊为空
+    peer = models.ForeignKey(
+        User, related_name="+", on_delete=models.CASCADE, null=True, blank=True
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+    # 已读水位：该成员已读到的最大消息ID，未读数按水位之后他人发送的消息统计
+    last_read_message_id = models.BigIntegerField(default=0)
+    # 冗余会话的最近活动时间，配合 (user, -last_activity_at) 索引排序
+    last_activity_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("conversation", "user")
+        indexes = [
+            models.Index(
+                fields=["user", "-last_activity_at"], name="conv_member_activity_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}"
@@ -0,0 +1,417 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+import orjson
+import redis
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, DataError, IntegrityError, connection, transaction
+from django.db.models import Exists, F, Max, OuterRef, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from interactions.counters import UnreadCounterService
+from .eventlog import ChatEventLog
+from .models import Conversation, ConversationMember, GroupChat, GroupMessage
+from .services import ConversationSequence, ConversationService
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# 所有进程的持久缓冲键，崩溃恢复时据此查找
+WAL_KEYS = "group_message_wal:keys"
+# 无法写入数据库的消息，保留下来人工排查
+WAL_DEAD_LETTERS = "group_message_wal:dead"
+
+
+class GroupMessageIds:
+    """
+    预分配群聊消息ID
+
+    PostgreSQL 一次从表的序列中取一批号，和普通 INSERT 使用同一个序列，不会冲突；
+    其他数据库没有可以批量取号的序列，从缓存计数器在当前最大ID之后分配，
+    只适合没有其他写入的单进程开发环境。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.block = deque()
+
+    def take(self):
+        with self.lock:
+            if not self.block:
+                self.block.extend(
+                    self.reserve(getattr(settings, "GROUP_MESSAGE_ID_BLOCK", 100))
+                )
+            return self.block.popleft()
+
+    @staticmethod
+    def reserve(count):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                    "FROM generate_series(1, %s)",
+                    [GroupMessage._meta.db_table, count],
+                )
+                return [row[0] for row in cursor.fetchall()]
+        key = "group_message_ids"
+        try:
+            end = cache.incr(key, count)
+        except ValueError:
+            latest = GroupMessage.objects.aggregate(latest=Max("id"))["latest"] or 0
+            cache.add(key, latest, None)
+            end = cache.incr(key, count)
+        return list(range(end - count + 1, end + 1))
+
+
+class RedisWal:
+    """
+    每个进程一个 Redis 哈希，保存已经接收、还没有写入数据库的消息
+
+    name 在每次进程启动时随机生成，重启后的进程（即使 PID 相同）不会被当成之前的进程，
+    之前留下的缓冲可以被恢复。后台线程定时刷新进程存活标记，和有没有消息写入无关，
+    空闲的进程不会被误判为已经退出。
+    """
+
+    def __init__(self, url, name):
+        self.client = redis.Redis.from_url(url)
+        self.key = f"group_message_wal:{name}"
+        self.alive_key = f"group_message_wal:alive:{name}"
+        self.heartbeat()
+        threading.Thread(target=self.keep_alive, daemon=True).start()
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, "GROUP_MESSAGE_WAL_HEARTBEAT", 30)
+
+    def heartbeat(self):
+        self.client.set(self.alive_key, 1, ex=self.ttl())
+
+    def keep_alive(self):
+        while True:
+            time.sleep(self.ttl() / 3)
+            try:
+                self.heartbeat()
+            except redis.RedisError:
+                logger.warning("刷新持久缓冲存活标记失败", exc_info=True)
+
+    def write(self, message_id, payload):
+        pipe = self.client.pipeline()
+        pipe.hset(self.key, message_id, payload)
+        pipe.sadd(WAL_KEYS, self.key)
+        pipe.execute()
+
+    def ack(self, message_ids):
+        if message_ids:
+            self.client.hdel(self.key, *message_ids)
+
+    def dead_letter(self, message_id, payload):
+        self.client.hset(WAL_DEAD_LETTERS, message_id, payload)
+
+    def orphans(self):
+        """
+        已经退出的进程留下的缓冲，返回 [(键, [消息])]
+
+        多个进程同时检查时，每份缓冲用一个短时间的锁交给其中一个进程恢复。
+        """
+        result = []
+        for key in self.client.smembers(WAL_KEYS):
+            key = key.decode()
+            name = key.split(":", 1)[1]
+            if self.client.exists(f"group_message_wal:alive:{name}"):
+                continue
+            if not self.client.set(
+                f"group_message_wal:recovering:{name}", 1, nx=True, ex=self.ttl()
+            ):
+                continue
+            result.append((key, list(self.client.hgetall(key).values())))
+        return result
+
+    def drop(self, key, message_ids):
+        if message_ids:
+            self.client.hdel(key, *message_ids)
+        if not self.client.hlen(key):
+            self.client.srem(WAL_KEYS, key)
+
+
+class LocalWal:
+    """没有 Redis 时的进程内替代，进程退出后缓冲随之丢失，只适合本地开发和测试"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dead = {}
+
+    def write(self, message_id, payload):
+        with self.lock:
+            self.entries[message_id] = payload
+
+    def ack(self, message_ids):
+        with self.lock:
+            for message_id in message_ids:
+                self.entries.pop(message_id, None)
+
+    def dead_letter(self, message_id, payload):
+        with self.lock:
+            self.dead[message_id] = payload
+
+    def orphans(self):
+        return []
+
+    def drop(self, key, message_ids):
+        pass
+
+
+class GroupMessagePersister:
+    """
+    群聊消息延迟批量写入（GROUP_MESSAGE_WRITE_BEHIND 开启时由 ChatConsumer 使用）
+
+    接收消息时只预分配ID和会话序号、写入持久缓冲，立即返回用于推送；
+    每隔 GROUP_MESSAGE_FLUSH_INTERVAL 秒或积累 GROUP_MESSAGE_FLUSH_SIZE 条时在一个事务中
+    bulk_create，并按群合并更新会话、未读数和事件日志，成功后从持久缓冲中删除。
+    进程崩溃时持久缓冲中还没写入的消息由其他进程补写：每个进程开始接收消息时检查一次，
+    之后每隔 GROUP_MESSAGE_RECOVER_INTERVAL 秒检查一次；也可以运行 recover_group_messages 命令。
+    """
+
+    def __init__(self):
+        self.ids = GroupMessageIds()
+        self.pending = []
+        self.flusher = None
+        self.recoverer = None
+        self._wal = None
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, "GROUP_MESSAGE_WRITE_BEHIND", False)
+
+    @staticmethod
+    def wal_backend():
+        url = getattr(settings, "GROUP_MESSAGE_WAL_URL", None)
+        if not url:
+            return LocalWal()
+        return RedisWal(url, uuid.uuid4().hex)
+
+    def wal(self):
+        if self._wal is None:
+            self._wal = self.wal_backend()
+        return self._wal
+
+    @staticmethod
+    def encode(message):
+        return orjson.dumps(
+            {
+                "id": message.id,
+                "group_id": message.group_id,
+                "sender_id": message.sender_id,
+                "content": message.content,
+                "timestamp": message.timestamp.isoformat(),
+                "seq": message.seq,
+            }
+        )
+
+    @staticmethod
+    def decode(payload):
+        data = orjson.loads(payload)
+        return GroupMessage(
+            id=data["id"],
+            group_id=data["group_id"],
+            sender_id=data["sender_id"],
+            content=data["content"],
+            timestamp=parse_datetime(data["timestamp"]),
+            seq=data["seq"],
+            change_seq=data["seq"],
+        )
+
+    @staticmethod
+    def save_now(sender_id, group_id, content):
+        """立即写入一条群聊消息（未开启延迟写入时的路径）"""
+        sender = User.objects.get(id=sender_id)
+        group = GroupChat.objects.get(id=group_id)
+        with transaction.atomic():
+            message = GroupMessage.objects.create(sender=sender, group=group, content=content)
+            ConversationService.record_group_message(message)
+        return message
+
+    def reserve(self, sender, group_id, content):
+        """分配ID和序号并写入持久缓冲，返回还没有写入数据库的消息"""
+        message = GroupMessage(
+            id=self.ids.take(),
+            group_id=int(group_id),
+            sender=sender,
+            content=content,
+            timestamp=timezone.now(),
+        )
+        message.seq = message.change_seq = ConversationSequence.next(
+            ChatEventLog.group_key(message.group_id)
+        )
+        self.wal().write(message.id, self.encode(message))
+        return message
+
+    async def accept(self, sender, group_id, content):
+        if self.recoverer is None or self.recoverer.done():
+            self.recoverer = asyncio.ensure_future(self.recover_periodically())
+        message = await database_sync_to_async(self.reserve)(sender, group_id, content)
+        self.pending.append(message)
+        if len(self.pending) >= getattr(settings, "GROUP_MESSAGE_FLUSH_SIZE", 200):
+            await self.flush()
+        elif self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self.flush_later())
+        return message
+
+    async def recover_periodically(self):
+        while True:
+            try:
+                recovered = await database_sync_to_async(self.recover)()
+                if recovered:
+                    logger.warning("补写了 %d 条已退出进程遗留的群聊消息", recovered)
+            except Exception:
+                logger.exception("补写遗留的群聊消息失败")
+            await asyncio.sleep(getattr(settings, "GROUP_MESSAGE_RECOVER_INTERVAL", 60))
+
+    async def flush_later(self):
+        await asyncio.sleep(getattr(settings, "GROUP_MESSAGE_FLUSH_INTERVAL", 0.2))
+        await self.flush()
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            retry = await database_sync_to_async(self.persist_and_ack)(batch)
+        except Exception:
+            logger.exception("批量写入 %d 条群聊消息失败", len(batch))
+            retry = batch
+        if retry:
+            # 数据库暂时不可用时消息仍在持久缓冲中，放回队列等下一次重试
+            self.pending = retry + self.pending
+            if self.flusher is None or self.flusher.done():
+                self.flusher = asyncio.ensure_future(self.flush_later())
+
+    def persist_and_ack(self, batch):
+        """写入并确认一批消息，返回需要稍后重试的消息"""
+        _, retry = self.persist_safely(batch)
+        retry_ids = {message.id for message in retry}
+        self.wal().ack([message.id for message in batch if message.id not in retry_ids])
+        return retry
+
+    def persist_safely(self, messages):
+        """
+        写入一批消息，整批失败时逐条重试，返回 (写入的条数, 需要稍后重试的消息)
+
+        数据本身有问题（如违反约束）的消息转入死信，不再重试，不会挡住其他消息；
+        其他数据库错误（如连接断开）的消息留待重试。
+        """
+        try:
+            return self.persist(messages), []
+        except DatabaseError:
+            logger.exception("批量写入 %d 条群聊消息失败，改为逐条写入", len(messages))
+        written, retry = 0, []
+        for message in messages:
+            try:
+                written += self.persist([message])
+            except (IntegrityError, DataError):
+                logger.exception("群聊消息 %s 无法写入，已转入死信", message.id)
+                self.wal().dead_letter(message.id, self.encode(message))
+            except DatabaseError:
+                retry.append(message)
+        return written, retry
+
+    @staticmethod
+    @transaction.atomic
+    def persist(messages):
+        """
+        在一个事务中写入一批已分配ID和序号的群聊消息，返回写入的条数
+
+        已经在数据库中的消息会被跳过，重试和崩溃恢复可以重复执行。
+        """
+        existing = set(
+            GroupMessage.objects.filter(id__in=[m.id for m in messages]).values_list(
+                "id", flat=True
+            )
+        )
+        groups = GroupChat.objects.in_bulk({m.group_id for m in messages})
+        senders = User.objects.in_bulk({m.sender_id for m in messages})
+        # 缓冲期间被删除的群和用户，消息一起丢弃
+        messages = [
+            m
+            for m in messages
+            if m.id not in existing and m.group_id in groups and m.sender_id in senders
+        ]
+        for message in messages:
+            message.sender = senders[message.sender_id]
+        if not messages:
+            return 0
+        # timestamp 为接收消息时的时间，和推送给客户端的一致
+        GroupMessage.objects.bulk_create(messages)
+
+        by_group = defaultdict(list)
+        for message in messages:
+            by_group[message.group_id].append(message)
+        for group_id, batch in by_group.items():
+            conversation = ConversationService.get_group(groups[group_id])
+            last = max(batch, key=lambda message: message.seq)
+            # 缓冲期间已经写入了序号更大的消息（如逐条写入或其他进程先写入）时，最后一条消息不回退
+            newer = GroupMessage.objects.filter(id=OuterRef("last_message_id"), seq__gt=last.seq)
+            Conversation.objects.filter(pk=conversation.pk).exclude(Exists(newer)).update(
+                last_message_id=last.id, last_activity_at=last.timestamp
+            )
+            Conversation.objects.filter(pk=conversation.pk).update(
+                last_seq=Greatest(F("last_seq"), Value(last.seq))
+            )
+            members = ConversationMember.objects.filter(conversation=conversation)
+            members.update(
+                last_activity_at=Greatest(F("last_activity_at"), Value(last.timestamp))
+            )
+
+            # 每个成员的未读数增加这批消息中别人发送、并且在已读水位之后的条数，
+            # 增量相同的成员一条 UPDATE；锁住成员行，和同时移动水位的 read_up_to 依次执行
+            increments = defaultdict(list)
+            member_ids = []
+            for user_id, last_read_message_id in members.select_for_update().values_list(
+                "user_id", "last_read_message_id"
+            ):
+                member_ids.append(user_id)
+                increment = sum(
+                    1
+                    for message in batch
+                    if message.sender_id != user_id
+                    and message.id > last_read_message_id
+                )
+                if increment:
+                    increments[increment].append(user_id)
+            for increment, user_ids in increments.items():
+                members.filter(user_id__in=user_ids).update(
+                    unread_count=F("unread_count") + increment
+                )
+            UnreadCounterService.messages_changed(
+                [user_id for user_ids in increments.values() for user_id in user_ids]
+            )
+            # 推送后、写入前已经标记的已读
+            ConversationService.apply_pending_reads(group_id, member_ids)
+            for message in batch:
+                ChatEventLog.append_on_commit(message)
+        return len(messages)
+
+    def recover(self):
+        """补写已退出进程的持久缓冲中还没写入数据库的消息，返回补写的条数"""
+        total = 0
+        wal = self.wal()
+        for key, payloads in wal.orphans():
+            messages = [self.decode(payload) for payload in payloads]
+            written, retry = self.persist_safely(messages)
+            total += written
+            retry_ids = {message.id for message in retry}
+            wal.drop(key, [message.id for message in messages if message.id not in retry_ids])
+        return total
+
+
+group_message_persister = GroupMessagePersister()
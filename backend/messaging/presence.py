@@ -0,0 +1,208 @@
+import asyncio
+from collections import defaultdict
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from accounts.services import FollowerService
+from .fanout import group_send_many
+from .services import GroupMembershipService
+
+
+class PresenceService:
+    """
+    缓存中的在线状态（部署环境为 Redis，多个 Daphne 进程共享）
+
+    每个用户一个连接计数 presence:{id}，连接时加一、断开时减一，心跳刷新过期时间；
+    进程崩溃没有正常断开时，计数在 PRESENCE_TTL 秒没有心跳后自动失效。
+    最近一次广播出去的状态记在 presence:announced:{id}，状态没有变化时不再广播。
+    """
+
+    ONLINE = "online"
+    OFFLINE = "offline"
+
+    @staticmethod
+    def key(user_id):
+        return f"presence:{user_id}"
+
+    @staticmethod
+    def announced_key(user_id):
+        return f"presence:announced:{user_id}"
+
+    @staticmethod
+    def last_seen_key(user_id):
+        return f"presence:seen:{user_id}"
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, "PRESENCE_TTL", 90)
+
+    @staticmethod
+    def connected(user_id):
+        """新连接建立，返回该用户当前的连接数"""
+        key = PresenceService.key(user_id)
+        cache.add(key, 0, PresenceService.ttl())
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # add 和 incr 之间计数恰好过期
+            cache.add(key, 1, PresenceService.ttl())
+            count = 1
+        cache.touch(key, PresenceService.ttl())
+        return count
+
+    @staticmethod
+    def disconnected(user_id):
+        """连接断开，返回剩余的连接数"""
+        key = PresenceService.key(user_id)
+        cache.set(PresenceService.last_seen_key(user_id), timezone.now().isoformat(), None)
+        try:
+            count = cache.decr(key)
+        except ValueError:
+            return 0
+        if count <= 0:
+            cache.delete(key)
+        return max(count, 0)
+
+    @staticmethod
+    def heartbeat(user_id):
+        """
+        刷新在线状态的过期时间，计数已经过期的重新记为在线
+
+        返回是否重新记为在线：计数过期期间用户已经显示为离线，调用方需要重新广播状态。
+        """
+        key = PresenceService.key(user_id)
+        if cache.touch(key, PresenceService.ttl()):
+            return False
+        return cache.add(key, 1, PresenceService.ttl())
+
+    @staticmethod
+    def is_online(user_id):
+        return bool(cache.get(PresenceService.key(user_id)))
+
+    @staticmethod
+    def statuses(user_ids):
+        """批量查询在线状态，返回 {user_id: {"status": ..., "last_seen": ...}}"""
+        keys = {}
+        for user_id in user_ids:
+            keys[PresenceService.key(user_id)] = user_id
+            keys[PresenceService.last_seen_key(user_id)] = user_id
+        values = cache.get_many(list(keys))
+        return {
+            user_id: {
+                "status": PresenceService.ONLINE
+                if values.get(PresenceService.key(user_id))
+                else PresenceService.OFFLINE,
+                "last_seen": values.get(PresenceService.last_seen_key(user_id)),
+            }
+            for user_id in user_ids
+        }
+
+    @staticmethod
+    def announce(user_id, status):
+        """记录要广播的状态，和上一次广播的相同时返回 False"""
+        key = PresenceService.announced_key(user_id)
+        if cache.get(key) == status:
+            return False
+        cache.set(key, status, None)
+        return True
+
+    @staticmethod
+    def collect_digest(changes):
+        """
+        把一批状态变化按接收房间分组，返回 {房间名: [{"user_id": ..., "status": ...}]}
+
+        changes 为 {user_id: 用户所在的群ID}，群ID为 None 时从缓存的群成员中查询；
+        状态以收集时缓存中的为准，窗口内先下线又上线的用户状态没有变化，不会广播。
+        """
+        rooms = defaultdict(list)
+        for user_id, group_ids in changes.items():
+            if group_ids is None:
+                group_ids = GroupMembershipService.group_ids(user_id)
+            status = (
+                PresenceService.ONLINE
+                if PresenceService.is_online(user_id)
+                else PresenceService.OFFLINE
+            )
+            if not PresenceService.announce(user_id, status):
+                continue
+            item = {"user_id": user_id, "status": status}
+            for group_id in group_ids:
+                rooms[f"group_{group_id}"].append(item)
+            for follower_id in FollowerService.follower_ids(user_id):
+                rooms[f"user_{follower_id}"].append(item)
+        return dict(rooms)
+
+
+class PresenceDigest:
+    """
+    本进程内的状态变化缓冲
+
+    连接和断开只记录变化，每隔 PRESENCE_DIGEST_INTERVAL 秒合并一次，
+    每个接收房间只发送一条 presence_digest；这段间隔同时起到防抖的作用。
+
+    所在进程崩溃的用户没有断开事件，计数过期时也不会有任何通知。
+    本进程的连接收到过在线状态的用户记在 watched 中，每隔 PRESENCE_TTL 秒检查一次，
+    计数已经过期的作为一次状态变化提交；多个进程同时发现时由 announce 去重，只广播一次。
+    """
+
+    def __init__(self):
+        self.changes = {}
+        self.flusher = None
+        self.watched = set()
+        self.sweeper = None
+
+    def submit(self, user_id, group_ids=None):
+        self.changes[user_id] = None if group_ids is None else set(group_ids)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self.flush_later())
+
+    def watch(self, statuses):
+        """记下本进程的连接收到的状态，在线的用户之后检查是否过期"""
+        for item in statuses:
+            if item["status"] == PresenceService.ONLINE:
+                self.watched.add(item["user_id"])
+            else:
+                self.watched.discard(item["user_id"])
+        if self.watched and (self.sweeper is None or self.sweeper.done()):
+            self.sweeper = asyncio.ensure_future(self.sweep_later())
+
+    def expired(self):
+        """返回 watched 中计数已经过期的用户，并停止检查这些用户"""
+        statuses = PresenceService.statuses(list(self.watched))
+        expired = [
+            user_id
+            for user_id, item in statuses.items()
+            if item["status"] == PresenceService.OFFLINE
+        ]
+        self.watched.difference_update(expired)
+        return expired
+
+    async def sweep_later(self):
+        while self.watched:
+            await asyncio.sleep(PresenceService.ttl())
+            for user_id in await database_sync_to_async(self.expired)():
+                self.submit(user_id)
+
+    async def flush_later(self):
+        await asyncio.sleep(getattr(settings, "PRESENCE_DIGEST_INTERVAL", 3))
+        await self.flush()
+
+    async def flush(self):
+        changes, self.changes = self.changes, {}
+        if not changes:
+            return
+        rooms = await database_sync_to_async(PresenceService.collect_digest)(changes)
+        await group_send_many(
+            get_channel_layer(),
+            [
+                (room, {"type": "presence_digest", "statuses": statuses})
+                for room, statuses in rooms.items()
+            ],
+        )
+
+
+status_digest = PresenceDigest()
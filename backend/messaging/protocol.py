@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from collections import namedtuple
+from urllib.parse import parse_qs
+
+import msgpack
+import orjson
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FrameCodec:
+    """
+    WebSocket 帧的编码方式，由客户端在连接地址中选择
+
+    json：文本帧，使用 orjson 序列化，比标准库 json 快且输出更紧凑；
+    msgpack：二进制帧，数字和短字符串更省字节，适合非浏览器客户端。
+    """
+
+    JSON = "json"
+    MSGPACK = "msgpack"
+    ENCODINGS = (JSON, MSGPACK)
+
+    def __init__(self, encoding=JSON):
+        self.encoding = encoding if encoding in self.ENCODINGS else self.JSON
+
+    @property
+    def binary(self):
+        return self.encoding == self.MSGPACK
+
+    def encode(self, event):
+        if self.binary:
+            return msgpack.packb(event, default=str)
+        # 和 json.dumps 一样允许非字符串的键（如以用户ID为键的字典）
+        return orjson.dumps(
+            event, default=str, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return msgpack.unpackb(bytes_data)
+        return orjson.loads(text_data)
+
+
+ProtocolOptions = namedtuple("ProtocolOptions", ["codec", "batch", "lazy_groups"])
+
+
+def negotiate(scope):
+    """
+    从连接地址的查询参数中读取协议选项：?encoding=msgpack&batch=1&groups=lazy
+
+    groups=lazy 时连接只订阅客户端标记为活跃的群聊，其余群只收到新消息提示。
+    未指定时保持原来的协议：每个事件一个 JSON 文本帧，连接时加入所有群聊房间。
+    """
+    params = parse_qs(scope.get("query_string", b"").decode())
+
+    def flag(name, *values):
+        return params.get(name, [""])[0] in values
+
+    return ProtocolOptions(
+        codec=FrameCodec(params.get("encoding", [FrameCodec.JSON])[0]),
+        batch=flag("batch", "1", "true"),
+        lazy_groups=flag("groups", "lazy"),
+    )
+
+
+class FrameBatcher:
+    """
+    把短时间内要推送给同一连接的事件合并为一帧
+
+    第一个事件到达后等待 WEBSOCKET_BATCH_WINDOW 秒，期间到达的事件一起以
+    {"type": "batch", "events": [...]} 发送；积累到 WEBSOCKET_BATCH_SIZE 条时立即发送。
+    """
+
+    def __init__(self, send_frame):
+        self.send_frame = send_frame
+        self.events = []
+        self.flusher = None
+
+    async def add(self, event):
+        self.events.append(event)
+        if len(self.events) >= getattr(settings, "WEBSOCKET_BATCH_SIZE", 50):
+            await self.flush()
+        elif self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(getattr(settings, "WEBSOCKET_BATCH_WINDOW", 0.05))
+        await self.flush()
+
+    async def flush(self):
+        events, self.events = self.events, []
+        if not events:
+            return
+        if len(events) == 1:
+            await self.send_frame(events[0])
+        else:
+            await self.send_frame({"type": "batch", "events": events})
+
+    async def close(self):
+        """
+        连接关闭时取消等待中的定时发送，立即发送缓冲中剩下的事件
+
+        客户端已经断开时发送会失败，这里尽力而为，失败的事件丢弃，重连后由 resume 补发。
+        """
+        if self.flusher is not None and not self.flusher.done():
+            self.flusher.cancel()
+        try:
+            await self.flush()
+        except Exception:
+            logger.debug("关闭连接时发送剩余事件失败", exc_info=True)
+        finally:
+            self.events = []
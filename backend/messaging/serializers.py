@@ -53,15 +53,25 @@ class MessageSerializer(serializers.ModelSerializer):
             "file",
             "image",
             "is_revoked",
+            "seq",
+            "change_seq",
+        ]
+        read_only_fields = [
+            "sender",
+            "timestamp",
+            "updated_at",
+            "is_edited",
+            "seq",
+            "change_seq",
         ]
-        read_only_fields = ["sender", "timestamp", "updated_at", "is_edited"]
 
 
 class GroupMessageSerializer(serializers.ModelSerializer):
     """群聊消息序列化器"""
 
     sender = UserSerializer(read_only=True)
-    group = GroupChatSerializer(read_only=True)
+    # 只返回群ID，群信息由 /group-chats/<id>/ 单独获取
+    group = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = GroupMessage
@@ -76,8 +86,17 @@ class GroupMessageSerializer(serializers.ModelSerializer):
             "file",
             "image",
             "is_revoked",
+            "seq",
+            "change_seq",
+        ]
+        read_only_fields = [
+            "sender",
+            "timestamp",
+            "updated_at",
+            "is_edited",
+            "seq",
+            "change_seq",
         ]
-        read_only_fields = ["sender", "timestamp", "updated_at", "is_edited"]
 
 
 class GroupMessageCreateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,645 @@
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, Value
+from django.db.models.functions import Greatest, Least
+
+from interactions.counters import UnreadCounterService
+from .eventlog import ChatEventLog
+from .models import (
+    Conversation,
+    ConversationMember,
+    GroupChat,
+    GroupMessage,
+    Message,
+)
+
+logger = logging.getLogger(__name__)
+
+# 已读到还没写入数据库的群聊消息时，这条已读记录的保留时间（秒）
+PENDING_READ_TIMEOUT = 60
+
+
+class ConversationService:
+    """维护物化的会话表：最后一条消息、最近活动时间和每个成员的未读数"""
+
+    @staticmethod
+    def private_key(user_id, other_id):
+        low, high = sorted([int(user_id), int(other_id)])
+        return f"{low}:{high}"
+
+    @staticmethod
+    def get_private(user_id, other_id, activity_at):
+        """获取（不存在时创建）两个用户之间的私聊会话"""
+        conversation, created = Conversation.objects.get_or_create(
+            private_key=ConversationService.private_key(user_id, other_id),
+            defaults={
+                "conversation_type": Conversation.PRIVATE,
+                "last_activity_at": activity_at,
+                "member_count": 2,
+            },
+        )
+        if created:
+            ConversationMember.objects.bulk_create(
+                [
+                    ConversationMember(
+                        conversation=conversation,
+                        user_id=user_id,
+                        peer_id=other_id,
+                        last_activity_at=activity_at,
+                    ),
+                    ConversationMember(
+                        conversation=conversation,
+                        user_id=other_id,
+                        peer_id=user_id,
+                        last_activity_at=activity_at,
+                    ),
+                ],
+                ignore_conflicts=True,
+            )
+        return conversation
+
+    @staticmethod
+    def get_group(group):
+        """获取（不存在时创建）群聊对应的会话，创建时同步全部成员"""
+        conversation, created = Conversation.objects.get_or_create(
+            group=group,
+            defaults={
+                "conversation_type": Conversation.GROUP,
+                "last_activity_at": group.created_at,
+            },
+        )
+        if created:
+            member_ids = list(group.members.values_list("id", flat=True))
+            ConversationMember.objects.bulk_create(
+                [
+                    ConversationMember(
+                        conversation=conversation,
+                        user_id=user_id,
+                        last_activity_at=conversation.last_activity_at,
+                    )
+                    for user_id in member_ids
+                ],
+                ignore_conflicts=True,
+            )
+            Conversation.objects.filter(pk=conversation.pk).update(member_count=len(member_ids))
+            conversation.member_count = len(member_ids)
+        return conversation
+
+    @staticmethod
+    def _touch(conversation, message):
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message_id=message.id, last_activity_at=message.timestamp
+        )
+        ConversationMember.objects.filter(conversation=conversation).update(
+            last_activity_at=message.timestamp
+        )
+
+    @staticmethod
+    def _next_seq(conversation):
+        """
+        分配会话内递增的序号，新消息、编辑和撤回各占一个
+
+        UPDATE 会锁住会话行，并发写入同一会话的事务依次拿到连续的序号。
+        群聊消息延迟写入开启时，群聊的序号改由缓存计数器分配，和写入前就要编号的消息共用。
+        """
+        if conversation.group_id and ConversationSequence.enabled():
+            seq = ConversationSequence.next(ChatEventLog.group_key(conversation.group_id))
+            Conversation.objects.filter(pk=conversation.pk).update(
+                last_seq=Greatest(F("last_seq"), Value(seq))
+            )
+            return seq
+        Conversation.objects.filter(pk=conversation.pk).update(last_seq=F("last_seq") + 1)
+        return (
+            Conversation.objects.filter(pk=conversation.pk)
+            .values_list("last_seq", flat=True)
+            .get()
+        )
+
+    @staticmethod
+    def _assign_seq(conversation, message):
+        """新消息的序号同时是它的第一个变更序号"""
+        message.seq = message.change_seq = ConversationService._next_seq(conversation)
+        type(message).objects.filter(pk=message.pk).update(
+            seq=message.seq, change_seq=message.change_seq
+        )
+        ChatEventLog.append_on_commit(message)
+
+    @staticmethod
+    @transaction.atomic
+    def message_changed(message):
+        """消息被编辑或撤回：分配新的变更序号，增量同步和重连补发都能取到最新内容"""
+        if hasattr(message, "group_id"):
+            conversation = ConversationService.get_group(message.group)
+        else:
+            conversation = ConversationService.get_private(
+                message.sender_id, message.recipient_id, message.timestamp
+            )
+        message.change_seq = ConversationService._next_seq(conversation)
+        type(message).objects.filter(pk=message.pk).update(change_seq=message.change_seq)
+        ChatEventLog.append_on_commit(message, "message_updated")
+
+    @staticmethod
+    @transaction.atomic
+    def record_private_message(message):
+        """新私聊消息：更新最后一条消息、分配序号，接收者未读数 +1"""
+        conversation = ConversationService.get_private(
+            message.sender_id, message.recipient_id, message.timestamp
+        )
+        ConversationService._touch(conversation, message)
+        ConversationService._assign_seq(conversation, message)
+        ConversationMember.objects.filter(
+            conversation=conversation, user_id=message.recipient_id
+        ).update(unread_count=F("unread_count") + 1)
+        UnreadCounterService.messages_changed([message.recipient_id])
+        return conversation
+
+    @staticmethod
+    @transaction.atomic
+    def record_group_message(message):
+        """新群聊消息：更新最后一条消息、分配序号，除发送者外所有成员未读数 +1"""
+        conversation = ConversationService.get_group(message.group)
+        ConversationService._touch(conversation, message)
+        ConversationService._assign_seq(conversation, message)
+        members = ConversationMember.objects.filter(conversation=conversation).exclude(
+            user_id=message.sender_id
+        )
+        UnreadCounterService.messages_changed(members.values_list("user_id", flat=True))
+        members.update(unread_count=F("unread_count") + 1)
+        return conversation
+
+    @staticmethod
+    def private_message_read(message):
+        """单条私聊消息被标记为已读"""
+        ConversationMember.objects.filter(
+            conversation__private_key=ConversationService.private_key(
+                message.sender_id, message.recipient_id
+            ),
+            user_id=message.recipient_id,
+        ).update(unread_count=Greatest(F("unread_count") - 1, Value(0)))
+        UnreadCounterService.messages_changed([message.recipient_id])
+
+    @staticmethod
+    def pending_read_key(group_id, user_id):
+        return f"pending_read:{group_id}:{user_id}"
+
+    @staticmethod
+    def mark_pending_read(group_id, user_id, message_id):
+        """记下用户已读到的、还在延迟写入缓冲中的群聊消息，过期后不再生效"""
+        key = ConversationService.pending_read_key(group_id, user_id)
+        cache.set(key, max(cache.get(key) or 0, message_id), PENDING_READ_TIMEOUT)
+
+    @staticmethod
+    def apply_pending_reads(group_id, user_ids):
+        """
+        群聊消息写入数据库后，把之前记下的已读移动到水位上
+
+        在写入消息的事务中调用；已读的消息还没有全部写入时保留记录，等之后的批次。
+        """
+        keys = {
+            ConversationService.pending_read_key(group_id, user_id): user_id
+            for user_id in user_ids
+        }
+        pending = cache.get_many(list(keys))
+        if not pending:
+            return
+        last_message_id = (
+            Conversation.objects.filter(group_id=group_id)
+            .values_list("last_message_id", flat=True)
+            .first()
+            or 0
+        )
+        conversation_key = ChatEventLog.group_key(group_id)
+        done = []
+        for key, message_id in pending.items():
+            ConversationService.read_up_to(keys[key], conversation_key, message_id)
+            if message_id <= last_message_id:
+                done.append(key)
+        if done:
+            transaction.on_commit(lambda: cache.delete_many(done))
+
+    @staticmethod
+    def group_read(group_id, user):
+        """用户查看了群聊消息，已读水位移到最新一条"""
+        last_message_id = (
+            Conversation.objects.filter(group_id=group_id)
+            .values_list("last_message_id", flat=True)
+            .first()
+        )
+        if last_message_id:
+            ConversationService.read_up_to(
+                user.id, ChatEventLog.group_key(group_id), last_message_id
+            )
+
+    @staticmethod
+    @transaction.atomic
+    def read_up_to(user_id, conversation_key, message_id):
+        """
+        把用户在会话中的已读水位移到 message_id，水位有变化时返回 True
+
+        水位只前进不后退，一条 UPDATE 完成；私聊同时批量把对方发来的消息标记为已读。
+        message_id 不会超过会话的最后一条消息，客户端传入过大的ID不能让水位越过之后的新消息。
+        未读数按水位之后他人发送的消息重新统计，事务提交后向对方（群聊为群房间）
+        推送一条合并的已读回执。
+        """
+        kind, target = ChatEventLog.parse_key(conversation_key)
+        user_id = int(user_id)
+        if kind == "group":
+            members = ConversationMember.objects.filter(
+                conversation__group_id=target, user_id=user_id
+            )
+            receipt_room = f"group_{target}"
+        else:
+            if user_id not in target:
+                return False
+            peer_id = target[1] if target[0] == user_id else target[0]
+            members = ConversationMember.objects.filter(
+                conversation__private_key="{}:{}".format(*target), user_id=user_id
+            )
+            unread = Message.objects.filter(
+                sender_id=peer_id, recipient_id=user_id, is_read=False
+            )
+            receipt_room = f"user_{peer_id}"
+
+        membership = members.values_list("id", "conversation__last_message_id").first()
+        if membership is None:
+            return False
+        last_message_id = membership[1] or 0
+        message_id = int(message_id)
+        if message_id > last_message_id and kind == "group" and ConversationSequence.enabled():
+            # 延迟写入时消息先推送再写入数据库，已读到还没写入的消息先记下，写入后再移动水位
+            ConversationService.mark_pending_read(target, user_id, message_id)
+        message_id = min(message_id, last_message_id)
+        if not message_id:
+            return False
+        if kind == "group":
+            unread = GroupMessage.objects.filter(group_id=target, id__gt=message_id).exclude(
+                sender_id=user_id
+            )
+
+        moved = members.filter(last_read_message_id__lt=message_id).update(
+            last_read_message_id=message_id
+        )
+        if not moved:
+            return False
+        if kind == "private":
+            unread.filter(id__lte=message_id).update(is_read=True)
+        members.update(unread_count=unread.count())
+        UnreadCounterService.messages_changed([user_id])
+
+        receipt = {
+            "type": "message_read",
+            "conversation": ChatEventLog.group_key(target)
+            if kind == "group"
+            else ChatEventLog.private_key(*target),
+            "message_id": message_id,
+            "read_by": user_id,
+        }
+
+        def send():
+            channel_layer = get_channel_layer()
+            if channel_layer is None:
+                return
+            try:
+                async_to_sync(channel_layer.group_send)(receipt_room, receipt)
+            except Exception:
+                # 回执推送失败不影响已读状态，对方刷新后可以看到
+                logger.warning("已读回执推送失败", exc_info=True)
+
+        transaction.on_commit(send)
+        return True
+
+    @staticmethod
+    @transaction.atomic
+    def private_message_deleted(message):
+        """删除的是最后一条消息时，把指针移到剩余的最新一条"""
+        if not message.is_read:
+            ConversationService.private_message_read(message)
+        key = ConversationService.private_key(message.sender_id, message.recipient_id)
+        conversation = Conversation.objects.filter(
+            private_key=key, last_message_id=message.id
+        ).first()
+        if conversation is None:
+            return
+        latest = (
+            Message.objects.filter(
+                sender_id__in=[message.sender_id, message.recipient_id],
+                recipient_id__in=[message.sender_id, message.recipient_id],
+            )
+            .exclude(id=message.id)
+            .order_by("-id")
+            .first()
+        )
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message_id=latest.id if latest else None
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def add_group_member(group, user):
+        conversation = ConversationService.get_group(group)
+        _, created = ConversationMember.objects.get_or_create(
+            conversation=conversation,
+            user=user,
+            defaults={"last_activity_at": conversation.last_activity_at},
+        )
+        if created:
+            Conversation.objects.filter(pk=conversation.pk).update(
+                member_count=F("member_count") + 1
+            )
+
+    @staticmethod
+    @transaction.atomic
+    def remove_group_member(group, user):
+        deleted, _ = ConversationMember.objects.filter(
+            conversation__group=group, user=user
+        ).delete()
+        if deleted:
+            UnreadCounterService.messages_changed([user.id])
+            Conversation.objects.filter(group=group).update(
+                member_count=Greatest(F("member_count") - deleted, Value(0))
+            )
+
+    @staticmethod
+    @transaction.atomic
+    def rebuild():
+        """根据消息表全量重建会话表"""
+        ConversationMember.objects.all().delete()
+        Conversation.objects.all().delete()
+
+        pairs = list(
+            Message.objects.annotate(
+                low=Least("sender_id", "recipient_id"),
+                high=Greatest("sender_id", "recipient_id"),
+            )
+            .values("low", "high")
+            .annotate(last_id=Max("id"))
+        )
+        last_messages = Message.objects.in_bulk([pair["last_id"] for pair in pairs])
+        unread = {
+            (row["recipient_id"], row["sender_id"]): row["count"]
+            for row in Message.objects.filter(is_read=False)
+            .values("recipient_id", "sender_id")
+            .annotate(count=Count("id"))
+        }
+        for pair in pairs:
+            last = last_messages[pair["last_id"]]
+            conversation = Conversation.objects.create(
+                conversation_type=Conversation.PRIVATE,
+                private_key=ConversationService.private_key(pair["low"], pair["high"]),
+                last_message_id=last.id,
+                last_activity_at=last.timestamp,
+                member_count=2,
+            )
+            ConversationMember.objects.bulk_create(
+                [
+                    ConversationMember(
+                        conversation=conversation,
+                        user_id=user_id,
+                        peer_id=peer_id,
+                        unread_count=unread.get((user_id, peer_id), 0),
+                        last_activity_at=last.timestamp,
+                    )
+                    for user_id, peer_id in [
+                        (pair["low"], pair["high"]),
+                        (pair["high"], pair["low"]),
+                    ]
+                ]
+            )
+
+        last_group_ids = dict(
+            GroupMessage.objects.values("group_id")
+            .annotate(last_id=Max("id"))
+            .values_list("group_id", "last_id")
+        )
+        last_group_messages = GroupMessage.objects.in_bulk(list(last_group_ids.values()))
+        for group in GroupChat.objects.prefetch_related("members"):
+            conversation = ConversationService.get_group(group)
+            last = last_group_messages.get(last_group_ids.get(group.id))
+            if last is not None:
+                ConversationService._touch(conversation, last)
+
+
+class ConversationSequence:
+    """
+    缓存中的会话序号计数器
+
+    群聊消息延迟写入时，序号要在消息写入数据库之前分配，计数器放在缓存（部署环境为 Redis，
+    需要开启持久化）中，多个进程共享；计数器缺失时从 Conversation.last_seq 恢复，
+    写入数据库时 last_seq 取两者中较大的值。
+    """
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, "GROUP_MESSAGE_WRITE_BEHIND", False)
+
+    @staticmethod
+    def key(conversation_key):
+        return f"conversation_seq:{conversation_key}"
+
+    @staticmethod
+    def next(conversation_key):
+        key = ConversationSequence.key(conversation_key)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            kind, target = ChatEventLog.parse_key(conversation_key)
+            conversations = (
+                Conversation.objects.filter(group_id=target)
+                if kind == "group"
+                else Conversation.objects.filter(private_key="{}:{}".format(*target))
+            )
+            cache.add(key, conversations.values_list("last_seq", flat=True).first() or 0, None)
+            return cache.incr(key)
+
+
+class MessageHistoryService:
+    @staticmethod
+    def private_page(user_id, other_id, before_id=None, after_id=None, limit=20):
+        """
+        两人之间的一页聊天记录，返回 (messages, has_more)
+
+        按消息ID做游标：默认和 before_id 时从新到旧返回，after_id 时从旧到新返回。
+        两个方向的消息分别沿 (sender, recipient, id) 索引各取 limit + 1 条再合并，
+        不对整段会话排序，也不统计总数，翻到多早的记录耗时都相同。
+        """
+        if after_id is not None:
+            lookup, ordering = {"id__gt": after_id}, "id"
+        else:
+            lookup = {"id__lt": before_id} if before_id is not None else {}
+            ordering = "-id"
+        rows = []
+        # 和自己的对话两个方向是同一组消息
+        for sender_id, recipient_id in dict.fromkeys(
+            [(user_id, other_id), (other_id, user_id)]
+        ):
+            rows += (
+                Message.objects.filter(
+                    sender_id=sender_id, recipient_id=recipient_id, **lookup
+                )
+                .select_related("sender", "recipient")
+                .order_by(ordering)[: limit + 1]
+            )
+        rows.sort(key=lambda message: message.id, reverse=ordering == "-id")
+        return rows[:limit], len(rows) > limit
+
+    @staticmethod
+    def changes_since(user_id, conversation_key, last_seq, limit=100):
+        """
+        会话中 last_seq 之后新增、编辑或撤回的消息，返回 (messages, has_more)
+
+        沿 change_seq 索引做范围读取，耗时只和变化的消息数有关；
+        用户不是会话成员或会话标识无效时返回 None。
+        """
+        try:
+            kind, target = ChatEventLog.parse_key(conversation_key)
+        except ValueError:
+            return None
+        if kind == "group":
+            if not GroupMembershipService.is_member(target, user_id):
+                return None
+            querysets = [
+                GroupMessage.objects.filter(group_id=target).select_related("sender")
+            ]
+        else:
+            if int(user_id) not in target:
+                return None
+            # 两个方向分别沿 (sender, recipient, change_seq) 索引读取，和自己的对话只读一次
+            querysets = [
+                Message.objects.filter(
+                    sender_id=sender_id, recipient_id=recipient_id
+                ).select_related("sender", "recipient")
+                for sender_id, recipient_id in dict.fromkeys(
+                    [target, tuple(reversed(target))]
+                )
+            ]
+        rows = []
+        for queryset in querysets:
+            rows += queryset.filter(change_seq__gt=last_seq).order_by("change_seq")[
+                : limit + 1
+            ]
+        rows.sort(key=lambda message: message.change_seq)
+        return rows[:limit], len(rows) > limit
+
+
+class GroupMembershipService:
+    """
+    缓存中的群成员ID集合
+
+    同时缓存每个用户所在的群ID列表。权限检查和 WebSocket 消费者只读缓存，
+    成员变化时由 messaging.signals 在事务提交后使缓存失效，缓存同时设置了过期时间。
+
+    缓存值按版本号存放：失效时把版本号加一，而不是删除缓存。
+    查询数据库期间成员发生变化时，读到的旧数据写在旧版本号下，之后不会再被读到；
+    直接删除缓存的话，这份旧数据会在删除之后写回，直到过期前一直是错的。
+    """
+
+    @staticmethod
+    def key(group_id):
+        return f"group_members:{group_id}"
+
+    @staticmethod
+    def user_key(user_id):
+        return f"user_groups:{user_id}"
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, "GROUP_MEMBERSHIP_CACHE_TIMEOUT", 3600)
+
+    @staticmethod
+    def version(key):
+        version_key = f"{key}:version"
+        version = cache.get(version_key)
+        if version is None:
+            # 版本号被淘汰后用当前时间重新开始，不会和淘汰前的版本号重复
+            cache.add(version_key, time.time_ns(), None)
+            version = cache.get(version_key)
+        return version
+
+    @staticmethod
+    def cached(key, load):
+        """按当前版本号读取缓存，没有时调用 load 查询数据库并写入"""
+        versioned_key = f"{key}:{GroupMembershipService.version(key)}"
+        value = cache.get(versioned_key)
+        if value is None:
+            value = load()
+            cache.add(versioned_key, value, GroupMembershipService.timeout())
+        return value
+
+    @staticmethod
+    def expire(keys):
+        for key in keys:
+            try:
+                cache.incr(f"{key}:version")
+            except ValueError:
+                # 没有版本号时下次读取会生成新的版本号
+                pass
+
+    @staticmethod
+    def member_ids(group_id):
+        return GroupMembershipService.cached(
+            GroupMembershipService.key(group_id),
+            lambda: set(
+                GroupChat.members.through.objects.filter(groupchat_id=group_id).values_list(
+                    "user_id", flat=True
+                )
+            ),
+        )
+
+    @staticmethod
+    def is_member(group_id, user_id):
+        try:
+            return int(user_id) in GroupMembershipService.member_ids(int(group_id))
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def group_ids(user_id):
+        """用户所在的全部群ID，WebSocket 连接和断开时用来加入、离开群聊房间"""
+        return GroupMembershipService.cached(
+            GroupMembershipService.user_key(user_id),
+            lambda: list(
+                GroupChat.members.through.objects.filter(user_id=user_id).values_list(
+                    "groupchat_id", flat=True
+                )
+            ),
+        )
+
+    @staticmethod
+    def invalidate(group_ids=(), user_ids=()):
+        keys = [GroupMembershipService.key(group_id) for group_id in group_ids or ()] + [
+            GroupMembershipService.user_key(user_id) for user_id in user_ids or ()
+        ]
+        if keys:
+            transaction.on_commit(lambda: GroupMembershipService.expire(keys))
+
+
+class GroupActivityService:
+    """
+    群聊新消息提示
+
+    按需订阅模式下连接只加入客户端正在查看的群聊房间，其余群的新消息通过成员各自的
+    user_{id} 房间推送 group_activity 提示。提示按群节流，
+    GROUP_ACTIVITY_HINT_INTERVAL 秒内同一个群只提示一次。
+    """
+
+    @staticmethod
+    def key(group_id):
+        return f"group_activity:{group_id}"
+
+    @staticmethod
+    def hint_rooms(group_id, sender_id):
+        """返回需要推送提示的房间，节流期内返回空列表"""
+        interval = getattr(settings, "GROUP_ACTIVITY_HINT_INTERVAL", 5)
+        if not cache.add(GroupActivityService.key(group_id), 1, interval):
+            return []
+        return [
+            f"user_{member_id}"
+            for member_id in sorted(GroupMembershipService.member_ids(group_id))
+            if member_id != sender_id
+        ]
@@ -0,0 +1,36 @@
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from .models import GroupChat
+from .services import GroupMembershipService
+
+
+@receiver(m2m_changed, sender=GroupChat.members.through)
+def group_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """群成员增减后清除群的成员缓存和相关用户的群列表缓存"""
+    if action in ("post_add", "post_remove"):
+        if reverse:
+            GroupMembershipService.invalidate(group_ids=pk_set, user_ids=[instance.pk])
+        else:
+            GroupMembershipService.invalidate(group_ids=[instance.pk], user_ids=pk_set)
+    elif action == "pre_clear":
+        # 清空时 pk_set 为空，需要在清空前取出受影响的一方
+        if reverse:
+            GroupMembershipService.invalidate(
+                group_ids=list(instance.group_chats.values_list("id", flat=True)),
+                user_ids=[instance.pk],
+            )
+        else:
+            GroupMembershipService.invalidate(
+                group_ids=[instance.pk],
+                user_ids=list(instance.members.values_list("id", flat=True)),
+            )
+
+
+@receiver(pre_delete, sender=GroupChat)
+def group_deleted(sender, instance, **kwargs):
+    # 删除群时成员关系随之级联删除，不会触发 m2m_changed
+    GroupMembershipService.invalidate(
+        group_ids=[instance.pk],
+        user_ids=list(instance.members.values_list("id", flat=True)),
+    )
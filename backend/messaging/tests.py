@@ -1,3 +1,879 @@
-from django.test import TestCase
+import asyncio
+from io import StringIO
 
-# Create your tests here.
+import orjson
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from myproject.explain import ExplainAssertionsMixin
+from .consumers import ChatConsumer
+from .eventlog import ChatEventLog, LocalStreamBackend
+from .fanout import group_send_many
+from .models import Conversation, ConversationMember, GroupChat, GroupMessage, Message
+from .persistence import GroupMessagePersister, LocalWal
+from .presence import PresenceDigest, PresenceService
+from .protocol import FrameBatcher, negotiate
+from .services import (
+    ConversationService,
+    GroupActivityService,
+    GroupMembershipService,
+)
+
+
+class MessagingTestCase(TestCase):
+    """清空缓存并使用进程内事件日志，创建 user0 ~ user2 三个用户"""
+
+    def setUp(self):
+        cache.clear()
+        ChatEventLog._backend = LocalStreamBackend()
+        self.users = [
+            User.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com", password="password"
+            )
+            for i in range(3)
+        ]
+
+    def tearDown(self):
+        ChatEventLog._backend = None
+
+
+class MessagingHotQueryPlanTests(ExplainAssertionsMixin, TestCase):
+    """聊天相关的热点查询必须走索引"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com", password="password"
+            )
+            for i in range(5)
+        ]
+        cls.group = GroupChat.objects.create(name="group", created_by=cls.users[0])
+        cls.group.members.add(*cls.users)
+        for i in range(50):
+            sender, recipient = cls.users[i % 5], cls.users[(i + 1) % 5]
+            Message.objects.create(sender=sender, recipient=recipient, content=str(i))
+            GroupMessage.objects.create(group=cls.group, sender=sender, content=str(i))
+
+    def test_private_history(self):
+        a, b = self.users[0], self.users[1]
+        # 聊天记录按方向分别查询，见 MessageHistoryService.private_page
+        self.assertNoSequentialScan(
+            Message.objects.filter(sender=a, recipient=b, id__lt=40).order_by("-id")[:21]
+        )
+
+    def test_unread_messages(self):
+        self.assertNoSequentialScan(
+            Message.objects.filter(recipient=self.users[0], is_read=False)
+            .values("sender_id")
+            .order_by()
+        )
+
+    def test_group_history(self):
+        self.assertNoSequentialScan(
+            GroupMessage.objects.filter(group=self.group).order_by("timestamp")[:50]
+        )
+
+    def test_conversation_list(self):
+        self.assertNoSequentialScan(
+            ConversationMember.objects.filter(user=self.users[0]).order_by(
+                "-last_activity_at", "-id"
+            )[:50]
+        )
+
+
+class PrivateHistoryTests(TestCase):
+    """私聊记录按消息ID游标分页"""
+
+    def setUp(self):
+        self.a = User.objects.create_user(
+            username="a", email="a@example.com", password="password"
+        )
+        self.b = User.objects.create_user(
+            username="b", email="b@example.com", password="password"
+        )
+        self.messages = [
+            Message.objects.create(
+                sender=self.a if i % 3 else self.b,
+                recipient=self.b if i % 3 else self.a,
+                content=str(i),
+            )
+            for i in range(25)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.a)
+
+    def get(self, **params):
+        response = self.client.get(f"/api/messages/conversations/{self.b.id}/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_scroll_back(self):
+        ids = [message.id for message in self.messages]
+        first = self.get(page_size=10)
+        self.assertEqual([m["id"] for m in first["results"]], ids[::-1][:10])
+        self.assertTrue(first["has_more"])
+        self.assertNotIn("count", first)
+
+        last = self.get(page_size=10, before_id=ids[5])
+        self.assertEqual([m["id"] for m in last["results"]], ids[4::-1])
+        self.assertFalse(last["has_more"])
+
+    def test_catch_up(self):
+        ids = [message.id for message in self.messages]
+        data = self.get(page_size=10, after_id=ids[20], include_count="true")
+        self.assertEqual([m["id"] for m in data["results"]], ids[21:])
+        self.assertFalse(data["has_more"])
+        self.assertEqual(data["count"], 25)
+
+
+class ConversationTests(MessagingTestCase):
+    """物化会话表随消息和群成员变化更新，可以从消息表重建"""
+
+    def setUp(self):
+        super().setUp()
+        self.group = GroupChat.objects.create(name="group", created_by=self.users[0])
+        self.group.members.add(self.users[0], self.users[1])
+        ConversationService.get_group(self.group)
+        self.client = APIClient()
+
+    def member(self, user, **lookup):
+        return ConversationMember.objects.get(user=user, **lookup)
+
+    def test_private_message(self):
+        messages = []
+        for i in range(3):
+            message = Message.objects.create(
+                sender=self.users[i % 2], recipient=self.users[(i + 1) % 2], content=str(i)
+            )
+            ConversationService.record_private_message(message)
+            messages.append(message)
+        conversation = Conversation.objects.get(
+            private_key=ConversationService.private_key(self.users[0].id, self.users[1].id)
+        )
+        self.assertEqual(conversation.last_message_id, messages[-1].id)
+        self.assertEqual(conversation.member_count, 2)
+        self.assertEqual(self.member(self.users[0], conversation=conversation).unread_count, 1)
+        self.assertEqual(self.member(self.users[1], conversation=conversation).unread_count, 2)
+
+    def test_group_message_via_api(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(
+            "/api/messages/group-messages/",
+            {"group": self.group.id, "content": "hello"},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        message = GroupMessage.objects.get()
+        self.assertEqual(message.seq, 1)
+        conversation = Conversation.objects.get(group=self.group)
+        self.assertEqual(conversation.last_message_id, message.id)
+        self.assertEqual(self.member(self.users[0], conversation=conversation).unread_count, 0)
+        self.assertEqual(self.member(self.users[1], conversation=conversation).unread_count, 1)
+
+    def test_group_members(self):
+        ConversationService.add_group_member(self.group, self.users[2])
+        ConversationService.add_group_member(self.group, self.users[2])
+        conversation = Conversation.objects.get(group=self.group)
+        self.assertEqual(conversation.member_count, 3)
+
+        ConversationService.remove_group_member(self.group, self.users[1])
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.member_count, 2)
+        self.assertEqual(
+            set(conversation.memberships.values_list("user_id", flat=True)),
+            {self.users[0].id, self.users[2].id},
+        )
+
+    def test_rebuild(self):
+        private = Message.objects.create(
+            sender=self.users[0], recipient=self.users[1], content="private"
+        )
+        grouped = GroupMessage.objects.create(
+            group=self.group, sender=self.users[1], content="group"
+        )
+        Conversation.objects.all().delete()
+
+        call_command("rebuild_conversations", "--if-empty", stdout=StringIO())
+        private_conversation = Conversation.objects.get(private_key__isnull=False)
+        self.assertEqual(private_conversation.last_message_id, private.id)
+        self.assertEqual(
+            self.member(self.users[1], conversation=private_conversation).unread_count, 1
+        )
+        group_conversation = Conversation.objects.get(group=self.group)
+        self.assertEqual(group_conversation.last_message_id, grouped.id)
+        self.assertEqual(group_conversation.member_count, 2)
+
+        # 已有会话时 --if-empty 不会重建
+        Conversation.objects.filter(pk=group_conversation.pk).update(last_message_id=None)
+        call_command("rebuild_conversations", "--if-empty", stdout=StringIO())
+        self.assertIsNone(Conversation.objects.get(group=self.group).last_message_id)
+
+
+class GroupHistoryTests(MessagingTestCase):
+    """群聊记录游标分页，成员身份从缓存判断"""
+
+    def setUp(self):
+        super().setUp()
+        self.group = GroupChat.objects.create(name="group", created_by=self.users[0])
+        self.group.members.add(self.users[0], self.users[1])
+        self.messages = [
+            GroupMessage.objects.create(group=self.group, sender=self.users[i % 2], content=str(i))
+            for i in range(25)
+        ]
+        self.client = APIClient()
+
+    def get(self, user, **params):
+        self.client.force_authenticate(user)
+        return self.client.get(
+            "/api/messages/group-messages/", dict(params, group_id=self.group.id)
+        )
+
+    def test_pages_from_newest(self):
+        ids, cursor = [], None
+        while True:
+            params = {"page_size": 10}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.get(self.users[0], **params)
+            self.assertEqual(response.status_code, 200)
+            ids += [item["id"] for item in response.data["results"]]
+            cursor = response.data["next"]
+            if not cursor:
+                break
+        self.assertEqual(ids, [message.id for message in reversed(self.messages)])
+        self.assertEqual(response.data["results"][0]["group"], self.group.id)
+
+    def test_non_member_is_rejected(self):
+        self.assertEqual(self.get(self.users[2]).status_code, 403)
+
+    def test_membership_cache_follows_changes(self):
+        self.assertFalse(GroupMembershipService.is_member(self.group.id, self.users[2].id))
+        with self.assertNumQueries(0):
+            self.assertTrue(GroupMembershipService.is_member(self.group.id, self.users[0].id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.members.add(self.users[2])
+        self.assertTrue(GroupMembershipService.is_member(self.group.id, self.users[2].id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[2].group_chats.clear()
+        self.assertFalse(GroupMembershipService.is_member(self.group.id, self.users[2].id))
+
+    def test_stale_refill_is_not_served(self):
+        key = GroupMembershipService.key(self.group.id)
+        stale = GroupMembershipService.member_ids(self.group.id)
+
+        def load():
+            # 查询数据库之后、写入缓存之前成员发生了变化
+            self.group.members.add(self.users[2])
+            GroupMembershipService.expire([key])
+            return stale
+
+        cache.delete(f"{key}:{GroupMembershipService.version(key)}")
+        GroupMembershipService.cached(key, load)
+        self.assertTrue(GroupMembershipService.is_member(self.group.id, self.users[2].id))
+
+    def test_user_group_ids_follow_changes(self):
+        self.assertEqual(GroupMembershipService.group_ids(self.users[2].id), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.members.add(self.users[2])
+        self.assertEqual(GroupMembershipService.group_ids(self.users[2].id), [self.group.id])
+        with self.assertNumQueries(0):
+            GroupMembershipService.group_ids(self.users[2].id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.delete()
+        self.assertEqual(GroupMembershipService.group_ids(self.users[2].id), [])
+
+    def test_activity_hints_are_throttled(self):
+        rooms = GroupActivityService.hint_rooms(self.group.id, self.users[0].id)
+        self.assertEqual(rooms, [f"user_{self.users[1].id}"])
+        # 节流期内同一个群不再提示
+        self.assertEqual(GroupActivityService.hint_rooms(self.group.id, self.users[1].id), [])
+
+
+class PresenceTests(MessagingTestCase):
+    """在线状态按连接计数，合并广播时状态没变的用户不重复发送"""
+
+    def setUp(self):
+        super().setUp()
+        self.users[1].following.add(self.users[0])
+
+    def test_refcount(self):
+        user_id = self.users[0].id
+        PresenceService.connected(user_id)
+        PresenceService.connected(user_id)
+        self.assertEqual(PresenceService.disconnected(user_id), 1)
+        self.assertTrue(PresenceService.is_online(user_id))
+        self.assertEqual(PresenceService.disconnected(user_id), 0)
+        self.assertFalse(PresenceService.is_online(user_id))
+
+    def test_digest_skips_flapping(self):
+        user_id = self.users[0].id
+        PresenceService.connected(user_id)
+        rooms = PresenceService.collect_digest({user_id: {7}})
+        self.assertEqual(set(rooms), {"group_7", f"user_{self.users[1].id}"})
+        self.assertEqual(rooms["group_7"], [{"user_id": user_id, "status": "online"}])
+
+        # 断开后很快重连，状态没有变化
+        PresenceService.disconnected(user_id)
+        PresenceService.connected(user_id)
+        self.assertEqual(PresenceService.collect_digest({user_id: {7}}), {})
+
+    def test_heartbeat_after_expiry_reannounces(self):
+        user_id = self.users[0].id
+        PresenceService.connected(user_id)
+        PresenceService.collect_digest({user_id: {7}})
+        self.assertFalse(PresenceService.heartbeat(user_id))
+
+        # 心跳间隔超过 TTL，计数过期后用户已经广播为离线
+        cache.delete(PresenceService.key(user_id))
+        rooms = PresenceService.collect_digest({user_id: None})
+        self.assertEqual(
+            rooms[f"user_{self.users[1].id}"], [{"user_id": user_id, "status": "offline"}]
+        )
+        self.assertTrue(PresenceService.heartbeat(user_id))
+        rooms = PresenceService.collect_digest({user_id: {7}})
+        self.assertEqual(rooms["group_7"], [{"user_id": user_id, "status": "online"}])
+
+    def test_expired_watched_users(self):
+        digest = PresenceDigest()
+        for user in self.users[:2]:
+            PresenceService.connected(user.id)
+        digest.watched = {self.users[0].id, self.users[1].id}
+        cache.delete(PresenceService.key(self.users[0].id))
+        self.assertEqual(digest.expired(), [self.users[0].id])
+        self.assertEqual(digest.watched, {self.users[1].id})
+
+    def test_presence_endpoint(self):
+        PresenceService.connected(self.users[0].id)
+        client = APIClient()
+        client.force_authenticate(self.users[2])
+        response = client.get(
+            "/api/messages/presence/",
+            {"user_ids": f"{self.users[0].id},{self.users[1].id}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][self.users[0].id]["status"], "online")
+        self.assertEqual(response.data["results"][self.users[1].id]["status"], "offline")
+
+
+class FanoutTests(SimpleTestCase):
+    """批量 group_send 把每条消息送到对应房间的所有成员"""
+
+    def test_group_send_many(self):
+        layer = InMemoryChannelLayer()
+
+        async def run():
+            channels = {}
+            for room in ("group_1", "group_2"):
+                channels[room] = await layer.new_channel()
+                await layer.group_add(room, channels[room])
+            await group_send_many(
+                layer,
+                [(f"group_{i % 2 + 1}", {"type": "chat", "seq": i}) for i in range(6)],
+                concurrency=2,
+            )
+            return {
+                room: sorted([(await layer.receive(channel))["seq"] for _ in range(3)])
+                for room, channel in channels.items()
+            }
+
+        self.assertEqual(
+            async_to_sync(run)(), {"group_1": [1, 3, 5], "group_2": [0, 2, 4]}
+        )
+
+
+@override_settings(WEBSOCKET_BATCH_SIZE=3, WEBSOCKET_BATCH_WINDOW=0.01)
+class FrameProtocolTests(SimpleTestCase):
+    """连接地址协商帧编码，合并推送把短时间内的事件打包为一帧"""
+
+    def test_negotiate(self):
+        options = negotiate(
+            {"query_string": b"token=x&encoding=msgpack&batch=1&groups=lazy"}
+        )
+        self.assertTrue(options.codec.binary)
+        self.assertTrue(options.batch)
+        self.assertTrue(options.lazy_groups)
+        codec = options.codec
+        self.assertEqual(codec.decode(bytes_data=codec.encode({"id": 1})), {"id": 1})
+
+        options = negotiate({"query_string": b"token=x"})
+        self.assertFalse(options.codec.binary)
+        self.assertFalse(options.batch)
+        self.assertFalse(options.lazy_groups)
+        codec = options.codec
+        self.assertEqual(codec.decode(text_data=codec.encode({1: "a"})), {"1": "a"})
+
+    def test_batcher_coalesces_events(self):
+        frames = []
+
+        async def send_frame(event):
+            frames.append(event)
+
+        async def run():
+            batcher = FrameBatcher(send_frame)
+            for i in range(4):
+                await batcher.add({"seq": i})
+            # 达到单帧上限的前三条立即发送，剩下一条等窗口结束
+            self.assertEqual(len(frames), 1)
+            await asyncio.sleep(0.05)
+
+        async_to_sync(run)()
+        self.assertEqual(
+            frames,
+            [{"type": "batch", "events": [{"seq": 0}, {"seq": 1}, {"seq": 2}]}, {"seq": 3}],
+        )
+
+    def test_batcher_close_flushes_pending_events(self):
+        frames = []
+
+        async def send_frame(event):
+            frames.append(event)
+
+        async def broken_frame(event):
+            raise ConnectionError
+
+        async def run():
+            batcher = FrameBatcher(send_frame)
+            await batcher.add({"seq": 0})
+            await batcher.add({"seq": 1})
+            await batcher.close()
+            self.assertEqual(frames, [{"type": "batch", "events": [{"seq": 0}, {"seq": 1}]}])
+
+            # 连接已经断开时发送失败也不影响关闭
+            batcher = FrameBatcher(broken_frame)
+            await batcher.add({"seq": 2})
+            await batcher.close()
+            self.assertEqual(batcher.events, [])
+
+        async_to_sync(run)()
+
+
+@override_settings(CHAT_EVENT_LOG_URL=None, CHAT_EVENT_LOG_MAXLEN=3)
+class ChatEventLogTests(MessagingTestCase):
+    """消息按会话分配序号写入事件日志，重连时只补发缺少的部分"""
+
+    def setUp(self):
+        super().setUp()
+        self.key = ChatEventLog.private_key(self.users[0].id, self.users[1].id)
+
+    def send(self, count):
+        messages = []
+        for i in range(count):
+            with self.captureOnCommitCallbacks(execute=True):
+                message = Message.objects.create(
+                    sender=self.users[i % 2], recipient=self.users[(i + 1) % 2], content=str(i)
+                )
+                ConversationService.record_private_message(message)
+            messages.append(message)
+        return messages
+
+    def test_sequence_and_resume(self):
+        messages = self.send(3)
+        self.assertEqual([m.seq for m in messages], [1, 2, 3])
+        self.assertEqual(Message.objects.get(pk=messages[2].pk).seq, 3)
+
+        events, complete = ChatEventLog.missed_events(self.users[1].id, set(), self.key, 1)
+        self.assertTrue(complete)
+        self.assertEqual([event["seq"] for event in events], [2, 3])
+        self.assertEqual(events[0]["message"]["id"], messages[1].id)
+        self.assertEqual(events[0]["type"], "chat_message")
+
+        self.assertEqual(ChatEventLog.missed_events(self.users[1].id, set(), self.key, 3), ([], True))
+
+    def test_outsider_gets_nothing(self):
+        self.send(1)
+        self.assertEqual(ChatEventLog.missed_events(self.users[2].id, set(), self.key, 0), ([], True))
+
+    def test_truncated_log_requires_resync(self):
+        self.send(5)
+        # 日志只保留最近 3 条，序号 1 之后的事件已经被截断
+        self.assertEqual(ChatEventLog.missed_events(self.users[0].id, set(), self.key, 1), ([], False))
+        events, complete = ChatEventLog.missed_events(self.users[0].id, set(), self.key, 2)
+        self.assertTrue(complete)
+        self.assertEqual([event["seq"] for event in events], [3, 4, 5])
+
+    def test_out_of_order_appends_are_kept(self):
+        messages = self.send(3)
+        # 并发提交时序号较大的事件先写入，较小的晚到
+        backend = ChatEventLog._backend = LocalStreamBackend()
+        stream = ChatEventLog.stream_key(self.key)
+        for message in (messages[0], messages[2], messages[1]):
+            event = ChatEventLog.message_event(message)
+            backend.append(stream, event["seq"], orjson.dumps(event, default=str))
+        events, complete = ChatEventLog.missed_events(self.users[1].id, set(), self.key, 0)
+        self.assertTrue(complete)
+        self.assertEqual([event["seq"] for event in events], [1, 2, 3])
+
+    def test_group_events(self):
+        group = GroupChat.objects.create(name="group", created_by=self.users[0])
+        group.members.add(self.users[0], self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            message = GroupMessage.objects.create(group=group, sender=self.users[0], content="hi")
+            ConversationService.record_group_message(message)
+        key = ChatEventLog.group_key(group.id)
+        events, complete = ChatEventLog.missed_events(self.users[1].id, {group.id}, key, 0)
+        self.assertTrue(complete)
+        self.assertEqual(events[0]["type"], "group_chat_message")
+        # 不在该群的用户不能读取
+        self.assertEqual(ChatEventLog.missed_events(self.users[2].id, set(), key, 0), ([], True))
+
+
+class ResumeTests(SimpleTestCase):
+    """重连补发校验请求格式，按需订阅时未订阅的群只提示"""
+
+    def resume(self, conversations, lazy_groups=False, subscribed=()):
+        consumer = ChatConsumer()
+        consumer.scope = {"user": None}
+        consumer.lazy_groups = lazy_groups
+        consumer.group_ids = {7}
+        consumer.subscribed_group_ids = set(subscribed)
+        sent = []
+
+        async def send_event(event):
+            sent.append(event)
+
+        async def get_missed_events(conversation, last_seq):
+            return [{"type": "group_chat_message", "seq": 2, "message": {"id": 20}}], True
+
+        consumer.send_event = send_event
+        consumer.get_missed_events = get_missed_events
+        async_to_sync(consumer.handle_resume)({"type": "resume", "conversations": conversations})
+        return sent
+
+    def test_rejects_non_mapping(self):
+        sent = self.resume(["group:7"])
+        self.assertEqual([event["type"] for event in sent], ["error"])
+
+    def test_replays_subscribed_group(self):
+        sent = self.resume({"group:7": 1})
+        self.assertEqual(sent[0]["replayed"], True)
+        self.assertEqual(sent[0]["message"]["id"], 20)
+        sent = self.resume({"group:7": 1}, lazy_groups=True, subscribed={7})
+        self.assertEqual(sent[0]["type"], "group_chat_message")
+
+    def test_hints_unsubscribed_group(self):
+        sent = self.resume({"group:7": 1}, lazy_groups=True)
+        self.assertEqual(
+            sent,
+            [
+                {"type": "group_activity", "group_id": 7, "message_id": 20, "seq": 2},
+                {"type": "resume_complete"},
+            ],
+        )
+
+
+class GroupMessageFrameTests(SimpleTestCase):
+    """群聊消息帧在写入前校验内容"""
+
+    def test_empty_content_is_rejected(self):
+        consumer = ChatConsumer()
+        consumer.scope = {"user": User(id=1)}
+        sent = []
+
+        async def send_event(event):
+            sent.append(event)
+
+        async def check_group_membership(user_id, group_id):
+            return True
+
+        consumer.send_event = send_event
+        consumer.check_group_membership = check_group_membership
+        for content in (None, "  ", 123):
+            async_to_sync(consumer.handle_group_message)(
+                {"type": "group_message", "group_id": 7, "content": content}
+            )
+        self.assertEqual(
+            sent, [{"type": "error", "message": "发送的内容不能为空"}] * 3
+        )
+
+
+@override_settings(CHAT_EVENT_LOG_URL=None)
+class MessageSyncTests(MessagingTestCase):
+    """增量同步只返回序号之后新增、编辑和撤回的消息"""
+
+    def setUp(self):
+        super().setUp()
+        self.key = ChatEventLog.private_key(self.users[0].id, self.users[1].id)
+        self.messages = []
+        for i in range(3):
+            message = Message.objects.create(
+                sender=self.users[i % 2], recipient=self.users[(i + 1) % 2], content=str(i)
+            )
+            ConversationService.record_private_message(message)
+            self.messages.append(message)
+        self.client = APIClient()
+
+    def sync(self, user, positions):
+        self.client.force_authenticate(user)
+        return self.client.post(
+            "/api/messages/sync/", {"conversations": positions}, format="json"
+        )
+
+    def test_returns_new_edited_and_revoked(self):
+        self.client.force_authenticate(self.users[0])
+        self.client.patch(
+            f"/api/messages/messages/{self.messages[0].id}/", {"content": "edited"}
+        )
+        self.client.patch(f"/api/messages/messages/{self.messages[2].id}/revoke/")
+
+        response = self.sync(self.users[1], {self.key: 3})
+        self.assertEqual(response.status_code, 200)
+        result = response.data["conversations"][self.key]
+        self.assertEqual(
+            [(m["id"], m["change_seq"]) for m in result["messages"]],
+            [(self.messages[0].id, 4), (self.messages[2].id, 5)],
+        )
+        self.assertTrue(result["messages"][0]["is_edited"])
+        self.assertTrue(result["messages"][1]["is_revoked"])
+        self.assertEqual(result["last_seq"], 5)
+        self.assertFalse(result["has_more"])
+
+        response = self.sync(self.users[1], {self.key: 5})
+        self.assertEqual(response.data["conversations"][self.key]["messages"], [])
+
+    def test_pages_through_changes(self):
+        self.client.force_authenticate(self.users[1])
+        response = self.client.post(
+            "/api/messages/sync/?page_size=2",
+            {"conversations": {self.key: 0}},
+            format="json",
+        )
+        result = response.data["conversations"][self.key]
+        self.assertEqual([m["seq"] for m in result["messages"]], [1, 2])
+        self.assertTrue(result["has_more"])
+        self.assertEqual(result["last_seq"], 2)
+
+    def test_skips_foreign_conversations(self):
+        group = GroupChat.objects.create(name="group", created_by=self.users[0])
+        response = self.sync(
+            self.users[2], {self.key: 0, ChatEventLog.group_key(group.id): 0, "bad": 0}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["conversations"], {})
+
+
+class ReadWatermarkTests(MessagingTestCase):
+    """已读水位一次标记整段消息，未读数按水位重新统计"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def membership(self, user, **lookup):
+        return ConversationMember.objects.get(user=user, **lookup)
+
+    def test_private_watermark(self):
+        messages = []
+        for i in range(5):
+            message = Message.objects.create(
+                sender=self.users[0], recipient=self.users[1], content=str(i)
+            )
+            ConversationService.record_private_message(message)
+            messages.append(message)
+        key = ChatEventLog.private_key(self.users[0].id, self.users[1].id)
+
+        self.client.force_authenticate(self.users[1])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/messages/read/",
+                {"conversation": key, "message_id": messages[2].id},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["moved"])
+        self.assertEqual(response.data["unread_count"], 2)
+        # 批量标记已读只有一条 UPDATE，没有逐条保存
+        message_updates = [
+            q for q in queries.captured_queries
+            if q["sql"].startswith("UPDATE") and "messaging_message" in q["sql"].split("SET")[0]
+        ]
+        self.assertEqual(len(message_updates), 1)
+        self.assertEqual(
+            list(Message.objects.order_by("id").values_list("is_read", flat=True)),
+            [True, True, True, False, False],
+        )
+        membership = self.membership(self.users[1], conversation__private_key__isnull=False)
+        self.assertEqual(membership.last_read_message_id, messages[2].id)
+        self.assertEqual(membership.unread_count, 2)
+
+        # 水位不会后退
+        self.assertFalse(
+            ConversationService.read_up_to(self.users[1].id, key, messages[0].id)
+        )
+        # 不是会话成员
+        self.assertFalse(
+            ConversationService.read_up_to(self.users[2].id, key, messages[4].id)
+        )
+
+    def test_watermark_is_clamped_to_last_message(self):
+        messages = []
+        for i in range(2):
+            message = Message.objects.create(
+                sender=self.users[0], recipient=self.users[1], content=str(i)
+            )
+            ConversationService.record_private_message(message)
+            messages.append(message)
+        key = ChatEventLog.private_key(self.users[0].id, self.users[1].id)
+
+        self.assertTrue(ConversationService.read_up_to(self.users[1].id, key, 10**12))
+        membership = self.membership(self.users[1], conversation__private_key__isnull=False)
+        self.assertEqual(membership.last_read_message_id, messages[1].id)
+
+        # 之后的新消息仍然是未读的
+        message = Message.objects.create(
+            sender=self.users[0], recipient=self.users[1], content="new"
+        )
+        ConversationService.record_private_message(message)
+        membership.refresh_from_db()
+        self.assertEqual(membership.unread_count, 1)
+
+    def test_group_watermark(self):
+        group = GroupChat.objects.create(name="group", created_by=self.users[0])
+        group.members.add(self.users[0], self.users[1])
+        messages = []
+        for i in range(4):
+            message = GroupMessage.objects.create(
+                group=group, sender=self.users[i % 2], content=str(i)
+            )
+            ConversationService.record_group_message(message)
+            messages.append(message)
+        self.assertEqual(self.membership(self.users[1], conversation__group=group).unread_count, 2)
+
+        key = ChatEventLog.group_key(group.id)
+        self.assertTrue(ConversationService.read_up_to(self.users[1].id, key, messages[1].id))
+        membership = self.membership(self.users[1], conversation__group=group)
+        # 水位之后只有 messages[2] 是别人发的
+        self.assertEqual(membership.unread_count, 1)
+        self.assertEqual(membership.last_read_message_id, messages[1].id)
+
+
+@override_settings(
+    CHAT_EVENT_LOG_URL=None, GROUP_MESSAGE_WAL_URL=None, GROUP_MESSAGE_WRITE_BEHIND=True
+)
+class GroupMessagePersisterTests(MessagingTestCase):
+    """延迟写入：先分配ID和序号，批量写入可重复执行，序号和逐条写入的消息连续"""
+
+    def setUp(self):
+        super().setUp()
+        self.group = GroupChat.objects.create(name="group", created_by=self.users[0])
+        self.group.members.add(*self.users)
+        self.persister = GroupMessagePersister()
+        self.persister._wal = LocalWal()
+
+    def unread(self, user):
+        return ConversationMember.objects.get(
+            user=user, conversation__group=self.group
+        ).unread_count
+
+    def test_persist_is_idempotent(self):
+        batch = [
+            self.persister.reserve(self.users[i % 2], self.group.id, str(i)) for i in range(3)
+        ]
+        self.assertEqual([message.seq for message in batch], [1, 2, 3])
+        self.assertEqual(len(self.persister.wal().entries), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                self.persister.persist_and_ack(batch)
+        self.assertEqual(self.persister.wal().entries, {})
+        self.assertEqual(self.persister.persist(batch), 0)
+        # 接收时间在写入前就已设置，写入后不需要再更新
+        self.assertFalse(
+            [
+                q for q in queries.captured_queries
+                if q["sql"].startswith('UPDATE "messaging_groupmessage"')
+            ]
+        )
+
+        saved = GroupMessage.objects.order_by("seq")
+        self.assertEqual([m.id for m in saved], [m.id for m in batch])
+        self.assertEqual(saved[0].timestamp, batch[0].timestamp)
+        # users[0] 发了两条，users[1] 发了一条，重复写入不会重复计数
+        self.assertEqual(
+            [self.unread(user) for user in self.users], [1, 2, 3]
+        )
+        conversation = Conversation.objects.get(group=self.group)
+        self.assertEqual(conversation.last_message_id, batch[-1].id)
+        self.assertEqual(conversation.last_seq, 3)
+        events, complete = ChatEventLog.missed_events(
+            self.users[2].id, [self.group.id], ChatEventLog.group_key(self.group.id), 0
+        )
+        self.assertTrue(complete)
+        self.assertEqual([event["seq"] for event in events], [1, 2, 3])
+
+    def test_sequence_shared_with_immediate_writes(self):
+        first = GroupMessagePersister.save_now(self.users[0].id, self.group.id, "first")
+        self.assertEqual(first.seq, 1)
+        message = self.persister.reserve(self.users[1], self.group.id, "second")
+        self.assertEqual(message.seq, 2)
+        self.persister.persist_and_ack([message])
+        third = GroupMessagePersister.save_now(self.users[2].id, self.group.id, "third")
+        self.assertEqual(third.seq, 3)
+        self.assertEqual(Conversation.objects.get(group=self.group).last_seq, 3)
+
+    def test_late_batch_does_not_roll_back_conversation(self):
+        early = self.persister.reserve(self.users[0], self.group.id, "early")
+        later = GroupMessagePersister.save_now(self.users[1].id, self.group.id, "later")
+        self.assertEqual((early.seq, later.seq), (1, 2))
+        self.persister.persist_and_ack([early])
+        conversation = Conversation.objects.get(group=self.group)
+        self.assertEqual(conversation.last_message_id, later.id)
+        self.assertEqual(conversation.last_seq, 2)
+
+    def test_unread_skips_messages_already_read(self):
+        batch = [self.persister.reserve(self.users[0], self.group.id, str(i)) for i in range(3)]
+        # 客户端收到推送后已读到第二条，之后这批消息才写入数据库
+        ConversationService.get_group(self.group)
+        ConversationMember.objects.filter(
+            user=self.users[1], conversation__group=self.group
+        ).update(last_read_message_id=batch[1].id)
+        self.persister.persist_and_ack(batch)
+        self.assertEqual([self.unread(user) for user in self.users], [0, 1, 3])
+
+    def test_read_before_flush_survives_flush(self):
+        batch = [self.persister.reserve(self.users[0], self.group.id, str(i)) for i in range(2)]
+        ConversationService.get_group(self.group)
+        key = ChatEventLog.group_key(self.group.id)
+        # 客户端收到推送后立即已读，这时消息还没有写入数据库
+        self.assertFalse(ConversationService.read_up_to(self.users[1].id, key, batch[1].id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.persister.persist_and_ack(batch)
+
+        membership = ConversationMember.objects.get(
+            user=self.users[1], conversation__group=self.group
+        )
+        self.assertEqual(membership.last_read_message_id, batch[1].id)
+        self.assertEqual(membership.unread_count, 0)
+        self.assertEqual(self.unread(self.users[2]), 2)
+        self.assertIsNone(
+            cache.get(ConversationService.pending_read_key(self.group.id, self.users[1].id))
+        )
+
+    def test_bad_rows_are_dead_lettered(self):
+        good = self.persister.reserve(self.users[0], self.group.id, "good")
+        bad = self.persister.reserve(self.users[1], self.group.id, None)
+        gone = self.persister.reserve(self.users[2], self.group.id, "gone")
+        self.users[2].delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            retry = self.persister.persist_and_ack([good, bad, gone])
+        # 违反约束的消息转入死信，发送者已删除的消息丢弃，其余消息正常写入，不再重试
+        self.assertEqual(retry, [])
+        self.assertEqual(list(GroupMessage.objects.values_list("id", flat=True)), [good.id])
+        self.assertEqual(list(self.persister.wal().dead), [bad.id])
+        self.assertEqual(self.persister.wal().entries, {})
+
+    def test_deleted_group_is_skipped(self):
+        message = self.persister.reserve(self.users[0], self.group.id, "lost")
+        self.group.delete()
+        self.assertEqual(self.persister.persist([message]), 0)
+        self.assertFalse(GroupMessage.objects.exists())
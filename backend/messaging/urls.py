@@ -15,6 +15,9 @@ urlpatterns = [
         views.MessageListView.as_view(),
         name="message-list",
     ),
+    path("presence/", views.presence, name="presence"),
+    path("sync/", views.sync, name="message-sync"),
+    path("read/", views.mark_conversation_read, name="conversation-read"),
     path("messages/", views.MessageCreateView.as_view(), name="message-create"),
     path(
         "messages/<int:message_id>/read/",
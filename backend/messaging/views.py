@@ -3,11 +3,18 @@ from rest_framework import viewsets, generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 from django.db.models import Q
 from django.utils import timezone
-from .models import Message, GroupMessage, GroupChat
+from django.db import transaction
+from .models import Message, GroupMessage, GroupChat, Conversation, ConversationMember
+from .eventlog import ChatEventLog
+from .presence import PresenceService
+from .services import ConversationService, GroupMembershipService, MessageHistoryService
 from accounts.models import User
+from interactions.counters import UnreadCounterService
+from myproject.pagination import KeysetPagination, get_page_params
 from .serializers import (
     UserSerializer,
     MessageSerializer,
@@ -26,9 +33,9 @@ class IsParticipant(permissions.BasePermission):
         if isinstance(obj, Message):
             return obj.recipient == request.user or obj.sender == request.user
         elif isinstance(obj, GroupMessage):
-            return obj.group.members.filter(id=request.user.id).exists()
+            return GroupMembershipService.is_member(obj.group_id, request.user.id)
         elif isinstance(obj, GroupChat):
-            return obj.members.filter(id=request.user.id).exists()
+            return GroupMembershipService.is_member(obj.id, request.user.id)
         return False
 
 
@@ -52,8 +59,10 @@ class GroupChatViewSet(viewsets.ModelViewSet):
         return GroupChat.objects.filter(members=self.request.user)
 
     def perform_create(self, serializer):
-        group = serializer.save(created_by=self.request.user)
-        group.members.add(self.request.user)
+        with transaction.atomic():
+            group = serializer.save(created_by=self.request.user)
+            group.members.add(self.request.user)
+            ConversationService.get_group(group)
 
     @action(detail=True, methods=["post"])
     def add_member(self, request, pk=None):
@@ -67,7 +76,9 @@ class GroupChatViewSet(viewsets.ModelViewSet):
 
         try:
             user = User.objects.get(id=user_id)
-            group.members.add(user)
+            with transaction.atomic():
+                group.members.add(user)
+                ConversationService.add_group_member(group, user)
             return Response(
                 {"detail": "用户已成功添加到群聊"}, status=status.HTTP_200_OK
             )
@@ -95,7 +106,9 @@ class GroupChatViewSet(viewsets.ModelViewSet):
         try:
             user = User.objects.get(id=user_id)
             if group.created_by == request.user or int(user_id) == request.user.id:
-                group.members.remove(user)
+                with transaction.atomic():
+                    group.members.remove(user)
+                    ConversationService.remove_group_member(group, user)
                 return Response(
                     {"detail": "用户已成功从群聊中移除"}, status=status.HTTP_200_OK
                 )
@@ -116,17 +129,43 @@ class GroupMessageViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         group_id = self.request.query_params.get("group_id", None)
+        queryset = GroupMessage.objects.select_related("sender")
         if group_id:
-            return GroupMessage.objects.filter(group_id=group_id)
-        return GroupMessage.objects.filter(group__members=self.request.user)
+            if not GroupMembershipService.is_member(group_id, self.request.user.id):
+                raise PermissionDenied("您不是该群的成员")
+            return queryset.filter(group_id=group_id)
+        return queryset.filter(group__members=self.request.user)
 
     def get_serializer_class(self):
         if self.action == "create":
             return GroupMessageCreateSerializer
         return GroupMessageSerializer
 
+    def list(self, request, *args, **kwargs):
+        # 从最新的消息开始按 (timestamp, id) 游标向前翻页
+        paginator = KeysetPagination(ordering=("-timestamp", "-id"))
+        page = paginator.paginate_queryset(self.get_queryset(), request)
+        response = paginator.get_paginated_response(
+            self.get_serializer(page, many=True).data
+        )
+        group_id = request.query_params.get("group_id")
+        if group_id:
+            # 查看群聊消息即视为已读
+            ConversationService.group_read(group_id, request.user)
+        return response
+
     def perform_create(self, serializer):
-        serializer.save(sender=self.request.user)
+        group = serializer.validated_data["group"]
+        if not GroupMembershipService.is_member(group.id, self.request.user.id):
+            raise PermissionDenied("您不是该群的成员")
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user)
+            ConversationService.record_group_message(message)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            message = serializer.save()
+            ConversationService.message_changed(message)
 
 
 @api_view(["PATCH"])
@@ -164,8 +203,10 @@ def revoke_message(request, pk):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    message.is_revoked = True
-    message.save()
+    with transaction.atomic():
+        message.is_revoked = True
+        message.save()
+        ConversationService.message_changed(message)
 
     serializer = MessageSerializer(message, context={"request": request})
     return Response(serializer.data)
@@ -179,50 +220,51 @@ class MessageListView(generics.ListCreateAPIView):
         user = self.request.user
         user_id = self.kwargs.get("user_id")
 
-        # 添加分页支持
         queryset = (
             Message.objects.filter(
                 (Q(sender=user) & Q(recipient_id=user_id))
                 | (Q(sender_id=user_id) & Q(recipient=user))
             )
             .select_related("sender", "recipient")
-            .order_by("-timestamp")
+            .order_by("-id")
         )
 
         return queryset
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-
-        # 获取分页参数
-        page = self.request.query_params.get("page", 1)
-        page_size = self.request.query_params.get("page_size", 20)
+        """
+        按消息ID游标分页的聊天记录
 
+        ?before_id= 向上翻更早的消息（不传时从最新一条开始），结果从新到旧；
+        ?after_id= 重连后补齐更新的消息，结果从旧到新。
+        has_more 表示该方向上是否还有消息，总数只在 ?include_count=true 时统计。
+        """
         try:
-            page = int(page)
-            page_size = int(page_size)
-        except (ValueError, TypeError):
-            page = 1
-            page_size = 20
-
-        # 应用分页
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_queryset = queryset[start:end]
-
-        serializer = self.get_serializer(paginated_queryset, many=True)
-
-        # 返回分页信息
-        return Response(
-            {
-                "results": serializer.data,
-                "count": queryset.count(),
-                "page": page,
-                "page_size": page_size,
-                "has_next": end < queryset.count(),
-                "has_previous": page > 1,
-            }
+            before_id = request.query_params.get("before_id")
+            after_id = request.query_params.get("after_id")
+            before_id = int(before_id) if before_id else None
+            after_id = int(after_id) if after_id else None
+        except ValueError:
+            return Response(
+                {"detail": "before_id 和 after_id 必须是整数"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        _, page_size = get_page_params(request, max_page_size=100)
+
+        messages, has_more = MessageHistoryService.private_page(
+            request.user.id,
+            self.kwargs.get("user_id"),
+            before_id=before_id,
+            after_id=after_id,
+            limit=page_size,
         )
+        data = {
+            "results": self.get_serializer(messages, many=True).data,
+            "has_more": has_more,
+        }
+        if request.query_params.get("include_count") == "true":
+            data["count"] = self.get_queryset().count()
+        return Response(data)
 
 
 class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -243,7 +285,9 @@ class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
             instance, data=request.data, partial=kwargs.get("partial", False)
         )
         if serializer.is_valid():
-            updated_instance = serializer.save(is_edited=True)
+            with transaction.atomic():
+                updated_instance = serializer.save(is_edited=True)
+                ConversationService.message_changed(updated_instance)
             response_serializer = self.get_serializer(updated_instance)
             return Response(response_serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -256,7 +300,9 @@ class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
                 {"detail": "只有消息发送者可以删除消息"},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        return super().destroy(request, *args, **kwargs)
+        with transaction.atomic():
+            ConversationService.private_message_deleted(instance)
+            return super().destroy(request, *args, **kwargs)
 
     def partial_update(self, request, *args, **kwargs):
         kwargs["partial"] = True
@@ -289,7 +335,9 @@ class MessageCreateView(generics.CreateAPIView):
                     {"recipient": "接收者不存在"}, status=status.HTTP_400_BAD_REQUEST
                 )
 
-            serializer.save(sender=request.user)
+            with transaction.atomic():
+                message = serializer.save(sender=request.user)
+                ConversationService.record_private_message(message)
             headers = self.get_success_headers(serializer.data)
             return Response(
                 serializer.data, status=status.HTTP_201_CREATED, headers=headers
@@ -308,90 +356,83 @@ class MessageCreateView(generics.CreateAPIView):
 def conversation_list(request):
     """获取当前用户的所有对话，包括私聊和群聊"""
     user = request.user
+    # 私聊和群聊按最近活动时间统一分页
+    page, page_size = get_page_params(request, default_page_size=50, max_page_size=100)
+    offset = (page - 1) * page_size
+
+    # 物化的会话表，按 (user, -last_activity_at) 索引范围读取
+    memberships = list(
+        ConversationMember.objects.filter(user=user)
+        .select_related("conversation", "conversation__group", "peer")
+        .order_by("-last_activity_at", "-id")[offset : offset + page_size + 1]
+    )
+    has_next = len(memberships) > page_size
+    memberships = memberships[:page_size]
+
+    private_ids = [
+        m.conversation.last_message_id
+        for m in memberships
+        if m.conversation.conversation_type == Conversation.PRIVATE
+    ]
+    group_ids = [
+        m.conversation.last_message_id
+        for m in memberships
+        if m.conversation.conversation_type == Conversation.GROUP
+    ]
+    last_messages = Message.objects.in_bulk([pk for pk in private_ids if pk])
+    last_group_messages = GroupMessage.objects.select_related("sender").in_bulk(
+        [pk for pk in group_ids if pk]
+    )
 
-    # 获取私聊对话
-    sent_messages = Message.objects.filter(sender=user)
-    received_messages = Message.objects.filter(recipient=user)
-
-    # 构建私聊对话列表
-    conversations = {}
-
-    for msg in sent_messages:
-        recipient_id = msg.recipient.id
-        if (
-            recipient_id not in conversations
-            or msg.timestamp > conversations[recipient_id]["timestamp"]
-        ):
-            conversations[recipient_id] = {
-                "user": msg.recipient,
-                "last_message": msg,
-                "timestamp": msg.timestamp,
-                "unread_count": 0,
-            }
-
-    # 处理接收到的信息
-    for msg in received_messages:
-        sender_id = msg.sender.id
-        if (
-            sender_id not in conversations
-            or msg.timestamp > conversations[sender_id]["timestamp"]
-        ):
-            unread_count = Message.objects.filter(
-                sender_id=sender_id, recipient=user, is_read=False
-            ).count()
-            conversations[sender_id] = {
-                "user": msg.sender,
-                "last_message": msg,
-                "timestamp": msg.timestamp,
-                "unread_count": unread_count,
-            }
-
-    conversations_list = list(conversations.values())
-    conversations_list.sort(key=lambda x: x["timestamp"], reverse=True)
-
-    # 序列化私聊数据
     private_chats = []
-    for conv in conversations_list:
-        # 获取用户头像的完整URL
-        avatar_url = None
-        if conv["user"].avatar:
-            # 使用 request.build_absolute_uri 生成完整URL
-            avatar_url = request.build_absolute_uri(conv["user"].avatar.url)
-
-        private_chats.append(
-            {
-                "user": {
-                    "id": conv["user"].id,
-                    "username": conv["user"].username,
-                    "avatar": avatar_url,
-                },
-                "last_message": {
-                    "content": conv["last_message"].content,
-                    "timestamp": conv["last_message"].timestamp,
-                    "is_read": conv["last_message"].is_read,
-                },
-                "unread_count": conv["unread_count"],
-            }
-        )
-
-    # 获取群聊列表
-    group_chats = GroupChat.objects.filter(members=user).prefetch_related("members")
     group_chats_data = []
-    for group in group_chats:
-        # 获取群聊最新的消息
-        latest_message = group.messages.order_by("-timestamp").first()
+    for membership in memberships:
+        conversation = membership.conversation
+        if conversation.conversation_type == Conversation.PRIVATE:
+            peer_user = membership.peer
+            last_message = last_messages.get(conversation.last_message_id)
+            # 获取用户头像的完整URL
+            avatar_url = None
+            if peer_user.avatar:
+                # 使用 request.build_absolute_uri 生成完整URL
+                avatar_url = request.build_absolute_uri(peer_user.avatar.url)
+
+            private_chats.append(
+                {
+                    "conversation_id": conversation.id,
+                    "user": {
+                        "id": peer_user.id,
+                        "username": peer_user.username,
+                        "avatar": avatar_url,
+                    },
+                    "last_message": {
+                        "content": last_message.content,
+                        "timestamp": last_message.timestamp,
+                        "is_read": last_message.is_read,
+                    }
+                    if last_message
+                    else None,
+                    "unread_count": membership.unread_count,
+                }
+            )
+            continue
+
+        group = conversation.group
+        latest_message = last_group_messages.get(conversation.last_message_id)
 
         avatar_url = None
         if group.avatar:
             avatar_url = request.build_absolute_uri(group.avatar.url)
 
         group_data = {
+            "conversation_id": conversation.id,
             "id": group.id,
             "name": group.name,
             "description": group.description,
             "avatar": avatar_url,
-            "member_count": group.members.count(),
+            "member_count": conversation.member_count,
             "created_at": group.created_at,
+            "unread_count": membership.unread_count,
             "last_message": None,
         }
 
@@ -407,17 +448,126 @@ def conversation_list(request):
 
         group_chats_data.append(group_data)
 
-    return Response({"private_chats": private_chats, "group_chats": group_chats_data})
+    return Response(
+        {
+            "private_chats": private_chats,
+            "group_chats": group_chats_data,
+            "page": page,
+            "has_next": has_next,
+        }
+    )
 
 
 @api_view(["PATCH"])
 @permission_classes([permissions.IsAuthenticated])
 def mark_as_read(request, message_id):
-    """处理消息，转换为已读"""
+    """把该消息所在的私聊标记为已读到这条消息"""
+    message = get_object_or_404(Message, id=message_id, recipient=request.user)
+    ConversationService.read_up_to(
+        request.user.id,
+        ChatEventLog.private_key(message.sender_id, request.user.id),
+        message.id,
+    )
+    return Response({"status": "message marked as read"})
+
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+def mark_conversation_read(request):
+    """
+    移动会话的已读水位
+
+    请求体 {"conversation": "private:1:2" 或 "group:3", "message_id": 已读到的消息ID}，
+    水位之前的消息全部视为已读，返回最新的未读数。
+    """
+    conversation = request.data.get("conversation")
     try:
-        message = get_object_or_404(Message, id=message_id, recipient=request.user)
-        message.is_read = True
-        message.save()
-        return Response({"status": "message marked as read"})
-    except Exception as e:
-        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        message_id = int(request.data.get("message_id"))
+        moved = ConversationService.read_up_to(request.user.id, conversation, message_id)
+    except (TypeError, ValueError):
+        return Response(
+            {"detail": "conversation 或 message_id 无效"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response(
+        {"moved": moved, "unread_count": UnreadCounterService.messages(request.user.id)}
+    )
+
+
+# 一次最多查询的用户数
+PRESENCE_QUERY_LIMIT = 200
+# 增量同步一次最多请求的会话数
+SYNC_CONVERSATION_LIMIT = 100
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def presence(request):
+    """批量查询用户在线状态，?user_ids=1,2,3"""
+    try:
+        user_ids = [
+            int(user_id)
+            for user_id in request.query_params.get("user_ids", "").split(",")
+            if user_id
+        ]
+    except ValueError:
+        return Response(
+            {"detail": "user_ids 必须是逗号分隔的整数"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(user_ids) > PRESENCE_QUERY_LIMIT:
+        return Response(
+            {"detail": f"一次最多查询 {PRESENCE_QUERY_LIMIT} 个用户"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response({"results": PresenceService.statuses(user_ids)})
+
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+def sync(request):
+    """
+    增量同步多个会话
+
+    请求体 {"conversations": {"private:1:2": 15, "group:3": 120}}，值为客户端已有的最大序号；
+    每个会话返回该序号之后新增、编辑和撤回的消息（按 change_seq 升序）以及新的序号，
+    has_more 为 true 时客户端用新的序号继续同步。无权访问的会话不返回。
+    """
+    positions = request.data.get("conversations")
+    if not isinstance(positions, dict):
+        return Response(
+            {"detail": "conversations 必须是会话到序号的映射"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(positions) > SYNC_CONVERSATION_LIMIT:
+        return Response(
+            {"detail": f"一次最多同步 {SYNC_CONVERSATION_LIMIT} 个会话"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    _, page_size = get_page_params(request, default_page_size=100, max_page_size=500)
+    results = {}
+    for conversation, last_seq in positions.items():
+        try:
+            last_seq = int(last_seq or 0)
+        except (TypeError, ValueError):
+            return Response(
+                {"detail": "序号必须是整数"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        page = MessageHistoryService.changes_since(
+            request.user.id, conversation, last_seq, limit=page_size
+        )
+        if page is None:
+            continue
+        messages, has_more = page
+        serializer_class = (
+            GroupMessageSerializer if conversation.startswith("group:") else MessageSerializer
+        )
+        results[conversation] = {
+            "messages": serializer_class(
+                messages, many=True, context={"request": request}
+            ).data,
+            "last_seq": messages[-1].change_seq if messages else last_seq,
+            "has_more": has_more,
+        }
+    return Response({"conversations": results})
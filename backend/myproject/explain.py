@@ -0,0 +1,46 @@
+import re
+
+from django.db import connection
+
+SEQUENTIAL_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    # SQLite 中 "SCAN 表名 USING [COVERING] INDEX" 仍然是走索引的
+    "sqlite": re.compile(r"\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX)"),
+}
+
+
+def explain(queryset):
+    """
+    返回查询的执行计划
+
+    PostgreSQL 对很小的表总是倾向顺序扫描，这里关闭 enable_seqscan，
+    这样只有确实没有可用索引的查询才会出现 Seq Scan。
+    """
+    if connection.vendor != "postgresql":
+        return queryset.explain()
+    with connection.cursor() as cursor:
+        cursor.execute("SET enable_seqscan = off")
+        try:
+            return queryset.explain()
+        finally:
+            cursor.execute("RESET enable_seqscan")
+
+
+def sequential_scans(queryset):
+    """返回执行计划中被顺序扫描的数据表"""
+    pattern = SEQUENTIAL_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None:
+        return []
+    tables = set(connection.introspection.table_names())
+    return [table for table in pattern.findall(explain(queryset)) if table in tables]
+
+
+class ExplainAssertionsMixin:
+    """测试用：断言热点查询不会退化为全表扫描"""
+
+    def assertNoSequentialScan(self, queryset):
+        scans = sequential_scans(queryset)
+        if scans:
+            self.fail(
+                f"查询对 {', '.join(scans)} 做了全表扫描:\n{explain(queryset)}\n{queryset.query}"
+            )
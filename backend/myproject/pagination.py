@@ -0,0 +1,113 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+
+class KeysetPagination:
+    """
+    基于排序键的游标分页（keyset pagination）
+
+    游标中只记录上一页最后一行的排序键，下一页通过
+    ``(created_at, id) < (上一页最后一行)`` 这样的条件直接定位，
+    不使用 OFFSET，也不统计总数，因此翻页耗时与表的大小无关。
+    ordering 中的所有字段必须同为升序或同为降序，最后一个字段应当唯一（通常是 id）。
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 20
+    max_page_size = 100
+
+    def __init__(self, ordering=("-created_at", "-id"), page_size=None, max_page_size=None):
+        self.ordering = tuple(ordering)
+        self.descending = self.ordering[0].startswith("-")
+        self.fields = [field.lstrip("-") for field in self.ordering]
+        if page_size is not None:
+            self.page_size = page_size
+        if max_page_size is not None:
+            self.max_page_size = max_page_size
+        self.next_cursor = None
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, values):
+        raw = json.dumps([str(value) for value in values], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor, model):
+        """
+        解析游标，按 model 中排序字段的类型转换每个值
+
+        游标由客户端传回，值的格式在这里校验，构造查询时不会再出错。
+        """
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        except (ValueError, TypeError):
+            raise NotFound("无效的游标")
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise NotFound("无效的游标")
+        try:
+            values = [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound("无效的游标")
+        if any(value is None for value in values):
+            raise NotFound("无效的游标")
+        return values
+
+    def get_position(self, obj):
+        """取出一行的排序键，obj 可以是模型实例或 values() 得到的字典"""
+        if isinstance(obj, dict):
+            return [obj[field] for field in self.fields]
+        return [getattr(obj, field) for field in self.fields]
+
+    def build_filter(self, values):
+        """构造 (f1, f2, ...) 在 values 之后的行比较条件"""
+        lookup = "lt" if self.descending else "gt"
+        condition = Q()
+        for index in range(len(self.fields)):
+            equal = {self.fields[i]: values[i] for i in range(index)}
+            equal[f"{self.fields[index]}__{lookup}"] = values[index]
+            condition |= Q(**equal)
+        return condition
+
+    def paginate_queryset(self, queryset, request):
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self.build_filter(self.decode_cursor(cursor, queryset.model)))
+
+        # 多取一行用来判断是否还有下一页
+        rows = list(queryset[: page_size + 1])
+        page = rows[:page_size]
+        if len(rows) > page_size:
+            self.next_cursor = self.encode_cursor(self.get_position(page[-1]))
+        else:
+            self.next_cursor = None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({"results": data, "next": self.next_cursor})
+
+
+def get_page_params(request, default_page_size=20, max_page_size=50):
+    """解析 page / page_size，返回 (page, page_size)"""
+    try:
+        page = max(1, int(request.query_params.get("page", 1)))
+        page_size = int(request.query_params.get("page_size", default_page_size))
+    except (TypeError, ValueError):
+        page, page_size = 1, default_page_size
+    return page, max(1, min(page_size, max_page_size))
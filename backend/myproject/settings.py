@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     "messaging",
     "channels",
     "ai",
+    "tasks",
 ]
 
 MIDDLEWARE = [
@@ -213,21 +214,114 @@ REST_FRAMEWORK = {
 
 # 添加channels配置
 ASGI_APPLICATION = "myproject.asgi.application"
+# REDIS_HOSTS 为逗号分隔的 host:port 列表时，channels_redis 按一致性哈希把
+# 组和通道分片到多个 Redis 实例上；未设置时使用单个 REDIS_HOST
+CHANNEL_REDIS_HOSTS = [
+    (host.rsplit(":", 1)[0], int(host.rsplit(":", 1)[1]) if ":" in host else 6379)
+    for host in os.environ.get("REDIS_HOSTS", "").split(",")
+    if host
+] or [
+    (
+        os.environ.get("REDIS_HOST", "localhost"),
+        int(os.environ.get("REDIS_PORT", 6379)),
+    )
+]
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [
-                (
-                    os.environ.get("REDIS_HOST", "localhost"),
-                    int(os.environ.get("REDIS_PORT", 6379)),
-                )
-            ],
+            "hosts": CHANNEL_REDIS_HOSTS,
         },
     },
 }
+# 批量 group_send 时同时进行的发送数
+CHANNEL_FANOUT_CONCURRENCY = 100
+# 缓存配置：部署环境使用 Redis，本地开发和测试没有 Redis 时退回进程内缓存
+if os.environ.get("REDIS_HOST"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://{}:{}/1".format(
+                os.environ["REDIS_HOST"], os.environ.get("REDIS_PORT", 6379)
+            ),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+# 未读数缓存的过期时间（秒），过期后从数据库重新统计，兼作定期校准
+UNREAD_COUNTER_TIMEOUT = 3600
+# 群成员集合缓存的过期时间（秒），成员变化时会主动清除
+GROUP_MEMBERSHIP_CACHE_TIMEOUT = 3600
+# 按需订阅模式下，未订阅群聊的新消息提示的节流间隔（秒）
+GROUP_ACTIVITY_HINT_INTERVAL = 5
+# 粉丝列表缓存的过期时间（秒），关注关系变化时会主动清除
+FOLLOWER_CACHE_TIMEOUT = 3600
+# 在线状态：超过 PRESENCE_TTL 秒没有心跳视为离线（客户端每 30 秒发送一次 ping）
+PRESENCE_TTL = 90
+# 上下线变化合并广播的间隔（秒），同时用于防抖
+PRESENCE_DIGEST_INTERVAL = 3
+# WebSocket 合并推送（客户端以 ?batch=1 开启）：等待窗口（秒）和单帧最多事件数
+WEBSOCKET_BATCH_WINDOW = 0.05
+WEBSOCKET_BATCH_SIZE = 50
+# 会话消息事件日志：部署环境写入 Redis Stream，未配置 Redis 时使用进程内替代
+CHAT_EVENT_LOG_URL = (
+    "redis://{}:{}/2".format(os.environ["REDIS_HOST"], os.environ.get("REDIS_PORT", 6379))
+    if os.environ.get("REDIS_HOST")
+    else None
+)
+# 每个会话保留的事件条数（近似截断）和空闲会话事件流的过期时间（秒）
+CHAT_EVENT_LOG_MAXLEN = 1000
+CHAT_EVENT_LOG_TTL = 7 * 86400
+# 重连时单个会话最多补发的事件数，缺口更大时客户端重新拉取
+CHAT_EVENT_LOG_RESUME_LIMIT = 200
+# 补发时在需要的条数之外多读的事件数，覆盖并发提交造成的写入乱序
+CHAT_EVENT_LOG_REORDER_WINDOW = 100
+# 群聊消息延迟写入（默认关闭）：消息先进入 Redis 持久缓冲并立即推送，按间隔或条数批量写入数据库；
+# 开启时 Redis 需要开启 AOF 持久化；崩溃遗留的消息由存活的进程定期补写，也可以运行 recover_group_messages
+GROUP_MESSAGE_WRITE_BEHIND = os.environ.get("GROUP_MESSAGE_WRITE_BEHIND", "0") == "1"
+GROUP_MESSAGE_FLUSH_INTERVAL = 0.2
+GROUP_MESSAGE_FLUSH_SIZE = 200
+# 每次从数据库序列预取的消息ID数
+GROUP_MESSAGE_ID_BLOCK = 100
+GROUP_MESSAGE_WAL_URL = CHAT_EVENT_LOG_URL
+# 进程存活标记的过期时间（秒），进程每隔三分之一的时间刷新一次，过期后进程的缓冲视为遗留
+GROUP_MESSAGE_WAL_HEARTBEAT = 30
+# 存活的进程检查并补写遗留缓冲的间隔（秒）
+GROUP_MESSAGE_RECOVER_INTERVAL = 60
+# 通知聚合的时间窗口（秒），同一帖子同一类型的通知在窗口内合并为一条
+NOTIFICATION_AGGREGATION_WINDOW = 86400
+# 通知保留天数，更早的通知由 archive_notifications 命令迁移到归档表
+NOTIFICATION_RETENTION_DAYS = 90
 import os
 
 DEEPSEEK_API_KEY = os.environ.get(
     "DEEPSEEK_API_KEY",
 )
+
+# 关注流推模式（fan-out-on-write）配置
+# 开启后发帖时把帖子写入每个粉丝的 TimelineEntry，粉丝数超过阈值的作者不推送，读取时再合并
+TIMELINE_FANOUT_ENABLED = os.environ.get("TIMELINE_FANOUT_ENABLED", "0") == "1"
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get("TIMELINE_FANOUT_MAX_FOLLOWERS", 1000))
+# 新关注某人时回填其最近的帖子条数
+TIMELINE_BACKFILL_LIMIT = 200
+
+# 后台任务队列
+# 同步模式下任务在请求的事务提交后立即执行，本地开发和测试不需要启动 worker；
+# 部署时设置 TASKS_EAGER=0 并运行 python manage.py run_tasks
+TASKS_EAGER = os.environ.get("TASKS_EAGER", "1") == "1"
+# 失败重试的基础间隔（秒），第 n 次失败后等待 TASKS_RETRY_DELAY * 2^(n-1)
+TASKS_RETRY_DELAY = 10
+# 任务处于 running 超过该时间（秒）视为 worker 已退出，重新放回队列
+TASKS_LOCK_TIMEOUT = 300
+# worker 在队列为空时的轮询间隔（秒）
+TASKS_POLL_INTERVAL = 1
+# 完成（成功或失败）的任务保留天数，worker 每小时清理一次
+TASKS_RETENTION_DAYS = 7
+
+# 搜索后端，留空时按数据库自动选择：
+# PostgreSQL -> posts.search.PostgresSearchBackend，SQLite -> posts.search.SQLiteSearchBackend
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND") or None
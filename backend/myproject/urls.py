@@ -38,6 +38,7 @@ def api_root(request):
                 "interactions": "/api/interactions/",
                 "messages": "/api/messages/",
                 "ai": "/api/ai/deepseek/",
+                "tasks": "/api/tasks/",
                 "token_refresh": "/api/token/refresh/",
             },
         }
@@ -53,6 +54,7 @@ urlpatterns = [
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("api/messages/", include("messaging.urls")),
     path("api/ai/deepseek/", include("ai.urls")),
+    path("api/tasks/", include("tasks.urls")),
 ]
 
 # 显式添加静态文件服务路由
@@ -17,7 +17,13 @@ class PostAdmin(admin.ModelAdmin):
     )
     list_filter = ("created_at", "updated_at", "author")
     search_fields = ("author__username", "content")
-    readonly_fields = ("created_at", "updated_at", "image_preview")
+    readonly_fields = (
+        "created_at",
+        "updated_at",
+        "image_preview",
+        "like_count",
+        "comment_count",
+    )
     date_hierarchy = "created_at"
     raw_id_fields = ("author",)
 
@@ -34,7 +40,6 @@ class PostAdmin(admin.ModelAdmin):
 
     def statistics_view(self, request):
         # 获取帖子相关的统计数据
-        from django.db.models import Count
         from django.utils import timezone
         from datetime import timedelta
 
@@ -42,9 +47,7 @@ class PostAdmin(admin.ModelAdmin):
         total_posts = Post.objects.count()
 
         # 热门帖子排行
-        popular_posts = Post.objects.annotate(comment_count=Count("comments")).order_by(
-            "-comment_count"
-        )[:5]
+        popular_posts = Post.objects.select_related("author").order_by("-comment_count")[:5]
 
         # 发帖趋势（最近7天）
         week_ago = timezone.now() - timedelta(days=7)
@@ -87,14 +90,16 @@ class PostAdmin(admin.ModelAdmin):
     image_preview.short_description = "Image Preview"
 
     def comment_count(self, obj):
-        return obj.comments.count()
+        return obj.comment_count
 
     comment_count.short_description = "Comments"
+    comment_count.admin_order_field = "comment_count"
 
     def like_count(self, obj):
-        return obj.likes.count()
+        return obj.like_count
 
     like_count.short_description = "Likes"
+    like_count.admin_order_field = "like_count"
 
 
 @admin.register(Comment)
@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+from interactions.models import Like
+from .models import Comment
+from .serializers import PostSerializer
+
+
+class FeedAssembler:
+    """
+    帖子列表的批量组装器
+
+    PostSerializer 逐条序列化时会为每个帖子单独查询点赞数、是否点赞、
+    是否关注作者和评论树。这里先用固定数量的 IN 查询把一整页需要的数据取出来，
+    再通过 serializer context 传给序列化器，查询次数与每页条数无关：
+    帖子(含作者及冗余点赞数) + 当前用户的点赞 + 当前用户的关注 + 全部评论(含作者)。
+    """
+
+    def __init__(self, request):
+        self.request = request
+        user = getattr(request, "user", None)
+        self.viewer = user if user is not None and user.is_authenticated else None
+
+        self.liked_post_ids = set()
+        self.following_ids = set()
+        # post_id -> 顶层评论列表；comment_id -> 子评论列表
+        self.top_level_comments = defaultdict(list)
+        self.replies = defaultdict(list)
+
+    @staticmethod
+    def prepare_queryset(queryset):
+        """帖子查询需要带上作者，避免序列化 author 时逐条查询"""
+        return queryset.select_related("author")
+
+    def load(self, posts):
+        post_ids = [post.id for post in posts]
+        if not post_ids:
+            return self
+
+        if self.viewer is not None:
+            self.liked_post_ids = set(
+                Like.objects.filter(user=self.viewer, post_id__in=post_ids).values_list(
+                    "post_id", flat=True
+                )
+            )
+            author_ids = {post.author_id for post in posts}
+            self.following_ids = set(
+                self.viewer.following.filter(id__in=author_ids).values_list(
+                    "id", flat=True
+                )
+            )
+
+        comments = (
+            Comment.objects.filter(post_id__in=post_ids)
+            .select_related("author")
+            .order_by("created_at", "id")
+        )
+        for comment in comments:
+            if comment.parent_id is None:
+                self.top_level_comments[comment.post_id].append(comment)
+            else:
+                self.replies[comment.parent_id].append(comment)
+        return self
+
+    def get_serializer_context(self):
+        return {"request": self.request, "feed": self}
+
+    def serialize(self, posts, many=True):
+        if many:
+            posts = list(posts)
+            self.load(posts)
+        else:
+            self.load([posts])
+        return PostSerializer(
+            posts, many=many, context=self.get_serializer_context()
+        ).data
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from posts.timeline import TimelineService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = '按当前的关注关系重建用户的关注流（开启 TIMELINE_FANOUT_ENABLED 前执行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='只重建指定用户ID的关注流')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user']:
+            users = users.filter(id=options['user'])
+
+        count = 0
+        for user in users.iterator():
+            TimelineService.rebuild(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 个用户的关注流'))
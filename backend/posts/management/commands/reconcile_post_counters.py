@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from posts.services import PostCounterService
+
+
+class Command(BaseCommand):
+    help = '按实际数据重算帖子的点赞数和评论数'
+
+    def handle(self, *args, **options):
+        fixed = PostCounterService.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'已修正 {fixed} 个帖子的计数'))
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.5 on 2026-10-17 16:40
+
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS posts_post_content_fts ON posts_post "
+    "USING GIN (to_tsvector('simple'::regconfig, COALESCE(content, '')))",
+    "CREATE INDEX IF NOT EXISTS posts_post_content_trgm ON posts_post "
+    "USING GIN (UPPER(content) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS accounts_user_username_trgm ON accounts_user "
+    "USING GIN (UPPER(username) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS accounts_user_bio_trgm ON accounts_user "
+    "USING GIN (UPPER(bio) gin_trgm_ops)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS posts_post_content_fts",
+    "DROP INDEX IF EXISTS posts_post_content_trgm",
+    "DROP INDEX IF EXISTS accounts_user_username_trgm",
+    "DROP INDEX IF EXISTS accounts_user_bio_trgm",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts "
+    "USING fts5(content, tokenize='trigram')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS accounts_user_fts "
+    "USING fts5(username, bio, tokenize='trigram')",
+    "INSERT INTO posts_post_fts(rowid, content) "
+    "SELECT id, COALESCE(content, '') FROM posts_post",
+    "INSERT INTO accounts_user_fts(rowid, username, bio) "
+    "SELECT id, COALESCE(username, ''), COALESCE(bio, '') FROM accounts_user",
+]
+
+SQLITE_REVERSE = [
+    "DROP TABLE IF EXISTS posts_post_fts",
+    "DROP TABLE IF EXISTS accounts_user_fts",
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("posts", "0006_timelineentry"),
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"postgresql": POSTGRES_FORWARD, "sqlite": SQLITE_FORWARD}),
+            run({"postgresql": POSTGRES_REVERSE, "sqlite": SQLITE_REVERSE}),
+        ),
+    ]
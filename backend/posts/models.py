@@ -11,9 +11,18 @@ class Post(models.Model):
     image = models.ImageField(upload_to="posts/", blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 冗余计数，由 PostCounterService 维护，reconcile_post_counters 命令负责纠偏
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # 关注流和个人主页：按作者取最新的帖子
+            models.Index(fields=["author", "-created_at", "-id"], name="post_author_time_idx"),
+            # 全站帖子流的 (created_at, id) 游标分页
+            models.Index(fields=["-created_at", "-id"], name="post_time_idx"),
+        ]
 
     def __str__(self):
         return f"{self.author.username}:{self.content[0:50]}..."
@@ -34,3 +43,33 @@ class Comment(models.Model):
 
     def __str__(self):
         return f"{self.author.username}:{self.content[0:50]}..."
+
+
+class TimelineEntry(models.Model):
+    """
+    推模式（fan-out-on-write）的关注流
+
+    发帖时为作者本人和每个粉丝各写一行，读关注流时只需按用户做一次索引范围扫描。
+    created_at 冗余自帖子的发布时间，用于和帖子表一致的 (created_at, id) 游标分页。
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries"
+    )
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at", "-post"], name="timeline_user_created_idx"
+            ),
+            models.Index(fields=["user", "author"], name="timeline_user_author_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} <- {self.post_id}"
@@ -0,0 +1,227 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Post
+
+User = get_user_model()
+
+# 中日韩文字没有空格分词，全文检索的分词器切不出词，改用三元组(trigram)匹配
+CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def has_cjk(text):
+    return bool(CJK_RE.search(text))
+
+
+class BaseSearchBackend:
+    """
+    搜索后端接口
+
+    search_* 返回按相关度排序的一页主键列表，index_* / remove_* 在保存或删除时增量维护索引。
+    """
+
+    def search_posts(self, query, offset=0, limit=20):
+        raise NotImplementedError
+
+    def search_users(self, query, offset=0, limit=20, exclude_id=None):
+        raise NotImplementedError
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_user(self, user):
+        pass
+
+    def remove_user(self, user_id):
+        pass
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """不依赖任何数据库特性的 icontains 实现，用于不支持全文检索的数据库"""
+
+    def search_posts(self, query, offset=0, limit=20):
+        queryset = Post.objects.filter(
+            Q(content__icontains=query) | Q(author__username__icontains=query)
+        ).order_by("-created_at", "-id")
+        return list(queryset.values_list("id", flat=True)[offset : offset + limit])
+
+    def search_users(self, query, offset=0, limit=20, exclude_id=None):
+        queryset = User.objects.filter(
+            Q(username__icontains=query) | Q(bio__icontains=query)
+        ).order_by("username", "id")
+        if exclude_id is not None:
+            queryset = queryset.exclude(id=exclude_id)
+        return list(queryset.values_list("id", flat=True)[offset : offset + limit])
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    PostgreSQL 后端
+
+    英文等有空格分词的内容走 to_tsvector('simple') + GIN 表达式索引并按 ts_rank 排序；
+    至少 3 个字符的中文查询走 pg_trgm 的 GIN 索引（UPPER(col) gin_trgm_ops），
+    icontains 生成的 UPPER(col) LIKE UPPER('%q%') 正好能用上这个索引。
+    不足 3 个字符的查询切不出三元组，任何索引都无法处理 LIKE '%q%'，
+    改为沿 post_time_idx 按时间倒序扫描，凑满一页即停止。
+    作者用户名的匹配单独在 accounts_user 上查询，得到的作者ID再和内容匹配合并，
+    不在帖子查询中 JOIN 用户表，两边的索引都能用上。
+    """
+
+    # 用户名匹配最多取的作者数，避免很短的查询把大量作者ID带进帖子查询
+    author_match_limit = 100
+
+    def _author_ids(self, query):
+        return list(
+            User.objects.filter(username__icontains=query).values_list("id", flat=True)[
+                : self.author_match_limit
+            ]
+        )
+
+    def search_posts(self, query, offset=0, limit=20):
+        from django.contrib.postgres.search import (
+            SearchQuery,
+            SearchRank,
+            SearchVector,
+            TrigramSimilarity,
+        )
+
+        author_match = Q(author_id__in=self._author_ids(query))
+        if len(query) < 3:
+            queryset = Post.objects.filter(Q(content__icontains=query) | author_match).order_by(
+                "-created_at", "-id"
+            )
+            return list(queryset.values_list("id", flat=True)[offset : offset + limit])
+        if has_cjk(query):
+            queryset = Post.objects.filter(Q(content__icontains=query) | author_match).annotate(
+                rank=TrigramSimilarity("content", query)
+            )
+        else:
+            vector = SearchVector("content", config="simple")
+            search_query = SearchQuery(query, config="simple")
+            queryset = (
+                Post.objects.annotate(search=vector)
+                .filter(Q(search=search_query) | author_match)
+                .annotate(rank=SearchRank(vector, search_query))
+            )
+        queryset = queryset.order_by("-rank", "-created_at", "-id")
+        return list(queryset.values_list("id", flat=True)[offset : offset + limit])
+
+    def search_users(self, query, offset=0, limit=20, exclude_id=None):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        queryset = (
+            User.objects.filter(Q(username__icontains=query) | Q(bio__icontains=query))
+            .annotate(rank=TrigramSimilarity("username", query))
+            .order_by("-rank", "id")
+        )
+        if exclude_id is not None:
+            queryset = queryset.exclude(id=exclude_id)
+        return list(queryset.values_list("id", flat=True)[offset : offset + limit])
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    SQLite 后端（开发环境）
+
+    使用 FTS5 的 trigram 分词器建立 posts_post_fts / accounts_user_fts 两张虚拟表，
+    rowid 与原表主键一致，按 bm25 排序。trigram 至少需要 3 个字符，更短的查询退回 icontains。
+    """
+
+    post_table = "posts_post_fts"
+    user_table = "accounts_user_fts"
+
+    def __init__(self):
+        self.fallback = SimpleSearchBackend()
+
+    @staticmethod
+    def _phrase(query):
+        # 整体作为一个短语匹配，避免用户输入中的 FTS5 语法字符被解释
+        return '"' + query.replace('"', '""') + '"'
+
+    def search_posts(self, query, offset=0, limit=20):
+        if len(query) < 3:
+            return self.fallback.search_posts(query, offset, limit)
+        phrase = self._phrase(query)
+        sql = f"""
+            SELECT id FROM (
+                SELECT rowid AS id, rank FROM {self.post_table}
+                WHERE {self.post_table} MATCH %s
+                UNION ALL
+                SELECT p.id, 0 FROM posts_post p
+                JOIN {self.user_table} u ON u.rowid = p.author_id
+                WHERE {self.user_table} MATCH %s
+            )
+            GROUP BY id ORDER BY MIN(rank), id DESC LIMIT %s OFFSET %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [phrase, f"username : {phrase}", limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_users(self, query, offset=0, limit=20, exclude_id=None):
+        if len(query) < 3:
+            return self.fallback.search_users(query, offset, limit, exclude_id)
+        sql = f"""
+            SELECT rowid FROM {self.user_table}
+            WHERE {self.user_table} MATCH %s AND rowid != %s
+            ORDER BY rank LIMIT %s OFFSET %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql,
+                [
+                    self._phrase(query),
+                    exclude_id if exclude_id is not None else -1,
+                    limit,
+                    offset,
+                ],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {self.post_table}(rowid, content) VALUES (%s, %s)",
+                [post.pk, post.content or ""],
+            )
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.post_table} WHERE rowid = %s", [post_id])
+
+    def index_user(self, user):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {self.user_table}(rowid, username, bio) VALUES (%s, %s, %s)",
+                [user.pk, user.username or "", user.bio or ""],
+            )
+
+    def remove_user(self, user_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.user_table} WHERE rowid = %s", [user_id])
+
+
+_backend = None
+
+
+def get_search_backend():
+    """按 SEARCH_BACKEND 配置创建搜索后端，未配置时按数据库类型选择"""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "SEARCH_BACKEND", None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == "postgresql":
+            _backend = PostgresSearchBackend()
+        elif connection.vendor == "sqlite":
+            _backend = SQLiteSearchBackend()
+        else:
+            _backend = SimpleSearchBackend()
+    return _backend
@@ -26,7 +26,12 @@ class CommentSerializer(serializers.ModelSerializer):
 
     def get_replies(self, obj):
         # 使用 self.__class__ (也就是 CommentSerializer 自己) 来序列化子评论
-        queryset = obj.replies.all().order_by('created_at')
+        feed = self.context.get("feed")
+        if feed is not None:
+            # FeedAssembler 已经批量取出了整棵评论树
+            queryset = feed.replies.get(obj.id, [])
+        else:
+            queryset = obj.replies.all().order_by('created_at')
         serializer = self.__class__(queryset, many=True, context=self.context)
         return serializer.data
 
@@ -59,7 +64,7 @@ class PostSerializer(serializers.ModelSerializer):
     author_id = serializers.IntegerField(source="author.id", read_only=True)
     
     comments = serializers.SerializerMethodField()
-    likes_count = serializers.SerializerMethodField()
+    likes_count = serializers.IntegerField(source="like_count", read_only=True)
     is_liked = serializers.SerializerMethodField()
     is_following = serializers.SerializerMethodField()
 
@@ -73,20 +78,29 @@ class PostSerializer(serializers.ModelSerializer):
 
     def get_comments(self, obj):
         # 逻辑保持不变，只获取顶层评论
-        top_level_comments = obj.comments.filter(parent__isnull=True).order_by('created_at')
+        feed = self.context.get("feed")
+        if feed is not None:
+            top_level_comments = feed.top_level_comments.get(obj.id, [])
+        else:
+            top_level_comments = obj.comments.filter(parent__isnull=True).order_by('created_at')
         request = self.context.get("request")
-        return CommentSerializer(top_level_comments, many=True, context={'request': request}).data
-
-    def get_likes_count(self, obj):
-        return obj.likes.count()
+        return CommentSerializer(
+            top_level_comments, many=True, context={'request': request, 'feed': feed}
+        ).data
 
     def get_is_liked(self, obj):
+        feed = self.context.get("feed")
+        if feed is not None:
+            return obj.id in feed.liked_post_ids
         request = self.context.get("request")
         if request and hasattr(request, "user") and request.user.is_authenticated:
             return obj.likes.filter(user=request.user).exists()
         return False
 
     def get_is_following(self, obj):
+        feed = self.context.get("feed")
+        if feed is not None:
+            return obj.author_id in feed.following_ids
         request = self.context.get("request")
         if request and hasattr(request, "user") and request.user.is_authenticated:
             # 假设你的 User 模型有 'following' 这个多对多字段
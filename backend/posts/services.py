@@ -0,0 +1,79 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from interactions.models import Like
+from .models import Post, Comment
+
+
+class PostCounterService:
+    """维护 Post 上冗余的点赞数和评论数"""
+
+    @staticmethod
+    def _adjust(post_id, field, delta):
+        # 用 F 表达式在数据库中原子地加减，避免并发点赞时读-改-写丢失更新
+        if delta >= 0:
+            value = F(field) + delta
+        else:
+            value = Greatest(F(field) + delta, Value(0))
+        Post.objects.filter(pk=post_id).update(**{field: value})
+
+    @staticmethod
+    def like_added(post):
+        PostCounterService._adjust(post.pk, "like_count", 1)
+
+    @staticmethod
+    def like_removed(post, count=1):
+        if count:
+            PostCounterService._adjust(post.pk, "like_count", -count)
+
+    @staticmethod
+    def comment_added(comment):
+        PostCounterService._adjust(comment.post_id, "comment_count", 1)
+
+    @staticmethod
+    def comment_removed(comment):
+        """删除评论会级联删除所有回复，需要先统计整棵子树的大小"""
+        total = 1
+        parent_ids = [comment.pk]
+        while parent_ids:
+            parent_ids = list(
+                Comment.objects.filter(parent_id__in=parent_ids).values_list("id", flat=True)
+            )
+            total += len(parent_ids)
+        PostCounterService._adjust(comment.post_id, "comment_count", -total)
+
+    @staticmethod
+    def get_like_count(post):
+        return Post.objects.values_list("like_count", flat=True).get(pk=post.pk)
+
+    @staticmethod
+    def reconcile(queryset=None):
+        """按实际的点赞/评论数重算计数，返回被修正的帖子数"""
+
+        def count_of(model):
+            return Coalesce(
+                Subquery(
+                    model.objects.filter(post=OuterRef("pk"))
+                    .order_by()
+                    .values("post")
+                    .annotate(count=Count("id"))
+                    .values("count")
+                ),
+                0,
+            )
+
+        if queryset is None:
+            queryset = Post.objects.all()
+        drifted = (
+            queryset.annotate(
+                actual_likes=count_of(Like), actual_comments=count_of(Comment)
+            )
+            .exclude(like_count=F("actual_likes"), comment_count=F("actual_comments"))
+            .values_list("id", "actual_likes", "actual_comments")
+        )
+        fixed = [
+            Post(id=post_id, like_count=likes, comment_count=comments)
+            for post_id, likes, comments in drifted
+        ]
+        Post.objects.bulk_update(fixed, ["like_count", "comment_count"], batch_size=500)
+        return len(fixed)
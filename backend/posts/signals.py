@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Post
+from .search import get_search_backend
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    """帖子保存后增量更新搜索索引"""
+    get_search_backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post(sender, instance, **kwargs):
+    get_search_backend().remove_post(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, update_fields=None, **kwargs):
+    """用户资料保存后增量更新搜索索引"""
+    # 登录时只更新 last_login，不需要重建索引
+    if update_fields is not None and not {"username", "bio"} & set(update_fields):
+        return
+    get_search_backend().index_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def remove_user(sender, instance, **kwargs):
+    get_search_backend().remove_user(instance.pk)
@@ -0,0 +1,37 @@
+from accounts.models import User
+from tasks.queue import task
+from .models import Post
+from .timeline import TimelineService
+
+
+@task()
+def fan_out(post_id):
+    post = Post.objects.select_related("author").filter(pk=post_id).first()
+    if post is not None:
+        TimelineService.fan_out(post)
+
+
+@task()
+def backfill(follower_id, followee_id):
+    follower = User.objects.filter(pk=follower_id).first()
+    # 关注后又取消关注时，回填任务可能晚于清理任务执行，这里以当前关注关系为准
+    if follower is None or not follower.following.filter(pk=followee_id).exists():
+        return
+    TimelineService.backfill(follower, User.objects.get(pk=followee_id))
+
+
+@task()
+def remove(follower_id, followee_id):
+    follower = User.objects.filter(pk=follower_id).first()
+    if follower is None or follower.following.filter(pk=followee_id).exists():
+        return
+    followee = User.objects.filter(pk=followee_id).first()
+    if followee is not None:
+        TimelineService.remove(follower, followee)
+
+
+@task()
+def backfill_followers(author_id):
+    author = User.objects.filter(pk=author_id).first()
+    if author is not None:
+        TimelineService.backfill_followers(author)
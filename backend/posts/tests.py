@@ -1,3 +1,219 @@
-from django.test import TestCase
+import base64
+import json
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from interactions.models import Like
+from myproject.explain import ExplainAssertionsMixin
+from . import tasks as timeline_tasks
+from .search import PostgresSearchBackend, SQLiteSearchBackend, SimpleSearchBackend
+from .models import Post, Comment, TimelineEntry
+from .services import PostCounterService
+
+
+class FeedQueryCountTests(TestCase):
+    """帖子列表的查询次数不应随每页条数增长"""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(
+            username="viewer", email="viewer@example.com", password="password"
+        )
+        self.authors = [
+            User.objects.create_user(
+                username=f"author{i}", email=f"author{i}@example.com", password="password"
+            )
+            for i in range(3)
+        ]
+        self.viewer.following.add(*self.authors)
+        for i in range(30):
+            author = self.authors[i % len(self.authors)]
+            post = Post.objects.create(author=author, content=f"post {i}")
+            comment = Comment.objects.create(post=post, author=self.viewer, content="c")
+            Comment.objects.create(post=post, author=author, content="r", parent=comment)
+            Like.objects.create(user=self.viewer, post=post)
+        PostCounterService.reconcile()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def count_queries(self, page_size):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/posts/", {"page_size": page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), page_size)
+        return len(context.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.assertEqual(self.count_queries(5), self.count_queries(25))
+
+    def test_feed_payload(self):
+        response = self.client.get("/api/posts/", {"page_size": 1})
+        post = response.data["results"][0]
+        self.assertEqual(post["likes_count"], 1)
+        self.assertTrue(post["is_liked"])
+        self.assertTrue(post["is_following"])
+        self.assertEqual(len(post["comments"]), 1)
+        self.assertEqual(len(post["comments"][0]["replies"]), 1)
+
+    def test_malformed_cursor(self):
+        for values in (["not-a-date", "1"], ["2026-10-17 00:00:00+00:00", "x"], [None, "1"]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            response = self.client.get("/api/posts/", {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class PostHotQueryPlanTests(ExplainAssertionsMixin, TestCase):
+    """帖子流相关的热点查询必须走索引"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(
+                username=f"author{i}", email=f"author{i}@example.com", password="password"
+            )
+            for i in range(5)
+        ]
+        Post.objects.bulk_create(
+            [Post(author=cls.authors[i % 5], content=f"post {i}") for i in range(50)]
+        )
+
+    def test_following_timeline(self):
+        self.assertNoSequentialScan(
+            Post.objects.filter(author__in=self.authors[:3]).order_by("-created_at", "-id")[:20]
+        )
+
+    def test_user_posts(self):
+        self.assertNoSequentialScan(
+            Post.objects.filter(author=self.authors[0]).order_by("-created_at", "-id")[:20]
+        )
+
+    def test_global_timeline(self):
+        self.assertNoSequentialScan(Post.objects.order_by("-created_at", "-id")[:20])
+
+
+@override_settings(TIMELINE_FANOUT_ENABLED=True, TIMELINE_FANOUT_MAX_FOLLOWERS=2, TASKS_EAGER=True)
+class TimelineTests(TestCase):
+    """关注流：普通作者推送，高粉作者读取时拉取并按时间归并"""
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com", password="password"
+            )
+            for i in range(5)
+        ]
+        self.viewer, self.author, self.star = self.users[:3]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.viewer.following.add(self.author, self.star)
+            self.star.followers.add(*self.users[3:])
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def post(self, author, content):
+        post = Post.objects.create(author=author, content=content)
+        timeline_tasks.fan_out(post.id)
+        return post
+
+    def entry_post_ids(self, user):
+        return set(TimelineEntry.objects.filter(user=user).values_list("post_id", flat=True))
+
+    def test_follower_count(self):
+        self.star.refresh_from_db()
+        self.assertEqual(self.star.follower_count, 3)
+        self.star.followers.remove(self.users[3], self.author)
+        self.star.refresh_from_db()
+        self.assertEqual(self.star.follower_count, 2)
+        self.viewer.following.clear()
+        self.star.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual((self.star.follower_count, self.author.follower_count), (1, 0))
+
+    def test_fan_out(self):
+        normal = self.post(self.author, "normal")
+        starred = self.post(self.star, "star")
+        self.assertEqual(self.entry_post_ids(self.viewer), {normal.id})
+        self.assertEqual(self.entry_post_ids(self.author), {normal.id})
+        # 高粉作者只写入自己的关注流
+        self.assertEqual(self.entry_post_ids(self.star), {starred.id})
+        self.assertEqual(self.entry_post_ids(self.users[3]), set())
+
+    def test_merge_and_cursor_pages(self):
+        posts = [self.post(self.users[1 + i % 2], f"post {i}") for i in range(7)]
+        ids, cursor = [], None
+        while True:
+            params = {"page_size": 3}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.client.get("/api/posts/", params)
+            self.assertEqual(response.status_code, 200)
+            ids += [post["id"] for post in response.data["results"]]
+            cursor = response.data["next"]
+            if not cursor:
+                break
+        expected = sorted(posts, key=lambda post: (post.created_at, post.id), reverse=True)
+        self.assertEqual(ids, [post.id for post in expected])
+
+    def test_backfill_after_dropping_below_threshold(self):
+        starred = self.post(self.star, "star")
+        self.assertNotIn(starred.id, self.entry_post_ids(self.viewer))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.star.followers.remove(self.users[4])
+        self.assertIn(starred.id, self.entry_post_ids(self.viewer))
+        self.assertIn(starred.id, self.entry_post_ids(self.users[3]))
+
+
+class SearchBackendCases:
+    """各搜索后端共用的用例，子类提供 backend"""
+
+    backend = None
+
+    def setUp(self):
+        self.searcher = User.objects.create_user(
+            username="searcher", email="searcher@example.com", password="password"
+        )
+        self.other = User.objects.create_user(
+            username="other", email="other@example.com", password="password", bio="hello bio"
+        )
+        self.english = Post.objects.create(author=self.other, content="hello world")
+        self.chinese = Post.objects.create(author=self.other, content="今天天气很好")
+        self.authored = Post.objects.create(author=self.searcher, content="nothing here")
+
+    def test_content(self):
+        self.assertEqual(self.backend.search_posts("hello"), [self.english.id])
+        self.assertEqual(self.backend.search_posts("天气很"), [self.chinese.id])
+        # 不足 3 个字符的查询
+        self.assertEqual(self.backend.search_posts("天气"), [self.chinese.id])
+
+    def test_author(self):
+        self.assertEqual(self.backend.search_posts("searcher"), [self.authored.id])
+
+    def test_paging(self):
+        ids = self.backend.search_posts("e", limit=10)
+        self.assertEqual(
+            self.backend.search_posts("e", offset=1, limit=10), ids[1:]
+        )
+
+    def test_users(self):
+        self.assertEqual(self.backend.search_users("searcher"), [self.searcher.id])
+        self.assertEqual(self.backend.search_users("hello"), [self.other.id])
+        self.assertEqual(
+            self.backend.search_users("searcher", exclude_id=self.searcher.id), []
+        )
+
+
+class SimpleSearchBackendTests(SearchBackendCases, TestCase):
+    backend = SimpleSearchBackend()
+
+
+@skipUnless(connection.vendor == "sqlite", "需要 SQLite FTS5")
+class SQLiteSearchBackendTests(SearchBackendCases, TestCase):
+    backend = SQLiteSearchBackend()
+
+
+@skipUnless(connection.vendor == "postgresql", "需要 PostgreSQL 和 pg_trgm")
+class PostgresSearchBackendTests(SearchBackendCases, TestCase):
+    backend = PostgresSearchBackend()
@@ -0,0 +1,159 @@
+from django.conf import settings
+
+from myproject.pagination import KeysetPagination
+from .models import Post, TimelineEntry
+
+
+class TimelineService:
+    """
+    推拉结合的关注流
+
+    普通作者发帖时把帖子推送到每个粉丝的 TimelineEntry（写扩散）；
+    粉丝数超过 TIMELINE_FANOUT_MAX_FOLLOWERS 的作者不推送，
+    读取时再从帖子表拉取这些作者的帖子并与 TimelineEntry 按 (created_at, id) 归并。
+    """
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, "TIMELINE_FANOUT_ENABLED", False)
+
+    @staticmethod
+    def max_followers():
+        return getattr(settings, "TIMELINE_FANOUT_MAX_FOLLOWERS", 1000)
+
+    @staticmethod
+    def is_high_follower(user):
+        return user.follower_count > TimelineService.max_followers()
+
+    @staticmethod
+    def dropped_below_threshold(old_count, new_count):
+        limit = TimelineService.max_followers()
+        return old_count > limit >= new_count
+
+    @staticmethod
+    def high_follower_following_ids(user):
+        """user 关注的人中粉丝数超过阈值的作者ID，只读取关注列表和反范式的粉丝数"""
+        return list(
+            user.following.filter(
+                follower_count__gt=TimelineService.max_followers()
+            ).values_list("id", flat=True)
+        )
+
+    @staticmethod
+    def _entry(user_id, post):
+        return TimelineEntry(
+            user_id=user_id,
+            post=post,
+            author_id=post.author_id,
+            created_at=post.created_at,
+        )
+
+    @staticmethod
+    def fan_out(post):
+        """发帖后写入作者本人及粉丝的关注流"""
+        if not TimelineService.enabled():
+            return
+        recipient_ids = [post.author_id]
+        if not TimelineService.is_high_follower(post.author):
+            recipient_ids += list(post.author.followers.values_list("id", flat=True))
+        TimelineEntry.objects.bulk_create(
+            [TimelineService._entry(user_id, post) for user_id in recipient_ids],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def backfill(follower, followee):
+        """关注后把对方最近的帖子补进自己的关注流"""
+        if not TimelineService.enabled() or TimelineService.is_high_follower(followee):
+            return
+        limit = getattr(settings, "TIMELINE_BACKFILL_LIMIT", 200)
+        posts = Post.objects.filter(author=followee).order_by("-created_at", "-id")[:limit]
+        TimelineEntry.objects.bulk_create(
+            [TimelineService._entry(follower.id, post) for post in posts],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def backfill_followers(author):
+        """作者的粉丝数降到阈值以下后，把最近的帖子补进所有粉丝的关注流"""
+        if not TimelineService.enabled() or TimelineService.is_high_follower(author):
+            return
+        limit = getattr(settings, "TIMELINE_BACKFILL_LIMIT", 200)
+        posts = list(Post.objects.filter(author=author).order_by("-created_at", "-id")[:limit])
+        for follower_id in author.followers.values_list("id", flat=True).iterator():
+            TimelineEntry.objects.bulk_create(
+                [TimelineService._entry(follower_id, post) for post in posts],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+
+    @staticmethod
+    def remove(follower, followee):
+        """取消关注后清理对方在自己关注流中的帖子"""
+        if not TimelineService.enabled():
+            return
+        TimelineEntry.objects.filter(user=follower, author=followee).delete()
+
+    @staticmethod
+    def rebuild(user):
+        """按当前的关注关系重建某个用户的关注流"""
+        TimelineEntry.objects.filter(user=user).delete()
+        limit = getattr(settings, "TIMELINE_BACKFILL_LIMIT", 200)
+        author_ids = [user.id] + list(
+            user.following.exclude(
+                id__in=TimelineService.high_follower_following_ids(user)
+            ).values_list("id", flat=True)
+        )
+        entries = []
+        for author_id in author_ids:
+            posts = Post.objects.filter(author_id=author_id).order_by("-created_at", "-id")[
+                :limit
+            ]
+            entries += [TimelineService._entry(user.id, post) for post in posts]
+        TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+    @staticmethod
+    def home_timeline(user, request):
+        """
+        读取一页关注流，返回 (按时间倒序的帖子列表, 下一页游标)
+
+        TimelineEntry 和高粉作者的帖子各取 page_size + 1 条，
+        归并后再截取一页，两边都只做一次索引范围扫描。
+        """
+        paginator = KeysetPagination(ordering=("-created_at", "-id"))
+        entry_paginator = KeysetPagination(ordering=("-created_at", "-post_id"))
+        page_size = paginator.get_page_size(request)
+        cursor = request.query_params.get(paginator.cursor_query_param)
+
+        entries = TimelineEntry.objects.filter(user=user)
+        high_follower_ids = TimelineService.high_follower_following_ids(user)
+        pulled = Post.objects.filter(author_id__in=high_follower_ids)
+        if cursor:
+            position = paginator.decode_cursor(cursor, Post)
+            entries = entries.filter(entry_paginator.build_filter(position))
+            pulled = pulled.filter(paginator.build_filter(position))
+
+        candidates = {}
+        for created_at, post_id in entries.order_by("-created_at", "-post_id").values_list(
+            "created_at", "post_id"
+        )[: page_size + 1]:
+            candidates[post_id] = created_at
+        if high_follower_ids:
+            for created_at, post_id in pulled.order_by("-created_at", "-id").values_list(
+                "created_at", "id"
+            )[: page_size + 1]:
+                candidates[post_id] = created_at
+
+        merged = sorted(
+            ((created_at, post_id) for post_id, created_at in candidates.items()),
+            reverse=True,
+        )
+        page = merged[:page_size]
+        next_cursor = None
+        if len(merged) > page_size:
+            next_cursor = paginator.encode_cursor(page[-1])
+
+        posts = Post.objects.select_related("author").in_bulk([post_id for _, post_id in page])
+        return [posts[post_id] for _, post_id in page if post_id in posts], next_cursor
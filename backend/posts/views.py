@@ -8,11 +8,17 @@ from .models import Post, Comment
 from interactions.models import Like, Notification
 from interactions.models import Like
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
 from rest_framework.parsers import MultiPartParser, FormParser
-from interactions.services import NotificationService
-from rest_framework import filters,generics
+from interactions.tasks import create_comment_notification, create_like_notification
+from rest_framework import generics
 from .serializers import PostSerializer, CommentSerializer
+from .feed import FeedAssembler
+from .services import PostCounterService
+from .tasks import fan_out
+from .timeline import TimelineService
+from .search import get_search_backend
+from myproject.pagination import KeysetPagination, get_page_params
 
 # Create your views here.
 User = get_user_model()
@@ -29,76 +35,95 @@ class SearchView(APIView):
             return Response({"results": {"posts": [], "users": []}})
 
         results = {"posts": [], "users": []}
+        page, page_size = get_page_params(request)
+        offset = (page - 1) * page_size
+        backend = get_search_backend()
+        has_next = False
 
         if search_type in ["all", "posts"]:
-            # 搜索帖子
-            post_queryset = Post.objects.filter(
-                models.Q(content__icontains=query)
-                | models.Q(author__username__icontains=query)
-            ).distinct()
-            post_serializer = PostSerializer(
-                post_queryset, many=True, context={"request": request}
+            # 搜索帖子，多取一条用来判断是否有下一页
+            post_ids = backend.search_posts(query, offset, page_size + 1)
+            has_next = has_next or len(post_ids) > page_size
+            results["posts"] = FeedAssembler(request).serialize(
+                ordered_by_ids(Post.objects.select_related("author"), post_ids[:page_size])
             )
-            results["posts"] = post_serializer.data
 
         if search_type in ["all", "users"]:
             # 搜索用户
-            user_queryset = User.objects.filter(
-                models.Q(username__icontains=query) | models.Q(bio__icontains=query)
-            ).distinct()
-            from accounts.serializers import UserSeralizers
-
-            user_serializer = UserSeralizers(
-                user_queryset, many=True, context={"request": request}
+            from accounts.serializers import UserSerializer
+
+            user_ids = backend.search_users(query, offset, page_size + 1)
+            has_next = has_next or len(user_ids) > page_size
+            user_serializer = UserSerializer(
+                ordered_by_ids(User.objects.all(), user_ids[:page_size]),
+                many=True,
+                context={"request": request},
             )
             results["users"] = user_serializer.data
 
-        return Response({"results": results, "query": query})
+        return Response(
+            {"results": results, "query": query, "page": page, "has_next": has_next}
+        )
 
 
 class PostSearchView(generics.ListAPIView):
     serializer_class = PostSerializer
     permission_classes=[IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['content', 'author__username',]
-    ordering_fields = ['created_at', 'updated_at']
-    ordering = ['-created_at']
-    def get_queryset(self):
-        queryset = Post.objects.all()
-        query = self.request.query_params.get('search', None)
-        if query:
-            queryset = queryset.filter(
-                models.Q(content__icontains=query) |
-                models.Q(author__username__icontains=query)
-            ).distinct()
-        return queryset
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('search', '').strip()
+        if not query:
+            return Response([])
+        # 按相关度排序，page / page_size 分页
+        page, page_size = get_page_params(request)
+        post_ids = get_search_backend().search_posts(query, (page - 1) * page_size, page_size)
+        posts = ordered_by_ids(FeedAssembler.prepare_queryset(Post.objects.all()), post_ids)
+        return Response(FeedAssembler(request).serialize(posts))
 
 
 
 
+def ordered_by_ids(queryset, ids):
+    """按搜索后端给出的主键顺序取出对象"""
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
 class PostListView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser)  # 添加解析器以处理文件上传
 
     def get(self, request):
         show_all = request.query_params.get("all", "false").lower() == "true"
+        if not show_all and request.user.is_authenticated and TimelineService.enabled():
+            # 已物化的关注流
+            page, next_cursor = TimelineService.home_timeline(request.user, request)
+            return Response(
+                {"results": FeedAssembler(request).serialize(page), "next": next_cursor}
+            )
+
         if show_all:
             posts = Post.objects.all()
         elif request.user.is_authenticated:
-            following = request.user.following.all()
+            # 用子查询代替 JOIN，避免 DISTINCT
+            following_ids = request.user.following.values("id")
             posts = Post.objects.filter(
-                models.Q(author__in=following) | models.Q(author=request.user)
-            ).distinct()
+                models.Q(author_id__in=following_ids) | models.Q(author=request.user)
+            )
         else:
             posts = Post.objects.all()
 
-        serializer = PostSerializer(posts, many=True, context={"request": request})
-        return Response(serializer.data)
+        # 按 (created_at, id) 做游标分页，每页条数有上限
+        paginator = KeysetPagination(ordering=("-created_at", "-id"))
+        page = paginator.paginate_queryset(FeedAssembler.prepare_queryset(posts), request)
+        return paginator.get_paginated_response(FeedAssembler(request).serialize(page))
 
     def post(self, request):
         serializer = PostSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
-            serializer.save(author=request.user)
+            post = serializer.save(author=request.user)
+            if TimelineService.enabled():
+                fan_out.delay(post.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -109,9 +134,8 @@ class PostDetailView(APIView):
 
     def get(self, request, pk):
         try:
-            post = Post.objects.get(pk=pk)
-            serializer = PostSeiralizer(post, context={"request": request})
-            return Response(serializer.data)
+            post = FeedAssembler.prepare_queryset(Post.objects.all()).get(pk=pk)
+            return Response(FeedAssembler(request).serialize(post, many=False))
         except Post.DoesNotExist:
             return Response(
                 {"error": "Post not found"}, status=status.HTTP_404_NOT_FOUND
@@ -171,12 +195,11 @@ class CommentView(APIView):
             
             if serializer.is_valid():
 
-                comment = serializer.save(post=post)
-
-                if comment.parent and comment.parent.author != request.user:
-                    pass
-                elif not comment.parent and post.author != request.user:
-                    NotificationService.create_comment_notification(comment)
+                with transaction.atomic():
+                    comment = serializer.save(post=post)
+                    PostCounterService.comment_added(comment)
+                    if not comment.parent and post.author != request.user:
+                        create_comment_notification.delay(comment.id)
 
                 response_serializer = CommentSerializer(comment, context={"request": request})
                 return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -196,7 +219,9 @@ class CommentView(APIView):
                     {"error": "You do not have permission to delete this comment"},
                     status=status.HTTP_403_FORBIDDEN,
                 )
-            comment.delete()
+            with transaction.atomic():
+                PostCounterService.comment_removed(comment)
+                comment.delete()
             return Response({"message": "Comment deleted successfully"})
         except Post.DoesNotExist:
             return Response(
@@ -212,16 +237,19 @@ class LikeView(APIView):
     def post(self, request, pk):
         try:
             post = Post.objects.get(pk=pk)
-            like, created = Like.objects.get_or_create(user=request.user, post=post)
-            if not created:
-                like.delete()
-                liked = False
-            else:
-                liked = True
-                if post.author != request.user:
-                    NotificationService.create_like_notification(like)
+            with transaction.atomic():
+                like, created = Like.objects.get_or_create(user=request.user, post=post)
+                if not created:
+                    like.delete()
+                    PostCounterService.like_removed(post)
+                    liked = False
+                else:
+                    PostCounterService.like_added(post)
+                    liked = True
+                    if post.author != request.user:
+                        create_like_notification.delay(like.id)
             # 返回当前点赞状态和数量
-            likes_count = post.likes.count()
+            likes_count = PostCounterService.get_like_count(post)
             return Response(
                 {
                     "message": "Liked" if liked else "Unliked",
@@ -237,14 +265,12 @@ class LikeView(APIView):
     def delete(self, request, pk):
         try:
             post = Post.objects.get(pk=pk)
-            like = Like.objects.filter(user=request.user, post=post)
-            if like.exists():
-                like.delete()
-                liked = False
-            else:
-                liked = False
+            with transaction.atomic():
+                deleted, _ = Like.objects.filter(user=request.user, post=post).delete()
+                PostCounterService.like_removed(post, deleted)
+            liked = False
             # 返回当前点赞状态和数量
-            likes_count = post.likes.count()
+            likes_count = PostCounterService.get_like_count(post)
             return Response(
                 {"message": "Unliked", "liked": liked, "likes_count": likes_count}
             )
@@ -258,9 +284,8 @@ class UserPostsView(APIView):
     def get(self, request, pk):
         try:
             user = User.objects.get(pk=pk)
-            posts = Post.objects.filter(author=user)
-            serializer = PostSerializer(posts, many=True, context={"request": request})
-            return Response(serializer.data)
+            posts = FeedAssembler.prepare_queryset(Post.objects.filter(author=user))
+            return Response(FeedAssembler(request).serialize(posts))
         except User.DoesNotExist:
             return Response(
                 {"error": "User not found"}, status=status.HTTP_404_NOT_FOUND
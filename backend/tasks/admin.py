@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ["name", "status", "attempts", "run_at", "created_at", "updated_at"]
+    list_filter = ["status", "name"]
+    search_fields = ["name", "error"]
+    readonly_fields = ["created_at", "updated_at", "locked_at", "result", "error"]
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tasks.queue import TaskQueue
+
+
+class Command(BaseCommand):
+    help = '启动本地后台任务 worker，循环领取并执行到期的任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='处理完当前到期的任务后退出')
+        parser.add_argument('--batch-size', type=int, default=10, help='每次领取的任务数')
+        parser.add_argument(
+            '--queue',
+            action='append',
+            dest='queues',
+            help='只领取指定队列的任务，可以重复指定；不指定时领取所有队列',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'TASKS_POLL_INTERVAL', 1),
+            help='队列为空时的轮询间隔（秒）',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        purged_at = 0
+        try:
+            while True:
+                # 每小时清理一次完成超过保留天数的任务
+                if time.monotonic() - purged_at >= 3600:
+                    TaskQueue.purge_finished()
+                    purged_at = time.monotonic()
+                TaskQueue.requeue_stale()
+                count = TaskQueue.run_pending(options['batch_size'], options['queues'])
+                total += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'共执行 {total} 个任务'))
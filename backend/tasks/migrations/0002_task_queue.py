@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-17 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tasks", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="queue",
+            field=models.CharField(default="default", max_length=50),
+        ),
+        migrations.RemoveIndex(
+            model_name="task",
+            name="task_status_run_at_idx",
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                fields=["queue", "status", "run_at"], name="task_queue_status_run_at_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,62 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """
+    后台任务队列中的一条任务
+
+    任务和业务数据写在同一个数据库事务中，业务回滚时任务也不会被执行。
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    )
+
+    # 任务ID会返回给客户端用于查询结果，使用 UUID 避免被遍历
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=200)
+    # 任务所在的队列，worker 可以只领取指定队列的任务
+    queue = models.CharField(max_length=50, default="default")
+    # 发起任务的用户，只有他能查询任务结果；系统内部的任务为空
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="tasks",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["run_at"]
+        indexes = [
+            models.Index(
+                fields=["queue", "status", "run_at"], name="task_queue_status_run_at_idx"
+            ),
+            # purge_finished 按状态和完成时间清理
+            models.Index(fields=["status", "updated_at"], name="task_status_updated_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
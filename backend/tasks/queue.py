@@ -0,0 +1,213 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+from .signals import tasks_finished
+
+logger = logging.getLogger(__name__)
+
+# 任务名 -> 任务函数，由 @task 装饰器在各应用的 tasks.py 中注册
+registry = {}
+
+DEFAULT_QUEUE = "default"
+
+
+def task(name=None, max_attempts=3, queue=DEFAULT_QUEUE, atomic=True, batch=False):
+    """
+    把函数注册为后台任务
+
+    注册后可以用 func.delay(*args, **kwargs) 入队，参数和返回值必须能被 JSON 序列化，
+    所以任务参数传对象ID而不是模型实例。结果要返回给用户查询的任务用
+    func.delay_for(user, *args, **kwargs) 入队，任务记录发起的用户。
+    queue 为任务所在的队列，耗时长的任务（如调用外部接口）放到单独的队列，由单独的 worker 执行，
+    不会挡住通知等短任务；atomic=False 时任务不在事务中执行，需要自己管理事务，
+    等待外部接口期间不会占着数据库事务。
+    batch=True 时 worker 把同一批领取到的同名任务合并为一次调用，函数收到 [(args, kwargs), ...]，
+    返回与之等长的结果列表（或 None）；这一组任务在同一个事务中一起成功或一起重试。
+    """
+
+    def decorator(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        registry[task_name] = func
+        func.task_name = task_name
+        func.atomic = atomic
+        func.batch = batch
+        func.delay = lambda *args, **kwargs: TaskQueue.enqueue(
+            task_name, args, kwargs, max_attempts=max_attempts, queue=queue
+        )
+        func.delay_for = lambda owner, *args, **kwargs: TaskQueue.enqueue(
+            task_name, args, kwargs, max_attempts=max_attempts, queue=queue, owner=owner
+        )
+        return func
+
+    return decorator
+
+
+class TaskQueue:
+    @staticmethod
+    def eager():
+        """同步模式下任务在当前事务提交后立即执行，不需要启动 worker"""
+        return getattr(settings, "TASKS_EAGER", False)
+
+    @staticmethod
+    def retry_delay(attempts):
+        """第 n 次失败后按指数退避推迟重试"""
+        base = getattr(settings, "TASKS_RETRY_DELAY", 10)
+        return timedelta(seconds=base * 2 ** (attempts - 1))
+
+    @staticmethod
+    def enqueue(name, args=(), kwargs=None, max_attempts=3, queue=DEFAULT_QUEUE, owner=None):
+        """
+        写入一条任务
+
+        任务行和调用方的业务写入处于同一事务中；同步模式下在事务提交后执行。
+        """
+        task = Task.objects.create(
+            name=name,
+            args=list(args),
+            kwargs=kwargs or {},
+            max_attempts=max_attempts,
+            queue=queue,
+            owner=owner,
+        )
+        if TaskQueue.eager():
+            transaction.on_commit(lambda: TaskQueue.run_eager(task))
+        return task
+
+    @staticmethod
+    def run_eager(task):
+        """同步模式没有 worker 负责重试，失败后立即重试直到次数用完"""
+        while task.status != Task.SUCCEEDED and task.attempts < task.max_attempts:
+            task.attempts += 1
+            task.status = Task.RUNNING
+            task.locked_at = timezone.now()
+            TaskQueue.execute(task, retry_at=task.locked_at)
+        tasks_finished.send(sender=TaskQueue)
+
+    @staticmethod
+    def claim(batch_size=10, queues=None):
+        """
+        领取一批到期的任务，queues 为空时领取所有队列的任务
+
+        用带状态条件的 UPDATE 抢占，多个 worker 同时领取同一条任务时只有一个会成功，
+        不依赖 SELECT ... FOR UPDATE SKIP LOCKED，SQLite 下同样可用。
+        """
+        now = timezone.now()
+        candidates = Task.objects.filter(status=Task.PENDING, run_at__lte=now)
+        if queues:
+            candidates = candidates.filter(queue__in=queues)
+        candidate_ids = list(
+            candidates.order_by("run_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        claimed = []
+        for task_id in candidate_ids:
+            updated = Task.objects.filter(pk=task_id, status=Task.PENDING).update(
+                status=Task.RUNNING, locked_at=now, attempts=F("attempts") + 1
+            )
+            if updated:
+                claimed.append(task_id)
+        return list(Task.objects.filter(pk__in=claimed).order_by("run_at"))
+
+    @staticmethod
+    def execute(task, retry_at=None):
+        """执行一条已领取的任务并记录结果，失败时按剩余次数安排重试或标记失败"""
+        return TaskQueue.execute_many([task], retry_at)[0]
+
+    @staticmethod
+    def execute_many(tasks, retry_at=None):
+        """
+        执行一组已领取的同名任务
+
+        批量任务一次调用处理整组，普通任务只能传入一条。
+        """
+        name = tasks[0].name
+        func = registry.get(name)
+        try:
+            if func is None:
+                raise LookupError(f"未注册的任务: {name}")
+            if func.batch:
+                call = lambda: func([(task.args, task.kwargs) for task in tasks])
+            else:
+                call = lambda: [func(*tasks[0].args, **tasks[0].kwargs)]
+            if func.atomic:
+                with transaction.atomic():
+                    results = call()
+            else:
+                results = call()
+        except Exception:
+            error = traceback.format_exc()
+            for task in tasks:
+                task.error = error
+                if task.attempts < task.max_attempts:
+                    task.status = Task.PENDING
+                    task.run_at = retry_at or timezone.now() + TaskQueue.retry_delay(
+                        task.attempts
+                    )
+                else:
+                    task.status = Task.FAILED
+            if any(task.status == Task.FAILED for task in tasks):
+                logger.error("任务 %s 重试次数用完", name, exc_info=True)
+            else:
+                logger.warning("任务 %s 执行失败，将重试", name, exc_info=True)
+        else:
+            for task, result in zip(tasks, results or [None] * len(tasks)):
+                task.status = Task.SUCCEEDED
+                task.result = result
+                task.error = ""
+        for task in tasks:
+            task.locked_at = None
+            task.save(
+                update_fields=[
+                    "status",
+                    "attempts",
+                    "run_at",
+                    "locked_at",
+                    "result",
+                    "error",
+                    "updated_at",
+                ]
+            )
+        return tasks
+
+    @staticmethod
+    def requeue_stale():
+        """worker 中途退出时任务会停在 running，超过锁定时间后放回队列"""
+        timeout = getattr(settings, "TASKS_LOCK_TIMEOUT", 300)
+        return Task.objects.filter(
+            status=Task.RUNNING,
+            locked_at__lt=timezone.now() - timedelta(seconds=timeout),
+        ).update(status=Task.PENDING, locked_at=None)
+
+    @staticmethod
+    def run_pending(batch_size=10, queues=None):
+        """领取并执行一批任务，返回本次执行的任务数"""
+        tasks = TaskQueue.claim(batch_size, queues)
+        # 批量任务按任务名分组一起执行，其余任务逐条执行
+        groups = {}
+        for task in tasks:
+            func = registry.get(task.name)
+            key = task.name if func is not None and func.batch else task.id
+            groups.setdefault(key, []).append(task)
+        for group in groups.values():
+            TaskQueue.execute_many(group)
+        if tasks:
+            tasks_finished.send(sender=TaskQueue)
+        return len(tasks)
+
+    @staticmethod
+    def purge_finished(days=None):
+        """删除完成超过保留天数的任务，返回删除的条数"""
+        if days is None:
+            days = getattr(settings, "TASKS_RETENTION_DAYS", 7)
+        deleted, _ = Task.objects.filter(
+            status__in=[Task.SUCCEEDED, Task.FAILED],
+            updated_at__lt=timezone.now() - timedelta(days=days),
+        ).delete()
+        return deleted
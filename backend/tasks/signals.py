@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# worker 执行完一批任务（同步模式下为每个任务）后发送，各应用在此写入缓冲的数据
+tasks_finished = Signal()
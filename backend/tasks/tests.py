@@ -0,0 +1,196 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from interactions.models import Notification
+from posts.models import Post
+from .models import Task
+from .queue import TaskQueue, task
+
+calls = []
+
+
+@task(name="tests.record")
+def record(value):
+    calls.append(value)
+    return value
+
+
+@task(name="tests.flaky", max_attempts=2)
+def flaky(value):
+    calls.append(value)
+    raise RuntimeError("boom")
+
+
+@task(name="tests.slow", queue="slow", atomic=False)
+def slow(value):
+    calls.append(value)
+    return value
+
+
+@task(name="tests.batch", max_attempts=2, batch=True)
+def batch(items):
+    values = [args[0] for args, _ in items]
+    calls.append(values)
+    if None in values:
+        raise RuntimeError("boom")
+    return values
+
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@override_settings(TASKS_EAGER=False, TASKS_RETRY_DELAY=0)
+class TaskQueueTests(TestCase):
+    """任务随事务写入，由 worker 领取执行并在失败时重试"""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_rollback_discards_task(self):
+        try:
+            with transaction.atomic():
+                record.delay(1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Task.objects.exists())
+
+    def test_worker_runs_pending_tasks(self):
+        queued = record.delay(1)
+        call_command("run_tasks", once=True, stdout=StringIO())
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.SUCCEEDED)
+        self.assertEqual(queued.result, 1)
+        self.assertEqual(calls, [1])
+
+    def test_task_is_claimed_once(self):
+        record.delay(1)
+        self.assertEqual(len(TaskQueue.claim()), 1)
+        self.assertEqual(TaskQueue.claim(), [])
+
+    def test_queues_are_claimed_separately(self):
+        record.delay(1)
+        queued = slow.delay(2)
+        self.assertEqual([t.name for t in TaskQueue.claim(queues=["default"])], ["tests.record"])
+        self.assertEqual(TaskQueue.claim(queues=["default"]), [])
+        self.assertEqual(TaskQueue.run_pending(queues=["slow"]), 1)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.SUCCEEDED)
+
+    def test_failed_task_retries_then_fails(self):
+        queued = flaky.delay(1)
+        TaskQueue.run_pending()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.PENDING)
+        self.assertEqual(queued.attempts, 1)
+
+        TaskQueue.run_pending()
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.FAILED)
+        self.assertIn("boom", queued.error)
+        self.assertEqual(calls, [1, 1])
+
+    def test_batch_tasks_run_in_one_call(self):
+        first, second = batch.delay(1), batch.delay(2)
+        record.delay(3)
+        self.assertEqual(TaskQueue.run_pending(), 3)
+        self.assertIn([1, 2], calls)
+        for queued, value in ((first, 1), (second, 2)):
+            queued.refresh_from_db()
+            self.assertEqual(queued.status, Task.SUCCEEDED)
+            self.assertEqual(queued.result, value)
+
+    def test_batch_failure_retries_whole_group(self):
+        queued = [batch.delay(1), batch.delay(None)]
+        TaskQueue.run_pending()
+        for item in queued:
+            item.refresh_from_db()
+            self.assertEqual(item.status, Task.PENDING)
+            self.assertIn("boom", item.error)
+
+        TaskQueue.run_pending()
+        for item in queued:
+            item.refresh_from_db()
+            self.assertEqual(item.status, Task.FAILED)
+        self.assertEqual(calls, [[1, None], [1, None]])
+
+
+@override_settings(TASKS_EAGER=True, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class EagerTaskTests(TestCase):
+    """同步模式下任务在事务提交后立即执行"""
+
+    def setUp(self):
+        calls.clear()
+        self.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password"
+        )
+        self.liker = User.objects.create_user(
+            username="liker", email="liker@example.com", password="password"
+        )
+        self.post = Post.objects.create(author=self.author, content="post")
+
+    def test_runs_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            queued = record.delay(1)
+            self.assertEqual(calls, [])
+        self.assertEqual(queued.status, Task.SUCCEEDED)
+        self.assertEqual(calls, [1])
+
+    def test_like_notification_is_enqueued(self):
+        client = APIClient()
+        client.force_authenticate(self.liker)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f"/api/posts/{self.post.id}/like/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            Task.objects.filter(
+                name="interactions.tasks.create_like_notification",
+                status=Task.SUCCEEDED,
+            ).exists()
+        )
+        self.assertTrue(
+            Notification.objects.filter(
+                recipient=self.author, actor=self.liker, notification_type="like"
+            ).exists()
+        )
+
+
+@override_settings(TASKS_EAGER=False)
+class TaskAccessTests(TestCase):
+    """任务结果只有发起的用户能查询，完成的任务过期后清理"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username="owner", email="owner@example.com", password="password"
+        )
+        self.other = User.objects.create_user(
+            username="other", email="other@example.com", password="password"
+        )
+        self.client = APIClient()
+
+    def test_only_owner_can_read(self):
+        queued = record.delay_for(self.owner, 1)
+        url = f"/api/tasks/{queued.id}/"
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], Task.PENDING)
+
+    def test_purge_finished(self):
+        old = timezone.now() - timedelta(days=30)
+        finished = record.delay(1)
+        pending = record.delay(2)
+        Task.objects.filter(pk__in=[finished.pk, pending.pk]).update(updated_at=old)
+        Task.objects.filter(pk=finished.pk).update(status=Task.SUCCEEDED)
+        self.assertEqual(TaskQueue.purge_finished(days=7), 1)
+        self.assertEqual(list(Task.objects.values_list("pk", flat=True)), [pending.pk])
@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import TaskDetailView
+
+urlpatterns = [
+    path("<uuid:pk>/", TaskDetailView.as_view(), name="task-detail"),
+]
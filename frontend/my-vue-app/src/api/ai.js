@@ -1,5 +1,26 @@
 import { api } from "./index";
 
+const TASK_POLL_INTERVAL = 1000;
+// 超过这个时间（毫秒）任务仍未结束时不再等待
+const TASK_TIMEOUT = 120000;
+
+// AI 请求由后台任务执行，接口返回任务信息，这里轮询到任务结束后返回结果
+const waitForTask = async (task) => {
+  const deadline = Date.now() + TASK_TIMEOUT;
+  while (task.status === "pending" || task.status === "running") {
+    if (Date.now() >= deadline) {
+      return { status: "error", message: "AI任务超时，请稍后重试" };
+    }
+    await new Promise((resolve) => setTimeout(resolve, TASK_POLL_INTERVAL));
+    const response = await api.get(`/tasks/${task.id}/`);
+    task = response.data;
+  }
+  if (task.status === "succeeded") {
+    return task.result;
+  }
+  return { status: "error", message: "AI任务执行失败" };
+};
+
 export const generateText = async (
   prompt,
   temperature = 0.7,
@@ -13,7 +34,7 @@ export const generateText = async (
       max_tokens: maxTokens,
       model,
     });
-    return response.data;
+    return await waitForTask(response.data);
   } catch (error) {
     console.error("AI服务调用失败:", error);
     throw error;
@@ -33,7 +54,7 @@ export const chatCompletion = async (
       temperature,
       max_tokens: maxTokens,
     });
-    return response.data;
+    return await waitForTask(response.data);
   } catch (error) {
     console.error("AI对话服务调用失败:", error);
     throw error;
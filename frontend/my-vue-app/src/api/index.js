@@ -62,8 +62,9 @@ export const authAPI = {
 
 // 帖子相关API
 export const postAPI = {
-  getPosts: () => api.get("/posts/"),
-  getAllPosts: () => api.get("/posts/?all=true"),
+  getPosts: (params = {}) => api.get("/posts/", { params }),
+  getAllPosts: (params = {}) =>
+    api.get("/posts/", { params: { ...params, all: true } }),
   getPost: (id) => api.get(`/posts/${id}/`),
   createPost: (postData) => api.post("/posts/", postData),
   updatePost: (id, postData) => api.put(`/posts/${id}/`, postData),
@@ -89,7 +90,8 @@ export const likeAPI = {
 
 // 通知相关API
 export const notificationAPI = {
-  getNotifications: () => api.get("/interactions/notifications/"),
+  getNotifications: (params = {}) =>
+    api.get("/interactions/notifications/", { params }),
   markAsRead: (notificationId) =>
     api.post(`/interactions/notifications/${notificationId}/read/`),
   markAllAsRead: () => api.post("/interactions/notifications/read-all/"),
@@ -111,9 +113,11 @@ export const searchAPI = {
 // 消息相关API
 export const messageAPI = {
   getConversations: () => api.get("/messages/conversations/"),
-  getMessages: (userId, page = 1, pageSize = 20) =>
+  getMessages: (userId, beforeId = null, pageSize = 20) =>
     api.get(`/messages/conversations/${userId}/`, {
-      params: { page, page_size: pageSize },
+      params: beforeId
+        ? { before_id: beforeId, page_size: pageSize }
+        : { page_size: pageSize },
     }),
   sendMessage: (messageData) => api.post("/messages/messages/", messageData),
   updateMessage: (messageId, messageData) =>
@@ -122,6 +126,12 @@ export const messageAPI = {
   revokeMessage: (messageId) =>
     api.patch(`/messages/messages/${messageId}/revoke/`),
   markAsRead: (messageId) => api.patch(`/messages/messages/${messageId}/read/`),
+  // 已读水位：conversation 中 messageId 及之前的消息全部已读
+  markConversationRead: (conversation, messageId) =>
+    api.post("/messages/read/", { conversation, message_id: messageId }),
+  // 增量同步：conversations 为 { 会话: 已有的最大序号 }，返回之后新增、编辑和撤回的消息
+  syncMessages: (conversations) =>
+    api.post("/messages/sync/", { conversations }),
 
   // 群聊相关API
   getGroupChat: (groupId) => api.get(`/messages/group-chats/${groupId}/`),
@@ -130,7 +140,7 @@ export const messageAPI = {
   },
   getGroupMessages: (groupId) =>
     api.get(`/messages/group-messages/`, {
-      params: { group_id: groupId },
+      params: { group_id: groupId, page_size: 50 },
     }),
   addGroupMember: (groupId, userId) =>
     api.post(`/messages/group-chats/${groupId}/add_member/`, {
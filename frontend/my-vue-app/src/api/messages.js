@@ -71,7 +71,7 @@ export const createGroupChat = (groupData) => {
 
 export const getGroupMessages = (groupId) => {
   return api.get(`/messages/group-messages/`, {
-    params: { group_id: groupId }
+    params: { group_id: groupId, page_size: 50 }
   })
 }
 
@@ -8,6 +8,10 @@ class WebSocketService {
     this.listeners = {};
     this.pingInterval = null;
     this.isConnecting = false;
+    // 当前正在查看的群聊，只订阅这些群的消息，其余群只收到新消息提示
+    this.activeGroups = new Set();
+    // 每个会话最后收到的消息序号，重连后据此补发错过的消息
+    this.lastSeq = {};
   }
 
   connect() {
@@ -28,7 +32,9 @@ class WebSocketService {
     // 使用环境变量或默认值构建WebSocket URL
     const wsBaseUrl = import.meta.env.VITE_WS_BASE_URL || 
                      (window.location.protocol === 'https:' ? 'wss://' : 'ws://') + window.location.host;
-    const wsUrl = `${wsBaseUrl}/ws/chat/?token=${token}`;
+    // batch=1：服务端把短时间内的多个事件合并为一帧推送
+    // groups=lazy：只订阅 subscribeGroup 标记的群聊
+    const wsUrl = `${wsBaseUrl}/ws/chat/?token=${token}&batch=1&groups=lazy`;
     console.log('Connecting to WebSocket:', wsUrl);
     
     try {
@@ -42,6 +48,16 @@ class WebSocketService {
         
         // 启动心跳检测
         this.startPing();
+
+        // 重连后恢复之前订阅的群聊
+        this.activeGroups.forEach(groupId => {
+          this.socket.send(JSON.stringify({ type: 'subscribe_group', group_id: groupId }));
+        });
+
+        // 补发断线期间错过的消息
+        if (Object.keys(this.lastSeq).length > 0) {
+          this.socket.send(JSON.stringify({ type: 'resume', conversations: this.lastSeq }));
+        }
         
         this.emit('connected');
       };
@@ -49,7 +65,17 @@ class WebSocketService {
       this.socket.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
-          this.emit('message', data);
+          const events = data.type === 'batch' ? data.events : [data];
+          events.forEach(item => {
+            if (item.conversation && item.seq) {
+              this.lastSeq[item.conversation] = Math.max(this.lastSeq[item.conversation] || 0, item.seq);
+            }
+            if (item.type === 'resync_required') {
+              // 事件日志无法覆盖，需要重新拉取该会话
+              this.emit('resync', item.conversation);
+            }
+            this.emit('message', item);
+          });
         } catch (error) {
           console.error('Error parsing WebSocket message:', error);
         }
@@ -131,10 +157,12 @@ class WebSocketService {
     }
   }
 
-  markAsRead(messageId) {
+  // 已读到 conversation 中的 messageId，服务端移动已读水位并合并推送回执
+  markAsRead(messageId, conversation = null) {
     if (this.isConnected && this.socket) {
       const message = {
         type: 'read',
+        conversation: conversation,
         message_id: messageId
       };
       this.socket.send(JSON.stringify(message));
@@ -143,6 +171,21 @@ class WebSocketService {
     }
   }
 
+  // 订阅群聊消息，连接建立后会自动恢复
+  subscribeGroup(groupId) {
+    this.activeGroups.add(groupId);
+    if (this.isConnected && this.socket) {
+      this.socket.send(JSON.stringify({ type: 'subscribe_group', group_id: groupId }));
+    }
+  }
+
+  unsubscribeGroup(groupId) {
+    this.activeGroups.delete(groupId);
+    if (this.isConnected && this.socket) {
+      this.socket.send(JSON.stringify({ type: 'unsubscribe_group', group_id: groupId }));
+    }
+  }
+
   // 心跳检测
   startPing() {
     this.pingInterval = setInterval(() => {
@@ -65,7 +65,7 @@ export const useMainStore = defineStore("main", {
     async fetchNotifications() {
       try {
         const response = await notificationAPI.getNotifications();
-        this.notifications = response.data;
+        this.notifications = response.data.results;
       } catch (error) {
         console.error("Error fetching notifications:", error);
       }
@@ -126,54 +126,39 @@ export const useMainStore = defineStore("main", {
       }
     },
 
-    async fetchConversation(userId, page = 1, pageSize = 20) {
+    async fetchConversation(userId, beforeId = null, pageSize = 20) {
       try {
-        const response = await messageAPI.getMessages(userId, page, pageSize);
+        const response = await messageAPI.getMessages(userId, beforeId, pageSize);
+        const results = response.data.results || [];
+        // 结果从新到旧，最后一条是下一次向上翻页的游标
+        const pagination = {
+          has_more: response.data.has_more || false,
+          before_id: results.length ? results[results.length - 1].id : beforeId,
+        };
 
-        if (page === 1) {
+        if (!beforeId) {
           // 第一页，替换所有消息
           this.currentConversation = {
             userId,
-            messages: response.data.results || response.data || [],
-            pagination: {
-              count: response.data.count || 0,
-              page: response.data.page || 1,
-              page_size: response.data.page_size || 20,
-              has_next: response.data.has_next || false,
-              has_previous: response.data.has_previous || false,
-            },
+            messages: results,
+            pagination,
           };
-        } else {
-          // 后续页面，追加消息到现有列表
-          if (
-            this.currentConversation &&
-            this.currentConversation.userId === userId
-          ) {
-            this.currentConversation.messages = [
-              ...(response.data.results || response.data || []),
-              ...this.currentConversation.messages,
-            ];
-
-            // 更新分页信息
-            this.currentConversation.pagination = {
-              count: response.data.count || 0,
-              page: response.data.page || page,
-              page_size: response.data.page_size || pageSize,
-              has_next: response.data.has_next || false,
-              has_previous: response.data.has_previous || page > 1,
-            };
-          }
+        } else if (
+          this.currentConversation &&
+          this.currentConversation.userId === userId
+        ) {
+          // 更早的消息，追加到现有列表
+          this.currentConversation.messages = [
+            ...results,
+            ...this.currentConversation.messages,
+          ];
+          this.currentConversation.pagination = pagination;
         }
 
         // 标记所有未读消息为已读（仅对第一页执行）
-        if (
-          page === 1 &&
-          Array.isArray(response.data.results || response.data)
-        ) {
+        if (!beforeId) {
           // 先过滤出有效的未读消息
-          const unreadMessages = (
-            response.data.results || response.data
-          ).filter((msg) => {
+          const unreadMessages = results.filter((msg) => {
             // 确保msg对象存在且具有必要的属性
             return (
               msg &&
@@ -189,14 +174,14 @@ export const useMainStore = defineStore("main", {
             );
           });
 
-          // 逐个标记未读消息为已读
-          for (const message of unreadMessages) {
+          // 把已读水位移到最新一条未读消息，服务端一次标记整段并通知发送者
+          if (unreadMessages.length > 0) {
+            const latestId = Math.max(...unreadMessages.map((msg) => msg.id));
+            const [low, high] = [this.user.id, Number(userId)].sort((a, b) => a - b);
             try {
-              await messageAPI.markAsRead(message.id);
-              // 也通过WebSocket通知发送者
-              websocket.markAsRead(message.id);
+              await messageAPI.markConversationRead(`private:${low}:${high}`, latestId);
             } catch (error) {
-              console.error("Error marking message as read:", error);
+              console.error("Error marking messages as read:", error);
             }
           }
         }
@@ -214,10 +199,12 @@ export const useMainStore = defineStore("main", {
         this.currentConversation &&
         this.currentConversation.userId === userId &&
         this.currentConversation.pagination &&
-        this.currentConversation.pagination.has_next
+        this.currentConversation.pagination.has_more
       ) {
-        const nextPage = this.currentConversation.pagination.page + 1;
-        await this.fetchConversation(userId, nextPage);
+        await this.fetchConversation(
+          userId,
+          this.currentConversation.pagination.before_id
+        );
       }
     },
 
@@ -242,7 +229,7 @@ export const useMainStore = defineStore("main", {
 
           // 监听WebSocket响应
           const messageHandler = (data) => {
-            if (data.type === "message") {
+            if (data.type === "message" || data.type === "chat_message") {
               clearTimeout(timeout);
               websocket.off("message", messageHandler);
 
@@ -346,11 +333,23 @@ export const useMainStore = defineStore("main", {
           if (data.type === "message") {
             // 处理接收到的新消息
             this.handleIncomingMessage(data.message);
+          } else if (data.type === "notification") {
+            // 服务端推送的新通知，附带最新的未读数
+            this.handleIncomingNotification(data);
           }
         });
       }
     },
 
+    handleIncomingNotification(data) {
+      this.unreadNotificationCount = data.unread_count;
+      // 合并通知更新时同一 id 会再次推送，移到列表最前面
+      this.notifications = [
+        data.notification,
+        ...this.notifications.filter((n) => n.id !== data.notification.id),
+      ];
+    },
+
     // 处理接收到的新消息
     handleIncomingMessage(message) {
       // 更新当前对话（如果正在查看该对话）